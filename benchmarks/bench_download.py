@@ -0,0 +1,67 @@
+"""Measure single-stream download_file throughput against a local HTTP server.
+
+    python benchmarks/bench_download.py [--size MiB] [--runs N]
+
+The server keeps the file in memory and writes it in 1 MiB blocks, so the
+numbers show how fast the client side (read loop, hashing, disk writes) is.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from kemono_dl.downloader import download_file  # noqa: E402
+from kemono_dl.session import CustomSession  # noqa: E402
+
+
+def make_handler(data: bytes):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            view = memoryview(data)
+            for offset in range(0, len(data), 1024 * 1024):
+                self.wfile.write(view[offset : offset + 1024 * 1024])
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=512, help="File size in MiB")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size * 1024 * 1024)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(data))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/data/file.bin"
+
+    session = CustomSession()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for run in range(args.runs):
+            filepath = os.path.join(tmp_dir, f"file-{run}.bin")
+            wall, cpu = time.perf_counter(), time.process_time()
+            download_file(session, url, filepath)
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            os.remove(filepath)
+            print(f"run {run}: {args.size / wall:8.1f} MiB/s  wall {wall:6.2f}s  cpu {cpu:6.2f}s")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""End-to-end benchmark of whole runs against the local mock server in mock_kemono.py.
+
+    python benchmarks/bench_e2e.py [--scenario NAME ...] [--save-baseline] [--tolerance 0.25]
+
+Every scenario runs in a fresh process (the mock server in another one), so peak RSS
+belongs to the client alone. Reported per scenario: posts/s, MB/s, api calls per post
+and peak RSS. The numbers are compared with benchmarks/baselines/e2e.json and the run
+exits with status 1 when a scenario is slower, makes more api calls or uses more
+memory than its baseline allows; --save-baseline stores the current numbers instead.
+
+Throughput depends on the machine, so the baseline is not committed: record one with
+--save-baseline before changing code, then compare against it on the same machine.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baselines", "e2e.json")
+
+# name -> (mock server config, KemonoDL options, run kind, pace api calls like a real run)
+SCENARIOS = {
+    # client overhead: no latency and no rate limit, so the numbers show kemono-dl itself
+    "url-fast": ({"posts": 100, "attachments": 4, "file_size": 128 * 1024}, {"post_workers": 4, "fetch_workers": 2}, "url", False),
+    # the default rate limit against an api answering in 50ms
+    "url-paced": ({"posts": 40, "attachments": 2, "file_size": 64 * 1024, "api_latency": 0.05}, {"post_workers": 2}, "url", True),
+    # slow data server, downloads capped at 4 MiB/s each
+    "url-bandwidth": ({"posts": 8, "attachments": 4, "file_size": 1024 * 1024, "data_latency": 0.02, "bandwidth": 4 * 1024 * 1024}, {"post_workers": 2, "concurrent_downloads": 4}, "url", False),
+    # 10% of the api calls throttled with 429, 10% of the downloads failing with 503
+    "url-errors": ({"posts": 40, "attachments": 2, "file_size": 64 * 1024, "api_error_rate": 0.1, "data_error_rate": 0.1}, {"post_workers": 2}, "url", False),
+    # large files split into ranges
+    "url-segmented": ({"posts": 2, "attachments": 2, "file_size": 16 * 1024 * 1024}, {"segments": 4, "segment_threshold": 4 * 1024 * 1024}, "url", False),
+    # a favorites run over many small creators
+    "favorites": ({"creators": 12, "posts": 10, "attachments": 2, "file_size": 32 * 1024, "api_latency": 0.005}, {"post_workers": 4, "parallel_creators": 4}, "favorites", False),
+}
+
+# metric -> True when higher is better
+METRICS = {"posts_per_sec": True, "mb_per_sec": True, "api_calls_per_post": False, "peak_rss_mib": False}
+
+
+def peak_rss_mib() -> float:
+    import resource
+
+    # ru_maxrss is in KiB on linux and bytes on macos
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_scenario(name: str, results) -> None:
+    """Child process: start the mock server, run kemono-dl against it and send back the metrics."""
+    from mock_kemono import serve_forever
+
+    from kemono_dl.kemono_dl import KemonoDL
+    from kemono_dl.session import RateLimiter
+
+    server_config, options, kind, paced = SCENARIOS[name]
+    context = multiprocessing.get_context("spawn")
+    conn, server_conn = context.Pipe()
+    server = context.Process(target=serve_forever, args=(server_config, server_conn), daemon=True)
+    server.start()
+    try:
+        url = conn.recv()
+        # post urls only match the real kemono domain, so point it at the mock server
+        KemonoDL.KEMONO_DOMAIN = url
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            kemono_dl = KemonoDL(path=tmp_dir, **options)
+            if not paced:
+                kemono_dl.session.rate_limiter = RateLimiter(rate=1e6, max_rate=1e6, burst=1e6)
+
+            stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+            start = time.perf_counter()
+            try:
+                if kind == "favorites":
+                    kemono_dl.download_favorite_creators(url)
+                else:
+                    kemono_dl.download_url("https://kemono.cr/patreon/user/creator0")
+                wall = time.perf_counter() - start
+                kemono_dl.close()
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+
+            files = sum(len(filenames) for _, _, filenames in os.walk(tmp_dir))
+
+        with urllib.request.urlopen(f"{url}/__stats") as response:
+            stats = json.load(response)
+    finally:
+        conn.send("stop")
+        server.join(10)
+
+    posts = server_config.get("creators", 1) * server_config["posts"]
+    expected_files = posts * server_config["attachments"]
+    results.put(
+        {
+            "wall": wall,
+            "files": files,
+            "expected_files": expected_files,
+            "posts_per_sec": posts / wall,
+            "mb_per_sec": stats["data_bytes"] / wall / (1024 * 1024),
+            "api_calls_per_post": stats["api"] / posts,
+            "peak_rss_mib": peak_rss_mib(),
+            "api_errors": stats["api_errors"],
+            "data_errors": stats["data_errors"],
+        }
+    )
+
+
+def measure(name: str) -> dict:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=run_scenario, args=(name, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def compare(name: str, result: dict, baseline: dict | None, tolerance: float) -> list[str]:
+    if baseline is None:
+        return []
+    regressions = []
+    for metric, higher_is_better in METRICS.items():
+        if metric not in baseline:
+            continue
+        limit = baseline[metric] * (1 - tolerance if higher_is_better else 1 + tolerance)
+        if result[metric] < limit if higher_is_better else result[metric] > limit:
+            regressions.append(f"{name}: {metric} {result[metric]:.2f} vs baseline {baseline[metric]:.2f}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Run only this scenario, may be repeated")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative change before a metric counts as a regression")
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baselines = json.load(f)
+
+    print(f"{'scenario':<14} {'posts/s':>9} {'MB/s':>8} {'api/post':>9} {'rss MiB':>8} {'errors':>7} {'files':>9}")
+    regressions = []
+    for name in args.scenario or SCENARIOS:
+        result = measure(name)
+        if result["files"] != result["expected_files"]:
+            regressions.append(f"{name}: {result['files']} files written, expected {result['expected_files']}")
+        print(
+            f"{name:<14} {result['posts_per_sec']:>9.1f} {result['mb_per_sec']:>8.1f} {result['api_calls_per_post']:>9.2f} {result['peak_rss_mib']:>8.1f}"
+            f" {result['api_errors'] + result['data_errors']:>7} {result['files']:>4}/{result['expected_files']:<4}"
+        )
+        if args.save_baseline:
+            baselines[name] = {metric: round(result[metric], 3) for metric in METRICS}
+        else:
+            regressions += compare(name, result, baselines.get(name), args.tolerance)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline!r}")
+        return
+
+    if regressions:
+        print("\nRegressions:\n" + "\n".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
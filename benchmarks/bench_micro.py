@@ -0,0 +1,236 @@
+"""Micro-benchmarks of the pure python hot paths, each with a time budget.
+
+    python benchmarks/bench_micro.py [--only NAME ...] [--save-baseline] [--tolerance 0.3] [--scale X]
+
+Fixtures are synthetic and sized like the worst cases seen in practice: posts with
+1000 attachments, an archive file with a million lines and deeply nested output
+templates with custom variables. Every benchmark reports the best time per call
+over several repeats and the run exits with status 1 when one is over its budget.
+
+Budgets are counted in runs of a fixed pure python calibration loop, timed at the
+start of every run, so a slower machine gets proportionally larger budgets (`--scale`
+multiplies them further). Smaller slowdowns are caught by comparing with a baseline
+recorded with --save-baseline, stored in the same units. The baseline belongs to the
+machine that recorded it and is not committed: record one before changing code, then
+compare against it.
+"""
+
+import argparse
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+from typing import Callable, NamedTuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_parse_post import make_post_response  # noqa: E402
+
+from kemono_dl.kemono_dl import KemonoDL  # noqa: E402
+from kemono_dl.models import Creator, CustomTemplateVariables, FileTemplateVaribales, Post  # noqa: E402
+from kemono_dl.utils import generate_file_path  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baselines", "micro.json")
+
+DEEP_TEMPLATE = (
+    "{service}/{creator_name} [{creator_id}]/{published:%Y}/{published:%Y-%m}/{published:%Y-%m-%d}"
+    "/[{post_id}] {post_title}/{kind}/{size_class}/{index:04d} - {file_name} [{sha256:.8}].{file_ext}"
+)
+CUSTOM_VARIABLES = {
+    "kind": "'images' if '{file_ext}' in ('png', 'jpg', 'gif') else 'files'",
+    "size_class": "'large' if {attachments_count} > 100 else 'small'",
+}
+
+
+class Benchmark(NamedTuple):
+    name: str
+    # returns the function to time; called once, outside the timing
+    setup: Callable[[], Callable[[], object]]
+    number: int  # calls per repeat
+    budget: float  # calibration loops per call
+
+
+def calibration_loop() -> int:
+    values = {}
+    for i in range(1000):
+        key = f"key-{i}"
+        values[key] = len(key) + i
+    return sum(values.values())
+
+
+def calibrate(repeat: int) -> float:
+    """Seconds per run of `calibration_loop` on this machine, the unit of the budgets and baselines."""
+    return min(timeit.repeat(calibration_loop, number=200, repeat=repeat)) / 200
+
+
+def post_init() -> Callable[[], object]:
+    response = make_post_response(1000)
+    return lambda: Post(response)
+
+
+def creator() -> Creator:
+    return Creator("1", "Some Creator", "patreon", 0, 0, "some-creator", None, 1, 0, 0, 0)
+
+
+def to_dict() -> Callable[[], object]:
+    post = Post(make_post_response(1000))
+    template_variables = FileTemplateVaribales(creator(), post, post.attachments[-1])
+    return template_variables.toDict
+
+
+def to_dict_custom() -> Callable[[], object]:
+    post = Post(make_post_response(1000))
+    attachments = post.attachments
+    custom_variables = CustomTemplateVariables(CUSTOM_VARIABLES)
+    creator_ = creator()
+
+    def run() -> None:
+        for attachment in attachments:
+            FileTemplateVaribales(creator_, post, attachment).toDict(custom_variables)
+
+    return run
+
+
+def file_path_deep() -> Callable[[], object]:
+    post = Post(make_post_response(1000))
+    template_variables = FileTemplateVaribales(creator(), post, post.attachments[-1]).toDict(CustomTemplateVariables(CUSTOM_VARIABLES))
+    return lambda: generate_file_path("/downloads", DEEP_TEMPLATE, template_variables, True)
+
+
+def file_path_default() -> Callable[[], object]:
+    post = Post(make_post_response(1))
+    template_variables = FileTemplateVaribales(creator(), post, post.attachments[0]).toDict()
+    return lambda: generate_file_path("/downloads", KemonoDL.DEFAULT_OUTPUT_TEMPLATE, template_variables)
+
+
+def parse_url() -> Callable[[], object]:
+    kemono_dl = KemonoDL.__new__(KemonoDL)
+    urls = [
+        "https://kemono.cr/patreon/user/12345",
+        "https://coomer.st/onlyfans/user/some_creator/post/1234567890",
+        "https://kemono.cr/fanbox/user/98765/post/555",
+        "https://example.com/patreon/user/12345",
+    ] * 250
+
+    def run() -> None:
+        for url in urls:
+            kemono_dl.parse_url(url)
+
+    return run
+
+
+def post_filters() -> Callable[[], object]:
+    kemono_dl = KemonoDL.__new__(KemonoDL)
+    kemono_dl.post_filters = {
+        "date": {},
+        "datebefore": {"published": datetime(2030, 1, 1), "added": datetime(2030, 1, 1)},
+        "dateafter": {"published": datetime(2000, 1, 1), "edited": datetime(2000, 1, 1)},
+    }
+    posts = [Post(make_post_response(1)) for _ in range(1000)]
+
+    def run() -> None:
+        for post in posts:
+            kemono_dl.post_matches_filters(post)
+
+    return run
+
+
+def load_archive(lines: int) -> Callable[[], Callable[[], object]]:
+    def setup() -> Callable[[], object]:
+        tmp_dir = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, tmp_dir, ignore_errors=True)
+        path = os.path.join(tmp_dir, "archive.txt")
+        with open(path, "w") as f:
+            f.writelines(f"https://kemono.cr/patreon/user/{i % 5000}/post/{i}\n" for i in range(lines))
+        kemono_dl = KemonoDL.__new__(KemonoDL)
+        kemono_dl.archive_file = path
+
+        def run() -> None:
+            kemono_dl.load_archive_file()
+            assert len(kemono_dl.archive) == lines
+
+        return run
+
+    return setup
+
+
+def benchmarks(archive_lines: int) -> list[Benchmark]:
+    return [
+        Benchmark("post_init_1k", post_init, 20, 8),
+        Benchmark("to_dict", to_dict, 20000, 0.02),
+        Benchmark("to_dict_custom_1k", to_dict_custom, 5, 75),
+        Benchmark("file_path_default", file_path_default, 5000, 0.2),
+        Benchmark("file_path_deep", file_path_deep, 2000, 0.6),
+        Benchmark("parse_url_1k", parse_url, 50, 22),
+        Benchmark("post_filters_1k", post_filters, 50, 22),
+        Benchmark(f"load_archive_{archive_lines // 1000}k", load_archive(archive_lines), 1, 9000 * archive_lines / 1_000_000),
+    ]
+
+
+def format_time(seconds: float) -> str:
+    for unit, factor in (("s", 1), ("ms", 1e3), ("us", 1e6)):
+        if seconds >= 1 / factor:
+            return f"{seconds * factor:8.2f} {unit}"
+    return f"{seconds * 1e9:8.0f} ns"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", action="append", help="Run only benchmarks whose name starts with this, may be repeated")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every budget, for slow machines")
+    parser.add_argument("--archive-lines", type=int, default=1_000_000)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the times as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Allowed slowdown relative to the baseline")
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baselines = json.load(f)
+
+    unit = calibrate(args.repeat)
+    print(f"calibration loop: {format_time(unit).strip()}, budgets and baselines below are scaled by it\n")
+
+    failed = []
+    print(f"{'benchmark':<20} {'per call':>11} {'budget':>11} {'baseline':>11}")
+    for benchmark in benchmarks(args.archive_lines):
+        if args.only and not any(benchmark.name.startswith(name) for name in args.only):
+            continue
+        func = benchmark.setup()
+        func()  # warm up caches the way a long run would
+        best = min(timeit.repeat(func, number=benchmark.number, repeat=args.repeat)) / benchmark.number
+        budget = benchmark.budget * unit * args.scale
+        baseline = baselines[benchmark.name] * unit if benchmark.name in baselines else None
+
+        status = ""
+        if best > budget:
+            status = "  OVER BUDGET"
+        elif baseline and not args.save_baseline and best > baseline * (1 + args.tolerance):
+            status = f"  {best / baseline - 1:.0%} SLOWER"
+        print(f"{benchmark.name:<20} {format_time(best)} {format_time(budget)} {format_time(baseline) if baseline else '-':>11}{status}")
+        if status:
+            failed.append(benchmark.name)
+        if args.save_baseline:
+            baselines[benchmark.name] = best / unit
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({name: float(f"{loops:.3g}") for name, loops in baselines.items()}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline!r}")
+
+    if failed:
+        print(f"\n{len(failed)} failed: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Measure how long Post takes to parse a post response with many attachments.
+
+    python benchmarks/bench_parse_post.py [--attachments N] [--runs N]
+
+The fixture mirrors the /post endpoint: every attachment is listed in the post
+and again, with its server, in the `attachments` and `previews` arrays.
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from kemono_dl.models import Post  # noqa: E402
+
+
+def make_post_response(attachments: int) -> dict:
+    files = [{"name": f"{i:04}.png", "path": f"/{i % 256:02x}/{i // 256:02x}/{i:064x}.png"} for i in range(attachments)]
+    return {
+        "post": {
+            "id": "1",
+            "user": "1",
+            "service": "patreon",
+            "title": "benchmark",
+            "content": "",
+            "added": "2024-01-01T00:00:00",
+            "published": "2024-01-01T00:00:00",
+            "edited": "2024-01-01T00:00:00",
+            "file": files[0],
+            "attachments": files[1:],
+        },
+        "attachments": [dict(file, server="https://n1.kemono.su") for file in files if not file["name"].endswith(".png")],
+        "previews": [dict(file, server="https://n2.kemono.su", type="thumbnail") for file in files],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--attachments", type=int, default=500)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    response = make_post_response(args.attachments)
+    assert len(Post(response).attachments) == args.attachments
+
+    timings = timeit.repeat(lambda: Post(response), number=args.runs, repeat=5)
+    best = min(timings) / args.runs
+    print(f"{args.attachments} attachments: {best * 1000:8.3f} ms per post  ({best / args.attachments * 1e6:.2f} us per attachment)")
+
+
+if __name__ == "__main__":
+    main()
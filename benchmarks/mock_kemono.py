@@ -0,0 +1,267 @@
+"""A local stand-in for the kemono/coomer api and data servers, for benchmarks.
+
+Serves the endpoints kemono-dl uses:
+
+    /api/v1/account                              (always logged in)
+    /api/v1/account/favorites?type=artist
+    /api/v1/{service}/user/{id}/profile
+    /api/v1/{service}/user/{id}/posts?o=N
+    /api/v1/{service}/user/{id}/post/{post_id}
+    /data/...                                    (attachments, with optional Range support)
+    /__stats                                     (request counters as json)
+
+Latency, a per-response bandwidth cap and injected 429/503 errors are configured
+through MockConfig. File contents are generated from the seed, so every run serves
+the same bytes.
+"""
+
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+POST_STEP_SIZE = 50
+
+
+@dataclass
+class MockConfig:
+    creators: int = 1
+    posts: int = 20  # per creator
+    attachments: int = 3  # per post
+    file_size: int = 256 * 1024
+    api_latency: float = 0.0  # seconds before every api response
+    data_latency: float = 0.0  # seconds before every data response
+    bandwidth: int = 0  # bytes/s per data response, 0 for no cap
+    range_support: bool = True
+    api_error_rate: float = 0.0  # fraction of api requests answered with 429
+    data_error_rate: float = 0.0  # fraction of data requests answered with 503
+    seed: int = 1
+
+
+class MockKemono:
+    def __init__(self, config: MockConfig) -> None:
+        self.config = config
+        self.url = ""
+        self.files: dict[str, bytes] = {}
+        self.creators: dict[str, list[dict]] = {}
+        self.stats = {"api": 0, "data": 0, "data_bytes": 0, "api_errors": 0, "data_errors": 0}
+        self._random = random.Random(config.seed)
+        self._lock = threading.Lock()
+
+    def build(self) -> None:
+        """Generate the creators, posts and files. Needs `url` for the attachment servers."""
+        file_number = 0
+        for c in range(self.config.creators):
+            creator_id = f"creator{c}"
+            posts = []
+            for p in range(self.config.posts):
+                post_id = str(100000 + self.config.posts - p)
+                files = []
+                for a in range(self.config.attachments):
+                    data = random.Random(self.config.seed * 1_000_003 + file_number).randbytes(self.config.file_size)
+                    file_number += 1
+                    sha256 = hashlib.sha256(data).hexdigest()
+                    path = f"/{sha256[:2]}/{sha256[2:4]}/{sha256}.bin"
+                    self.files[path] = data
+                    files.append({"name": f"{a:03d}.bin", "path": path})
+                post = {
+                    "id": post_id,
+                    "user": creator_id,
+                    "service": "patreon",
+                    "title": f"Post {p} of {creator_id}",
+                    "content": f"<p>post {post_id}</p>",
+                    "embed": {},
+                    "shared_file": False,
+                    "added": "2024-01-01T00:00:00",
+                    "published": f"2024-01-01T{p % 24:02d}:00:00",
+                    "edited": None,
+                    "file": files[0] if files else {},
+                    "attachments": files[1:],
+                }
+                posts.append({"post": post, "attachments": [dict(file, server=self.url) for file in files], "previews": []})
+            self.creators[creator_id] = posts
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += amount
+
+    def inject_error(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def favorites(self) -> list[dict]:
+        return [
+            {
+                "id": creator_id,
+                "name": creator_id,
+                "service": "patreon",
+                "indexed": "2024-01-01T00:00:00",
+                "updated": "2024-01-01T00:00:00",
+                "public_id": creator_id,
+                "relation_id": None,
+                "faved_seq": i,
+                "last_imported": "2024-01-01T00:00:00",
+            }
+            for i, creator_id in enumerate(self.creators)
+        ]
+
+    def profile(self, creator_id: str) -> dict:
+        return {
+            "id": creator_id,
+            "name": creator_id,
+            "service": "patreon",
+            "indexed": 0,
+            "updated": 0,
+            "public_id": creator_id,
+            "relation_id": None,
+            "post_count": len(self.creators.get(creator_id, ())),
+            "dm_count": 0,
+            "share_count": 0,
+            "chat_count": 0,
+        }
+
+
+def make_handler(mock: MockKemono):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def do_HEAD(self) -> None:
+            self.do_GET()
+
+        def do_GET(self) -> None:
+            url = urlsplit(self.path)
+            if url.path == "/__stats":
+                return self.send_body(200, json.dumps(mock.stats).encode())
+            if url.path.startswith("/data/"):
+                return self.send_data(url.path[len("/data") :])
+            return self.send_api(url.path, parse_qs(url.query))
+
+        def send_api(self, path: str, query: dict) -> None:
+            mock.count("api")
+            if mock.config.api_latency:
+                time.sleep(mock.config.api_latency)
+            if mock.inject_error(mock.config.api_error_rate):
+                mock.count("api_errors")
+                return self.send_body(429, b"", {"Retry-After": "0"})
+
+            parts = path.strip("/").split("/")
+            if path == "/api/v1/account":
+                return self.send_body(200, b"{}")
+            if path == "/api/v1/account/favorites":
+                return self.send_body(200, json.dumps(mock.favorites()).encode())
+            if len(parts) >= 5 and parts[3] == "user":
+                posts = mock.creators.get(parts[4])
+                if posts is None:
+                    return self.send_body(404, b"")
+                if parts[-1] == "profile":
+                    return self.send_body(200, json.dumps(mock.profile(parts[4])).encode())
+                if parts[-1] == "posts":
+                    offset = int(query.get("o", ["0"])[0])
+                    return self.send_body(200, json.dumps([post["post"] for post in posts[offset : offset + POST_STEP_SIZE]]).encode())
+                if parts[-2] == "post":
+                    post = next((post for post in posts if post["post"]["id"] == parts[-1]), None)
+                    if post is not None:
+                        return self.send_body(200, json.dumps(post).encode())
+            self.send_body(404, b"")
+
+        def send_data(self, path: str) -> None:
+            mock.count("data")
+            if mock.config.data_latency:
+                time.sleep(mock.config.data_latency)
+            data = mock.files.get(path)
+            if data is None:
+                return self.send_body(404, b"")
+            if mock.inject_error(mock.config.data_error_rate):
+                mock.count("data_errors")
+                return self.send_body(503, b"", {"Retry-After": "0"})
+
+            start, end, status, headers = 0, len(data) - 1, 200, {"Accept-Ranges": "bytes"} if mock.config.range_support else {}
+            range_header = self.headers.get("Range")
+            if range_header and mock.config.range_support and range_header.startswith("bytes="):
+                first, _, last = range_header[6:].partition("-")
+                start, end = int(first), min(int(last) if last else len(data) - 1, len(data) - 1)
+                if start >= len(data):
+                    return self.send_body(416, b"", {"Content-Range": f"bytes */{len(data)}"})
+                status = 206
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            self.send_body(status, memoryview(data)[start : end + 1], headers, "application/octet-stream", throttle=True)
+
+        def send_body(self, status: int, body, headers: dict | None = None, content_type: str = "text/css", throttle: bool = False) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            if self.command == "HEAD":
+                return
+
+            block = 64 * 1024
+            start_time = time.monotonic()
+            for offset in range(0, len(body), block):
+                chunk = body[offset : offset + block]
+                self.wfile.write(chunk)
+                if throttle:
+                    mock.count("data_bytes", len(chunk))
+                    if mock.config.bandwidth:
+                        ahead = (offset + len(chunk)) / mock.config.bandwidth - (time.monotonic() - start_time)
+                        if ahead > 0:
+                            time.sleep(ahead)
+
+    return Handler
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address) -> None:
+        # clients close the connection of a response they stop reading (the first range of a
+        # segmented download, a failed or cancelled download), which is not a server error
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def start_server(config: MockConfig, port: int = 0) -> tuple[ThreadingHTTPServer, MockKemono]:
+    mock = MockKemono(config)
+    server = QuietHTTPServer(("127.0.0.1", port), make_handler(mock))
+    mock.url = f"http://127.0.0.1:{server.server_port}"
+    mock.build()
+    threading.Thread(target=server.serve_forever, name="mock-kemono", daemon=True).start()
+    return server, mock
+
+
+def serve_forever(config: dict, conn) -> None:
+    """Entry point for running the stand-in in its own process; sends the url through `conn`."""
+    server, mock = start_server(MockConfig(**config))
+    conn.send(mock.url)
+    conn.recv()  # any message stops the server
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the mock kemono server until interrupted.")
+    parser.add_argument("--port", type=int, default=8080)
+    for name, value in asdict(MockConfig()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value) if not isinstance(value, bool) else lambda s: s.lower() in ("1", "true", "yes"), default=value)
+    args = vars(parser.parse_args())
+    port = args.pop("port")
+    server, mock = start_server(MockConfig(**args), port)
+    print(f"Serving {len(mock.files)} files of {len(mock.creators)} creators on {mock.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -3,7 +3,12 @@ import json
 import os
 from datetime import datetime
 
+from .blob_store import BlobStore
+from .hash_cache import HashCache
+from .http_cache import ResponseCache
 from .kemono_dl import KemonoDL
+from .profiling import TIMERS, RunProfiler
+from .utils import tprint
 from .version import __version__
 
 
@@ -25,9 +30,40 @@ def parse_args():
     parser.add_argument("--output", type=str, action="append", metavar="[Type:]Template", default=[KemonoDL.DEFAULT_OUTPUT_TEMPLATE], help="Post attachments output filename tamplate")
     parser.add_argument("--restrict-names", action="store_true", help="Restrict output file to ASCII characters.")
     parser.add_argument("--custom-template-variables", type=str, help="Path to a json file with your custom template variables")
-    parser.add_argument("--no-tmp", action="store_true", help="Do not use .tmp files. Write directly into the output file.")
+    parser.add_argument("--no-tmp", action="store_true", help="Do not use .tmp files. Write directly into the output file. Ignored with --blob-store, whose linked files are always replaced.")
+    parser.add_argument("--manifest", metavar="FILE", type=str, help="Write a json line per URL listing the files and directories it wrote.")
+    parser.add_argument("--plan", metavar="FILE", type=str, help="Do not download anything. Write the files that would be downloaded, with their sizes, to FILE as json lines.")
+    parser.add_argument("--from-plan", metavar="FILE", type=str, help="Download the files listed in a --plan file without fetching post metadata again.")
+    parser.add_argument("--plan-workers", metavar="N", type=int, default=8, help="Number of HEAD requests made at the same time to get file sizes for --plan.")
+    parser.add_argument("--no-hash-cache", action="store_true", help="Do not keep a cache of the sha256 hashes of downloaded files under --path.")
+    parser.add_argument("--no-cache", action="store_true", help="Do not cache api responses under --path.")
+    parser.add_argument("--cache-size", metavar="MiB", type=int, default=256, help="Maximum size of the api response cache.")
+    parser.add_argument("--rehash", action="store_true", help="Ignore the sha256 hash cache and hash existing files again.")
+    parser.add_argument("--blob-store", action="store_true", help="Keep one copy of every downloaded file under --path, keyed by sha256, and link output files to it. A file already in the store is never downloaded again.")
+    parser.add_argument("--link-mode", choices=["auto", *BlobStore.LINK_MODES], default="auto", help="How output files are created from the --blob-store. auto tries hardlink, reflink, symlink then copy.")
+    # Performance
+    parser.add_argument("--concurrent-downloads", metavar="N", type=int, default=1, help="Number of post attachments to download at the same time.")
+    parser.add_argument("--max-connections-per-host", metavar="N", type=int, default=4, help="Maximum number of simultaneous downloads from a single data server.")
+    parser.add_argument("--segments", metavar="N", type=int, default=1, help="Download large attachments over N connections, each fetching its own byte range.")
+    parser.add_argument("--segment-threshold", metavar="MiB", type=int, default=64, help="Only split attachments of at least this size when using --segments.")
+    parser.add_argument("--connect-timeout", metavar="SECONDS", type=float, default=10, help="Seconds to wait for a connection to a server.")
+    parser.add_argument("--read-timeout", metavar="SECONDS", type=float, default=60, help="Seconds to wait for a server to send data.")
+    parser.add_argument("--queue-size", metavar="N", type=int, default=16, help="Number of posts each pipeline stage may queue ahead of the next one, per creator listed at the same time.")
+    parser.add_argument("--fetch-workers", metavar="N", type=int, default=1, help="Number of posts whose details are fetched at the same time.")
+    parser.add_argument("--post-workers", metavar="N", type=int, default=1, help="Number of posts downloaded at the same time.")
+    parser.add_argument("--parallel-creators", metavar="N", type=int, default=1, help="Number of creators listed at the same time. Their posts share the fetch and post workers round-robin.")
+    parser.add_argument("--max-posts-per-domain", metavar="N", type=int, default=0, help="Maximum number of posts downloaded from one site at the same time. 0 for no limit.")
+    # Monitoring
+    parser.add_argument("--profile", metavar="FILE", type=str, help="Profile the run with cProfile and write the stats to FILE (read them with python -m pstats). Also times the hot functions and prints the slowest at exit.")
+    parser.add_argument("--profile-top", metavar="N", type=int, default=10, help="Number of functions in the --profile table printed at exit.")
+    parser.add_argument("--event-log", metavar="FILE", type=str, help="Append a json line for every file downloaded or skipped, every retry and finished post, and a snapshot of all counters, to FILE.")
+    parser.add_argument("--metrics-file", metavar="FILE", type=str, help="Write the run's counters in the Prometheus text format to FILE, e.g. for the node exporter textfile collector.")
+    parser.add_argument("--metrics-interval", metavar="SECONDS", type=float, default=15, help="Seconds between updates of --metrics-file and counter snapshots in --event-log.")
     # Filters
-    parser.add_argument("--archive", metavar="FILE", type=str, help="Path to archive file containing a list of post urls")
+    parser.add_argument("--archive", metavar="FILE", type=str, help="Path to archive file containing a list of post urls. Use a .sqlite/.db extension for an indexed archive database.")
+    parser.add_argument("--archive-import", metavar="FILE", type=str, action="append", help="Import the post urls of a text archive file into --archive")
+    parser.add_argument("--full-rescan", action="store_true", help="List every post of a creator instead of stopping at the newest post synced by the last run")
+    parser.add_argument("--archive-compact", action="store_true", help="Remove duplicate entries and reclaim unused space in --archive")
     parser.add_argument("--date", metavar="[Type:]DATE", type=str, help="Download only posts uploaded on this date. Format 'YYYYMMDD'")
     parser.add_argument("--datebefore", metavar="[Type:]DATE", type=str, help="Download only videos uploaded on or before this date. Format 'YYYYMMDD'")
     parser.add_argument("--dateafter", metavar="[Type:]DATE", type=str, help="Download only videos uploaded on or after this date. Format 'YYYYMMDD'")
@@ -125,42 +161,100 @@ def main() -> None:
         skip_attachments=args.skip_attachments,
         write_content=args.write_content,
         no_tmp=args.no_tmp,
+        concurrent_downloads=max(args.concurrent_downloads, 1),
+        max_connections_per_host=max(args.max_connections_per_host, 1),
+        queue_size=max(args.queue_size, 1),
+        fetch_workers=max(args.fetch_workers, 1),
+        post_workers=max(args.post_workers, 1),
+        parallel_creators=max(args.parallel_creators, 1),
+        max_posts_per_domain=max(args.max_posts_per_domain, 0),
+        hash_cache_file=None if args.no_hash_cache else os.path.join(args.path, HashCache.FILENAME),
+        rehash=args.rehash,
+        segments=max(args.segments, 1),
+        segment_threshold=args.segment_threshold * 1024 * 1024,
+        full_rescan=args.full_rescan,
+        response_cache_file=None if args.no_cache else os.path.join(args.path, ResponseCache.FILENAME),
+        response_cache_size=args.cache_size * 1024 * 1024,
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+        blob_store_dir=os.path.join(args.path, BlobStore.DIRNAME) if args.blob_store else None,
+        link_mode=args.link_mode,
+        track_written=bool(args.manifest),
+        plan_file=args.plan,
+        plan_workers=max(args.plan_workers, 1),
+        event_log=args.event_log,
+        metrics_file=args.metrics_file,
+        metrics_interval=max(args.metrics_interval, 1),
     )
 
-    if args.cookies:
-        for cookie_file in args.cookies:
-            kemono_dl.load_cookies(cookie_file)
+    if (args.archive_import or args.archive_compact) and not args.archive:
+        print("[Error] --archive-import and --archive-compact require --archive")
+        quit()
+
+    for archive_import in args.archive_import or []:
+        if not os.path.exists(archive_import):
+            print(f"[Error] Archive file doesn't exist {archive_import!r}")
+            continue
+        print(f"[info] Imported {kemono_dl.import_archive_file(archive_import)} posts from {archive_import!r}")
+
+    if args.archive_compact:
+        kemono_dl.archive.compact()
+        print(f"[info] Compacted archive {args.archive!r} ({len(kemono_dl.archive)} posts)")
+
+    profiler = RunProfiler(args.profile) if args.profile else None
+    if profiler:
+        TIMERS.enabled = True
+        profiler.start()
+
+    try:
+        if args.cookies:
+            for cookie_file in args.cookies:
+                kemono_dl.load_cookies(cookie_file)
+
+        if args.coomer_login:
+            kemono_dl.login(KemonoDL.COOMER_DOMAIN, args.coomer_login[0], args.coomer_login[1])
+            print(kemono_dl.isLoggedin(KemonoDL.COOMER_DOMAIN))
+
+        if args.kemono_login:
+            kemono_dl.login(KemonoDL.KEMONO_DOMAIN, args.kemono_login[0], args.kemono_login[1])
+            print(kemono_dl.isLoggedin(KemonoDL.KEMONO_DOMAIN))
 
-    if args.coomer_login:
-        kemono_dl.login(KemonoDL.COOMER_DOMAIN, args.coomer_login[0], args.coomer_login[1])
-        print(kemono_dl.isLoggedin(KemonoDL.COOMER_DOMAIN))
+        favorite_domains = []
+        if args.favorite_creators_coomer:
+            favorite_domains.append(KemonoDL.COOMER_DOMAIN)
 
-    if args.kemono_login:
-        kemono_dl.login(KemonoDL.KEMONO_DOMAIN, args.kemono_login[0], args.kemono_login[1])
-        print(kemono_dl.isLoggedin(KemonoDL.KEMONO_DOMAIN))
+        if args.favorite_creators_kemono:
+            favorite_domains.append(KemonoDL.KEMONO_DOMAIN)
 
-    if args.favorite_creators_coomer:
-        kemono_dl.download_favorite_creators(KemonoDL.COOMER_DOMAIN)
+        urls = list(args.URL or [])
 
-    if args.favorite_creators_kemono:
-        kemono_dl.download_favorite_creators(KemonoDL.KEMONO_DOMAIN)
+        if args.batch_file:
+            for batch_file in args.batch_file:
+                if not os.path.exists(batch_file):
+                    print(f"[Error] Batch file doesn't exist {batch_file!r}")
+                    continue
 
-    if args.URL:
-        for url in args.URL:
-            kemono_dl.download_url(url)
+                with open(batch_file, "r", encoding="utf-8") as f:
+                    urls += [line.strip() for line in f.readlines() if not line.startswith("#")]
 
-    if args.batch_file:
-        for batch_file in args.batch_file:
-            if not os.path.exists(batch_file):
-                print(f"[Error] Batch file doesn't exist {batch_file!r}")
-                continue
+        if args.from_plan:
+            kemono_dl.download_plan(args.from_plan)
 
-            with open(batch_file, "r", encoding="utf-8") as f:
-                batch_urls = [line.strip() for line in f.readlines() if not line.startswith("#")]
+        # favorites, urls and batch files are scheduled together so small creators are not stuck behind large ones
+        kemono_dl.download_batch(urls, favorite_domains)
 
-            for url in batch_urls:
-                kemono_dl.download_url(url)
+        if args.manifest:
+            kemono_dl.write_manifest(args.manifest, urls)
+    finally:
+        kemono_dl.close()
+        if profiler:
+            profiler.stop()
 
+    kemono_dl.print_summary()
+    if profiler:
+        for line in TIMERS.table(args.profile_top):
+            tprint(f"[profile] {line}")
+        tprint(f"[profile] cProfile stats written to {args.profile!r}")
     print("Complete")
 
 
@@ -0,0 +1,219 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from dataclasses import asdict, dataclass
+from typing import Iterable
+
+# matches the lines written to an archive file, e.g. "https://coomer.st/onlyfans/user/123/post/456"
+ARCHIVE_LINE_PATTERN = re.compile(r"^https://(?:kemono|coomer)\.\w+/([^/]+/user/[^/]+/post/[^/]+)$")
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+
+def archive_key(service: str, creator_id: str, post_id: str) -> str:
+    return f"{service}/user/{creator_id}/post/{post_id}"
+
+
+def creator_key(service: str, creator_id: str) -> str:
+    return f"{service}/user/{creator_id}"
+
+
+@dataclass
+class SyncMark:
+    """The newest post seen by the last complete sync of a creator."""
+
+    post_id: str
+    published: str | None
+
+    def reached(self, post: dict) -> bool:
+        """True once the (newest first) post listing gets to posts the last sync already covered."""
+        if post.get("id") == self.post_id:
+            return True
+        published = post.get("published")
+        # api dates are ISO 8601 strings in the same format, so they compare correctly as text
+        return bool(self.published and published and published < self.published)
+
+
+def parse_archive_line(line: str) -> str | None:
+    match = ARCHIVE_LINE_PATTERN.match(line.strip())
+    return match.group(1) if match else None
+
+
+class TextArchive:
+    """The original one url per line archive file, held in memory as a set.
+
+    New entries are buffered and appended to the file in batches. With no path
+    the archive only lives for the current run.
+    """
+
+    def __init__(self, path: str | None = None, flush_every: int = 32) -> None:
+        self.path = path
+        self.flush_every = flush_every
+        self._keys: set[str] = set()
+        self._pending: list[str] = []
+        self._lock = threading.Lock()
+        if path and os.path.isfile(path):
+            with open(path, "r") as f:
+                self._keys.update(key for line in f if (key := parse_archive_line(line)))
+
+        # sync marks don't fit the one url per line format, they live in a small json sidecar
+        self.sync_path = path + ".sync.json" if path else None
+        self._sync_marks: dict[str, dict] = {}
+        if self.sync_path and os.path.isfile(self.sync_path):
+            with open(self.sync_path, "r") as f:
+                self._sync_marks = json.load(f)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, domain: str, service: str, creator_id: str, post_id: str) -> None:
+        key = archive_key(service, creator_id, post_id)
+        with self._lock:
+            if key in self._keys:
+                return
+            self._keys.add(key)
+            self._pending.append(f"{domain}/{key}")
+            if len(self._pending) >= self.flush_every:
+                self._flush()
+
+    def add_urls(self, urls: Iterable[str]) -> int:
+        added = 0
+        with self._lock:
+            for url in urls:
+                if (key := parse_archive_line(url)) and key not in self._keys:
+                    self._keys.add(key)
+                    self._pending.append(url.strip())
+                    added += 1
+            self._flush()
+        return added
+
+    def get_sync_mark(self, service: str, creator_id: str) -> SyncMark | None:
+        mark = self._sync_marks.get(creator_key(service, creator_id))
+        return SyncMark(**mark) if mark else None
+
+    def set_sync_mark(self, service: str, creator_id: str, mark: SyncMark) -> None:
+        with self._lock:
+            self._flush()
+            self._sync_marks[creator_key(service, creator_id)] = asdict(mark)
+            if self.sync_path:
+                with open(self.sync_path + ".tmp", "w") as f:
+                    json.dump(self._sync_marks, f, indent=1)
+                os.replace(self.sync_path + ".tmp", self.sync_path)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self.path and self._pending:
+            with open(self.path, "a") as f:
+                f.write("\n".join(self._pending) + "\n")
+        self._pending.clear()
+
+    def compact(self) -> None:
+        """Rewrite the archive file without duplicate or unparsable lines."""
+        self.flush()
+        if not (self.path and os.path.isfile(self.path)):
+            return
+        seen = set()
+        with open(self.path, "r") as f, open(self.path + ".tmp", "w") as out:
+            for line in f:
+                line = line.strip()
+                if (key := parse_archive_line(line)) and key not in seen:
+                    seen.add(key)
+                    out.write(line + "\n")
+        os.replace(self.path + ".tmp", self.path)
+
+    def close(self) -> None:
+        self.flush()
+
+
+class SQLiteArchive:
+    """Archive stored in an indexed SQLite table, so membership checks never load the whole archive."""
+
+    def __init__(self, path: str, flush_every: int = 32) -> None:
+        self.path = path
+        self.flush_every = flush_every
+        self._pending: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS posts (key TEXT PRIMARY KEY, url TEXT NOT NULL) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE IF NOT EXISTS sync_marks (creator TEXT PRIMARY KEY, post_id TEXT NOT NULL, published TEXT) WITHOUT ROWID")
+        self._db.commit()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._pending:
+                return True
+            return self._db.execute("SELECT 1 FROM posts WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._flush()
+            return self._db.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def add(self, domain: str, service: str, creator_id: str, post_id: str) -> None:
+        key = archive_key(service, creator_id, post_id)
+        with self._lock:
+            self._pending[key] = f"{domain}/{key}"
+            if len(self._pending) >= self.flush_every:
+                self._flush()
+
+    def add_urls(self, urls: Iterable[str]) -> int:
+        rows = ((key, url.strip()) for url in urls if (key := parse_archive_line(url)))
+        with self._lock:
+            self._flush()
+            before = self._db.total_changes
+            self._db.executemany("INSERT OR IGNORE INTO posts (key, url) VALUES (?, ?)", rows)
+            self._db.commit()
+            return self._db.total_changes - before
+
+    def get_sync_mark(self, service: str, creator_id: str) -> SyncMark | None:
+        with self._lock:
+            row = self._db.execute("SELECT post_id, published FROM sync_marks WHERE creator = ?", (creator_key(service, creator_id),)).fetchone()
+        return SyncMark(*row) if row else None
+
+    def set_sync_mark(self, service: str, creator_id: str, mark: SyncMark) -> None:
+        with self._lock:
+            self._flush()
+            self._db.execute(
+                "INSERT OR REPLACE INTO sync_marks (creator, post_id, published) VALUES (?, ?, ?)",
+                (creator_key(service, creator_id), mark.post_id, mark.published),
+            )
+            self._db.commit()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._pending:
+            self._db.executemany("INSERT OR IGNORE INTO posts (key, url) VALUES (?, ?)", self._pending.items())
+            self._db.commit()
+            self._pending.clear()
+
+    def compact(self) -> None:
+        """Reclaim the space left behind in the database file."""
+        with self._lock:
+            self._flush()
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._db.execute("VACUUM")
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            self._db.close()
+
+
+Archive = TextArchive | SQLiteArchive
+
+
+def open_archive(path: str | None) -> Archive:
+    if path and path.lower().endswith(SQLITE_EXTENSIONS):
+        return SQLiteArchive(path)
+    return TextArchive(path)
@@ -0,0 +1,118 @@
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+from .utils import format_bytes
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None
+
+# linux ioctl that shares the extents of one file with another (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+
+class BlobStore:
+    """Downloaded files stored once by sha256, with every output path linked to the stored copy.
+
+    Blobs live at `<root>/<ab>/<cd>/<sha256>`. An output path is created as a hardlink,
+    reflink, symlink or plain copy of its blob, trying them in that order unless a single
+    `link_mode` is chosen.
+    """
+
+    DIRNAME = ".kemono-dl-blobs"
+    LINK_MODES = ("hardlink", "reflink", "symlink", "copy")
+
+    def __init__(self, root: str, link_mode: str = "auto") -> None:
+        if link_mode != "auto" and link_mode not in BlobStore.LINK_MODES:
+            raise ValueError(f"Unknown link mode {link_mode!r}")
+        self.root = root
+        self.link_modes = BlobStore.LINK_MODES if link_mode == "auto" else (link_mode,)
+        self.linked = 0
+        self.stored = 0
+        self.saved_bytes = 0
+        self._lock = threading.Lock()
+        self._claims: dict[str, list] = {}
+        os.makedirs(root, exist_ok=True)
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def __contains__(self, sha256: str) -> bool:
+        return os.path.isfile(self.blob_path(sha256))
+
+    @contextmanager
+    def claim(self, sha256: str):
+        """Hold `sha256` so a second download of the same file waits and then links to the first one."""
+        with self._lock:
+            claim = self._claims.setdefault(sha256, [threading.Lock(), 0])
+            claim[1] += 1
+        try:
+            with claim[0]:
+                yield
+        finally:
+            with self._lock:
+                claim[1] -= 1
+                if claim[1] == 0:
+                    del self._claims[sha256]
+
+    def link(self, sha256: str, file_path: str) -> bool:
+        """Create `file_path` from the stored blob. Returns False when the blob is not stored."""
+        blob_path = self.blob_path(sha256)
+        if not os.path.isfile(blob_path):
+            return False
+        if not _link_file(blob_path, file_path, self.link_modes):
+            return False
+        with self._lock:
+            self.linked += 1
+            self.saved_bytes += os.path.getsize(blob_path)
+        return True
+
+    def add(self, file_path: str, sha256: str) -> None:
+        """Store a downloaded file whose sha256 was verified. The file itself stays where it is."""
+        blob_path = self.blob_path(sha256)
+        if os.path.isfile(blob_path):
+            return
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        # a symlink would point the blob at a path the user may move or delete
+        if _link_file(file_path, blob_path, tuple(mode for mode in self.LINK_MODES if mode != "symlink")):
+            with self._lock:
+                self.stored += 1
+
+    def summary(self) -> str:
+        return f"Blob store: {self.linked} files linked ({format_bytes(self.saved_bytes)} not downloaded), {self.stored} files stored"
+
+
+def _link_file(source: str, destination: str, link_modes: tuple[str, ...]) -> bool:
+    # build the link next to the destination and move it in place, so an existing file is replaced atomically
+    temp_path = f"{destination}.{threading.get_ident()}.link"
+    for mode in link_modes:
+        try:
+            if mode == "hardlink":
+                os.link(source, temp_path)
+            elif mode == "reflink":
+                _reflink(source, temp_path)
+            elif mode == "symlink":
+                os.symlink(os.path.abspath(source), temp_path)
+            else:
+                shutil.copyfile(source, temp_path)
+            os.replace(temp_path, destination)
+            return True
+        except OSError:
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+    return False
+
+
+def _reflink(source: str, destination: str) -> None:
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination)
+            raise
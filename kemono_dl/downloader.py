@@ -1,19 +1,48 @@
+import hashlib
+import io
+import json
 import os
-import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
+from .profiling import timed
+from .progress import ProgressTracker, Transfer
 from .session import CustomSession
-from .utils import format_bytes
+from .utils import format_bytes, get_sha256_hash, hash_file_into, tprint
 
 
-def download_file(session: CustomSession, url: str, filepath: str, chunk_size: int = 8192, temp_file: bool = True) -> None:
-    print(f"[downloading] Source: {url!r}")
-    print(f"[downloading] Destination: {filepath!r}")
+class DownloadError(Exception):
+    pass
+
+
+MIN_BUFFER_SIZE = 64 * 1024
+MAX_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+@timed
+def download_file(
+    session: CustomSession,
+    url: str,
+    filepath: str,
+    chunk_size: int = MAX_BUFFER_SIZE,
+    temp_file: bool = True,
+    progress: ProgressTracker | None = None,
+    expected_size: int | None = None,
+) -> str:
+    """Download `url` to `filepath` and return the sha256 hex digest of the written file.
+
+    The digest is computed while the chunks are written; a resumed `.tmp` file is hashed once
+    before appending to it. When `expected_size` is given the download is aborted before any
+    data is read if the server reports a different size. `chunk_size` is the largest read.
+    """
+    tprint(f"[downloading] Source: {url!r}\n[downloading] Destination: {filepath!r}")
 
     headers = {}
     mode = "wb"
     downloaded = 0
     temp_filepath = filepath
+    sha256 = hashlib.sha256()
 
     if temp_file:
         temp_filepath = filepath + ".tmp"
@@ -21,31 +50,273 @@ def download_file(session: CustomSession, url: str, filepath: str, chunk_size: i
             downloaded = os.path.getsize(temp_filepath)
             headers = {"Range": f"bytes={downloaded}-"}
             mode = "ab"
-            print("[downloading] Resuming partially downloaded file")
+            tprint(f"[downloading] Resuming partially downloaded file {os.path.basename(filepath)!r}")
 
     with session.get(url, stream=True, allow_redirects=True, headers=headers) as response:
+        if downloaded and response.status_code == 416:
+            # the .tmp file is already complete (or preallocated by a download that was killed), start over
+            response.close()
+            os.remove(temp_filepath)
+            return download_file(session, url, filepath, chunk_size, temp_file, progress, expected_size)
+
         response.raise_for_status()
 
-        total_size = int(response.headers.get("content-length", 0)) + downloaded
+        if downloaded and response.status_code != 206:
+            # the server ignored the Range header and is sending the whole file again
+            tprint("[downloading] Server does not support resuming. Restarting download")
+            downloaded = 0
+            mode = "wb"
 
-        start_time = time.time()
+        content_length = int(response.headers.get("content-length", 0))
+        total_size = content_length + downloaded
 
+        if expected_size is not None and total_size != expected_size:
+            if downloaded:
+                # the partial file can never become the expected file
+                os.remove(temp_filepath)
+            raise DownloadError(f"Size mismatch. Expected {expected_size} bytes, server reported {total_size} bytes")
+
+        if downloaded:
+            hash_file_into(sha256, temp_filepath)
+
+        transfer = _save_response(response, filepath, temp_filepath, mode, downloaded, sha256, chunk_size, progress)
+
+    _print_finished(filepath, transfer)
+
+    if temp_file:
+        os.replace(temp_filepath, filepath)
+
+    return sha256.hexdigest()
+
+
+def _save_response(response, filepath: str, temp_filepath: str, mode: str, downloaded: int, sha256, chunk_size: int, progress: ProgressTracker | None) -> Transfer:
+    """Write the body of `response` to `temp_filepath` after the `downloaded` bytes already there."""
+    content_length = int(response.headers.get("content-length", 0))
+    # the progress tracker samples this counter on its own schedule, the loop below only adds to it
+    transfer = progress.start_transfer(os.path.basename(filepath), content_length + downloaded, downloaded) if progress else Transfer(os.path.basename(filepath), content_length + downloaded, downloaded)
+    try:
         with open(temp_filepath, mode) as f:
+            if mode == "wb" and content_length:
+                _preallocate(f, content_length)
+            try:
+                _stream_response(response, f, sha256, transfer, chunk_size)
+            finally:
+                # drop any preallocated space that was not written so a resume starts at the right offset
+                f.truncate(f.tell())
+    finally:
+        if progress:
+            progress.finish_transfer(transfer)
+    return transfer
+
+
+def _stream_response(response, f, sha256, transfer: Transfer, max_buffer_size: int) -> None:
+    """Copy the response body into `f` through one reused buffer.
+
+    The read size starts small and is adjusted to roughly 50ms worth of data at the measured
+    throughput, so fast transfers make few large reads and writes and slow ones stay responsive.
+    Reads go through urllib3 so the connection goes back to the pool once the body is consumed.
+    """
+    raw = response.raw
+    # urllib3's response is a file object in both 1.x and 2.x
+    if not isinstance(raw, io.IOBase) or response.headers.get("Content-Encoding", "identity") not in ("identity", ""):
+        # compressed (or otherwise wrapped) bodies have to be decoded by requests
+        for chunk in response.iter_content(chunk_size=max_buffer_size):
+            f.write(chunk)
+            sha256.update(chunk)
+            transfer.downloaded += len(chunk)
+        return
+
+    max_buffer_size = max(max_buffer_size, MIN_BUFFER_SIZE)
+    buffer = memoryview(bytearray(max_buffer_size))
+    read_size = min(MIN_BUFFER_SIZE, max_buffer_size)
+    window_start, window_bytes = time.monotonic(), 0
+    while n := raw.readinto(buffer[:read_size]):
+        chunk = buffer[:n]
+        f.write(chunk)
+        sha256.update(chunk)
+        transfer.downloaded += n
+        window_bytes += n
+        elapsed = time.monotonic() - window_start
+        if elapsed >= 0.25:
+            target = window_bytes / elapsed * 0.05
+            read_size = min(max_buffer_size, max(MIN_BUFFER_SIZE, 1 << int(target).bit_length() - 1 if target >= 1 else 0))
+            window_start, window_bytes = time.monotonic(), 0
+
+
+def _preallocate(f, size: int) -> None:
+    # reserves the blocks up front to avoid fragmentation; only where the os supports it
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except OSError:
+            pass
+
+
+def _print_finished(filepath: str, transfer: Transfer) -> None:
+    elapsed = time.monotonic() - transfer.start_time
+    speed = (transfer.downloaded - transfer.start_size) / elapsed if elapsed > 0 else 0
+    tprint(f"[downloading] Finished {os.path.basename(filepath)!r} {format_bytes(transfer.downloaded)} at {format_bytes(speed)}/s")
+
+
+@timed
+def download_file_segmented(
+    session: CustomSession,
+    url: str,
+    filepath: str,
+    segments: int = 4,
+    min_size: int = 64 * 1024 * 1024,
+    chunk_size: int = 1024 * 1024,
+    temp_file: bool = True,
+    progress: ProgressTracker | None = None,
+) -> str:
+    """Download `url` over several connections, each fetching its own byte range.
+
+    The first request is a plain GET. When its response is smaller than `min_size` or the
+    server does not advertise Range support it is saved as one stream, like `download_file`;
+    otherwise it serves the first range and the other ranges are requested next to it.
+    Progress of every range is tracked in a `.parts` sidecar file so an interrupted download
+    continues per segment. Returns the sha256 hex digest.
+    """
+    temp_filepath = filepath + ".tmp" if temp_file else filepath
+    parts_filepath = filepath + ".parts"
+
+    state = _load_parts(parts_filepath, url, temp_filepath)
+    if state is not None:
+        tprint(f"[downloading] Resuming segmented download {os.path.basename(filepath)!r}")
+        return _download_segments(session, url, filepath, temp_filepath, parts_filepath, state, chunk_size, temp_file, progress)
+
+    if temp_file and os.path.exists(temp_filepath):
+        # a single stream download was interrupted, let it resume where it stopped
+        return download_file(session, url, filepath, temp_file=temp_file, progress=progress)
+
+    with session.get(url, stream=True, allow_redirects=True) as response:
+        response.raise_for_status()
+        total_size = int(response.headers.get("content-length", 0))
+        if segments <= 1 or total_size < min_size or not _supports_ranges(response):
+            tprint(f"[downloading] Source: {url!r}\n[downloading] Destination: {filepath!r}")
+            sha256 = hashlib.sha256()
+            transfer = _save_response(response, filepath, temp_filepath, "wb", 0, sha256, MAX_BUFFER_SIZE, progress)
+            _print_finished(filepath, transfer)
+            if temp_file:
+                os.replace(temp_filepath, filepath)
+            return sha256.hexdigest()
+
+        step = -(-total_size // segments)
+        state = {"url": url, "size": total_size, "segments": [[start, min(start + step, total_size) - 1, 0] for start in range(0, total_size, step)]}
+        with open(temp_filepath, "wb") as f:
+            f.truncate(total_size)
+        _save_parts(parts_filepath, state)
+        return _download_segments(session, url, filepath, temp_filepath, parts_filepath, state, chunk_size, temp_file, progress, response)
+
+
+def _download_segments(
+    session: CustomSession,
+    url: str,
+    filepath: str,
+    temp_filepath: str,
+    parts_filepath: str,
+    state: dict,
+    chunk_size: int,
+    temp_file: bool,
+    progress: ProgressTracker | None,
+    first_response=None,
+) -> str:
+    """Fetch the missing part of every segment in `state`; `first_response`, a plain GET still unread, serves the first."""
+    tprint(f"[downloading] Source: {url!r}\n[downloading] Destination: {filepath!r}\n[downloading] Segments: {len(state['segments'])}")
+
+    lock = threading.Lock()
+    last_save = [time.monotonic()]
+    downloaded = sum(segment[2] for segment in state["segments"])
+    transfer = progress.start_transfer(os.path.basename(filepath), state["size"], downloaded) if progress else Transfer(os.path.basename(filepath), state["size"], downloaded)
+
+    def write_segment(segment: list[int], response) -> None:
+        start, end = segment[0], segment[1]
+        with open(temp_filepath, "r+b") as f:
+            f.seek(start + segment[2])
             for chunk in response.iter_content(chunk_size=chunk_size):
                 if chunk:
+                    chunk = chunk[: end + 1 - start - segment[2]]
                     f.write(chunk)
-                    downloaded += len(chunk)
+                    with lock:
+                        segment[2] += len(chunk)
+                        transfer.downloaded += len(chunk)
+                        if time.monotonic() - last_save[0] >= 1:
+                            _save_parts(parts_filepath, state)
+                            last_save[0] = time.monotonic()
+                    if start + segment[2] > end:
+                        # the first response carries the whole file, stop at the end of its segment
+                        return
 
-                    elapsed = time.time() - start_time
-                    speed = downloaded / elapsed if elapsed > 0 else 0
-                    remaining = total_size - downloaded
-                    eta = remaining / speed if speed > 0 else 0
+    def read_first_segment(segment: list[int]) -> None:
+        try:
+            write_segment(segment, first_response)
+        finally:
+            # drops the connection, so the server stops sending the rest of the file
+            first_response.close()
 
-                    percent = (downloaded / total_size) * 100
-                    progress = f"[downloading] {percent:6.2f}% of {format_bytes(total_size)} eta {time.strftime('%H:%M:%S', time.gmtime(eta))} at {format_bytes(speed)}/s"
-                    if sys.stdout.isatty():
-                        print(progress.ljust(100), end="\r")
-        print(progress.ljust(100))
+    def fetch_segment(segment: list[int]) -> None:
+        start, end, done = segment
+        if start + done > end:
+            return
+        headers = {"Range": f"bytes={start + done}-{end}"}
+        with session.get(url, stream=True, allow_redirects=True, headers=headers) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise _RangeIgnored()
+            write_segment(segment, response)
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(state["segments"]), thread_name_prefix="kemono-dl-segment") as executor:
+            futures = [executor.submit(read_first_segment, state["segments"][0])] if first_response is not None else []
+            remaining = state["segments"][1:] if first_response is not None else state["segments"]
+            futures += [executor.submit(fetch_segment, segment) for segment in remaining]
+            for future in futures:
+                future.result()
+    except _RangeIgnored:
+        tprint("[downloading] Server ignored the Range header. Falling back to a single connection")
+        os.remove(parts_filepath)
+        os.remove(temp_filepath)
+        return download_file(session, url, filepath, temp_file=temp_file, progress=progress)
+    except BaseException:
+        # keep the finished ranges so the next attempt only fetches what is missing
+        _save_parts(parts_filepath, state)
+        raise
+    finally:
+        if progress:
+            progress.finish_transfer(transfer)
+
+    _print_finished(filepath, transfer)
 
     if temp_file:
         os.replace(temp_filepath, filepath)
+    os.remove(parts_filepath)
+
+    # the segments arrive out of order, so this is the one download that is hashed after the fact
+    return get_sha256_hash(filepath)
+
+
+class _RangeIgnored(Exception):
+    pass
+
+
+def _supports_ranges(response) -> bool:
+    # byte ranges of an encoded body do not map to the file, so those are downloaded as one stream
+    encoding = response.headers.get("Content-Encoding", "identity")
+    return response.headers.get("Accept-Ranges", "").lower() == "bytes" and encoding in ("identity", "")
+
+
+def _load_parts(parts_filepath: str, url: str, temp_filepath: str) -> dict | None:
+    try:
+        with open(parts_filepath, "r") as f:
+            state = json.load(f)
+        if state.get("url") == url and os.path.getsize(temp_filepath) == state["size"]:
+            return state
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def _save_parts(parts_filepath: str, state: dict) -> None:
+    with open(parts_filepath + ".new", "w") as f:
+        json.dump(state, f)
+    os.replace(parts_filepath + ".new", parts_filepath)
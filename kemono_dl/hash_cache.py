@@ -0,0 +1,80 @@
+import os
+import sqlite3
+import threading
+
+from .utils import get_sha256_hash
+
+
+class HashCache:
+    """Persistent sha256 digests of downloaded files.
+
+    An entry is only trusted while the file's size, mtime, inode and ctime are
+    unchanged; any difference means the file was touched and it is hashed again.
+    """
+
+    FILENAME = ".kemono-dl-hashes.sqlite"
+
+    def __init__(self, path: str, rehash: bool = False, commit_every: int = 64) -> None:
+        self.path = path
+        self.rehash = rehash
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                ctime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            ) WITHOUT ROWID"""
+        )
+        self._db.commit()
+
+    def get_sha256(self, file_path: str) -> str:
+        """Return the sha256 of `file_path`, hashing it only if the cached entry is missing or stale."""
+        key = os.path.abspath(file_path)
+        st = os.stat(key)
+        if not self.rehash:
+            with self._lock:
+                row = self._db.execute("SELECT size, mtime_ns, ctime_ns, inode, sha256 FROM files WHERE path = ?", (key,)).fetchone()
+            if row and row[:4] == (st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino):
+                with self._lock:
+                    self.hits += 1
+                return row[4]
+
+        sha256 = get_sha256_hash(key)
+        with self._lock:
+            self.misses += 1
+        self._store(key, st, sha256)
+        return sha256
+
+    def store(self, file_path: str, sha256: str) -> None:
+        """Record the digest of a file that was just written."""
+        key = os.path.abspath(file_path)
+        self._store(key, os.stat(key), sha256)
+
+    def _store(self, key: str, st: os.stat_result, sha256: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, ctime_ns, inode, sha256) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino, sha256),
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._db.commit()
+                self._uncommitted = 0
+
+    def summary(self) -> str:
+        return f"Hash cache: {self.hits} hits, {self.misses} misses"
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.commit()
+            self._db.close()
@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str | None
+    last_modified: str | None
+    stored: float
+
+
+class ResponseCache:
+    """On-disk cache of api response bodies.
+
+    Entries younger than their ttl are used as is. Older entries are revalidated with
+    If-None-Match / If-Modified-Since when the server sent an ETag or Last-Modified.
+    The least recently used entries are dropped once the cache grows past `max_size` bytes.
+    """
+
+    FILENAME = ".kemono-dl-cache.sqlite"
+    PROFILE_TTL = 60 * 60
+    POST_TTL = 7 * 24 * 60 * 60
+    # listing pages gain new posts at any time, so they are always revalidated
+    LISTING_TTL = 0
+
+    def __init__(self, path: str, max_size: int = 256 * 1024 * 1024) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                stored REAL NOT NULL,
+                accessed REAL NOT NULL,
+                size INTEGER NOT NULL
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._db.commit()
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> CachedResponse | None:
+        with self._lock:
+            row = self._db.execute("SELECT body, etag, last_modified, stored FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+            return CachedResponse(*row)
+
+    def put(self, key: str, body: bytes, etag: str | None = None, last_modified: str | None = None) -> None:
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._size -= old[0] if old else 0
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, body, etag, last_modified, stored, accessed, size) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, body, etag, last_modified, now, now, len(body)),
+            )
+            self._size += len(body)
+            self._evict()
+            self._db.commit()
+
+    def refresh(self, key: str) -> None:
+        """Mark an entry the server confirmed as unchanged as fresh again."""
+        with self._lock:
+            self._db.execute("UPDATE responses SET stored = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+
+    def _evict(self) -> None:
+        if self._size <= self.max_size:
+            return
+        evicted = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            evicted.append((key,))
+            self._size -= size
+            if self._size <= self.max_size:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def summary(self) -> str:
+        return f"Metadata cache: {self.hits} hits, {self.revalidated} revalidated, {self.misses} misses"
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.commit()
+            self._db.close()
@@ -1,17 +1,32 @@
 import http.cookiejar
+import json
 import mimetypes
 import os
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from http.cookiejar import LoadError
-from typing import List, Literal
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Literal
+from urllib.parse import urlencode, urlsplit
 
 from requests.exceptions import RequestException
 
-from .downloader import download_file
-from .models import Attachment, Creator, FavoriteCreator, FileTemplateVaribales, Post
-from .session import CustomSession
-from .utils import compute_sha256, generate_file_path, get_sha256_hash, get_sha256_url_content
+from .archive import SyncMark, archive_key, open_archive
+from .blob_store import BlobStore
+from .downloader import download_file, download_file_segmented
+from .hash_cache import HashCache
+from .http_cache import ResponseCache
+from .metrics import Metrics
+from .models import Attachment, Creator, CustomTemplateVariables, FavoriteCreator, FileTemplateVaribales, ParsedUrl, Post
+from .pipeline import CreatorJob, PostPipeline
+from .plan import PlanWriter, read_plan
+from .profiling import timed
+from .progress import ProgressTracker
+from .session import CustomSession, RateLimiter
+from .utils import compute_sha256, decode_json, generate_file_path, get_sha256_hash, get_sha256_url_content, json_loads, tprint
 
 OverwriteMode = Literal[False, "soft", True]
 # "soft" will not overwrite the file if it has the expected sha256 hash
@@ -45,14 +60,50 @@ class KemonoDL:
         skip_attachments: bool = False,
         write_content: bool = False,
         no_tmp: bool = False,
+        concurrent_downloads: int = 1,
+        max_connections_per_host: int = 4,
+        queue_size: int = 16,
+        fetch_workers: int = 1,
+        post_workers: int = 1,
+        hash_cache_file: str | None = None,
+        rehash: bool = False,
+        segments: int = 1,
+        segment_threshold: int = 64 * 1024 * 1024,
+        full_rescan: bool = False,
+        response_cache_file: str | None = None,
+        response_cache_size: int = 256 * 1024 * 1024,
+        connect_timeout: float | None = 10,
+        read_timeout: float | None = 60,
+        blob_store_dir: str | None = None,
+        link_mode: str = "auto",
+        parallel_creators: int = 1,
+        max_posts_per_domain: int = 0,
+        track_written: bool = False,
+        on_file_written: Callable[[str], None] | None = None,
+        plan_file: str | None = None,
+        plan_workers: int = 8,
+        event_log: str | None = None,
+        metrics_file: str | None = None,
+        metrics_interval: float = 15.0,
     ) -> None:
         self.domain = KemonoDL.COOMER_DOMAIN
-        self.session = CustomSession()
+        self.metrics = Metrics(event_log, metrics_file, metrics_interval)
+        # the host slots cap the attachments downloading from one data server at once, each using up to `segments` connections
+        data_connections = min(max(concurrent_downloads, 1) * max(post_workers, 1), max_connections_per_host) * max(segments, 1)
+        api_connections = max(fetch_workers, 1) + max(post_workers, 1) + max(parallel_creators, 1)
+        self.session = CustomSession(
+            rate_limiter=RateLimiter(),
+            pool_maxsize=max(data_connections, 10),
+            host_pool_sizes={urlsplit(domain).netloc: max(api_connections, 10) for domain in (KemonoDL.COOMER_DOMAIN, KemonoDL.KEMONO_DOMAIN)},
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            metrics=self.metrics,
+        )
         self.creators_cache: dict[tuple[str, str], Creator] = {}
         self.path = path
         self.output_templates = output_templates
         self.restrict_names = restrict_names
-        self.custom_template_variables = custom_template_variables
+        self.custom_template_variables = CustomTemplateVariables(custom_template_variables)
         self.force_overwrite = force_overwrite
         self.max_retries = max_retries
         self.post_filters = post_filters
@@ -60,34 +111,134 @@ class KemonoDL:
         self.skip_attachments = skip_attachments
         self.write_content = write_content
         self.no_tmp = no_tmp
+        self.concurrent_downloads = concurrent_downloads
+        self.max_connections_per_host = max_connections_per_host
+        self._host_slots: dict[str | None, threading.BoundedSemaphore] = {}
+        self._host_slots_lock = threading.Lock()
+        self.queue_size = queue_size
+        self.fetch_workers = fetch_workers
+        self.post_workers = post_workers
+        self.parallel_creators = parallel_creators
+        self.max_posts_per_domain = max_posts_per_domain
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.full_rescan = full_rescan
 
         self.archive_file = archive_file
-        self.archived_posts = []
         self.load_archive_file()
 
+        self.progress = ProgressTracker()
+        self.metrics.observe("downloaded_bytes_total", self.progress.received_bytes)
+        self.hash_cache = HashCache(hash_cache_file, rehash) if hash_cache_file else None
+        self.response_cache = ResponseCache(response_cache_file, response_cache_size) if response_cache_file else None
+        self.blob_store = BlobStore(blob_store_dir, link_mode) if blob_store_dir else None
+
+        # (service, creator_id, post_id) -> files and directories written for the post, see `written_by_url`
+        self.track_written = track_written
+        # called from the download threads with the path of every file as soon as it is complete
+        self.on_file_written = on_file_written
+
+        # with a plan file the posts are only planned, nothing is downloaded
+        self.planner = PlanWriter(plan_file, self.session, plan_workers) if plan_file else None
+        self.written: dict[tuple[str, str, str], dict[str, list[str]]] = {}
+        self._written_lock = threading.Lock()
+
     def load_archive_file(self) -> None:
-        if self.archive_file and os.path.isfile(self.archive_file):
-            with open(self.archive_file, "r") as f:
-                self.archived_posts.extend(f"{parsed_url['service']}/user/{parsed_url['creator_id']}/post/{parsed_url['post_id']}" for line in f if (parsed_url := self.parse_url(line.strip())))
+        self.archive = open_archive(self.archive_file)
 
     def write_archive_file(self, domain: str, service: str, creator_id: str, post_id: str) -> None:
-        archive_data = f"{domain}/{service}/user/{creator_id}/post/{post_id}"
-        self.archived_posts.append(archive_data)
-        if self.archive_file:
-            if os.path.exists(self.archive_file):
-                with open(self.archive_file, "a") as f:
-                    f.write(archive_data + "\n")
-            else:
-                with open(self.archive_file, "w") as f:
-                    f.write(archive_data + "\n")
+        self.archive.add(domain, service, creator_id, post_id)
 
-    def parse_url(self, url) -> dict | None:
+    def get_sync_mark(self, service: str, creator_id: str) -> SyncMark | None:
+        """Where listing the creator's posts may stop, or None to list them all."""
+        if self.full_rescan:
+            return None
+        return self.archive.get_sync_mark(service, creator_id)
+
+    def creator_synced(self, service: str, creator_id: str, mark: SyncMark | None) -> None:
+        """Called once every listed post of a creator was fetched and downloaded."""
+        # a planned post is not downloaded yet and a filtered one not at all, the next run has to list them again
+        if mark and not self.planner and not self.has_post_filters():
+            self.archive.set_sync_mark(service, creator_id, mark)
+
+    def import_archive_file(self, text_file: str) -> int:
+        """Copy the posts listed in an old text archive file into the current archive."""
+        with open(text_file, "r") as f:
+            return self.archive.add_urls(f)
+
+    def close(self) -> None:
+        self.progress.close()
+        if self.planner:
+            self.planner.close()
+        self.archive.close()
+        if self.hash_cache:
+            self.hash_cache.close()
+        if self.response_cache:
+            self.response_cache.close()
+        self.metrics.close()
+
+    def print_summary(self) -> None:
+        for line in self.session.summary():
+            tprint(f"[summary] {line}")
+        if self.hash_cache:
+            tprint(f"[summary] {self.hash_cache.summary()}")
+        if self.response_cache:
+            tprint(f"[summary] {self.response_cache.summary()}")
+        if self.blob_store:
+            tprint(f"[summary] {self.blob_store.summary()}")
+        if self.planner:
+            tprint(f"[summary] {self.planner.summary()}")
+        tprint(f"[summary] {self.metrics.summary()}")
+
+    def file_sha256(self, file_path: str) -> str:
+        with self.metrics.phase("hash"):
+            if self.hash_cache:
+                return self.hash_cache.get_sha256(file_path)
+            return get_sha256_hash(file_path)
+
+    def parse_url(self, url) -> ParsedUrl | None:
         match = re.match(KemonoDL.URL_PARSE_PATTERN, url)
         if match:
             site, service, creator_id, post_id = match.groups()
-            return {"site": site, "service": service, "creator_id": creator_id, "post_id": post_id}
+            return ParsedUrl(site=site, service=service, creator_id=creator_id, post_id=post_id)
         return None
 
+    def get_api_json(self, url: str, params: dict | None = None, ttl: float | None = None):
+        """GET an api endpoint and decode its json, going through the response cache when a `ttl` is given."""
+        kwargs: dict = {"headers": {"accept": "text/css"}}
+        if params is not None:
+            kwargs["params"] = params
+
+        cache = self.response_cache
+        if cache is None or ttl is None:
+            response = self.session.get(url, **kwargs)
+            response.raise_for_status()
+            return decode_json(response)
+
+        key = url if params is None else f"{url}?{urlencode(sorted(params.items()))}"
+        cached = cache.get(key)
+        if cached and time.time() - cached.stored < ttl:
+            cache.count("hits")
+            return json_loads(cached.body)
+
+        if cached:
+            if cached.etag:
+                kwargs["headers"]["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                kwargs["headers"]["If-Modified-Since"] = cached.last_modified
+
+        response = self.session.get(url, **kwargs)
+        if cached and response.status_code == 304:
+            cache.count("revalidated")
+            cache.refresh(key)
+            return json_loads(cached.body)
+
+        response.raise_for_status()
+        data = decode_json(response)
+        cache.count("misses")
+        cache.put(key, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return data
+
     def load_cookies(self, cookies_file: str) -> bool:
         try:
             jar = http.cookiejar.MozillaCookieJar()
@@ -96,7 +247,7 @@ class KemonoDL:
                 self.session.cookies.set_cookie(cookie)
             return True
         except (LoadError, OSError) as e:
-            print(f"[Error] Failed to load cookies from {cookies_file}: {e}")
+            tprint(f"[Error] Failed to load cookies from {cookies_file}: {e}")
             return False
 
     def login(self, domain: str, username: str, password: str) -> bool:
@@ -106,7 +257,7 @@ class KemonoDL:
             response.raise_for_status()
             return True
         except RequestException as e:
-            print(f"[Error] Unable to login: {e}")
+            tprint(f"[Error] Unable to login: {e}")
             return False
 
     def isLoggedin(self, domain: str) -> bool:
@@ -119,49 +270,49 @@ class KemonoDL:
             creator = self.creators_cache.get((service, creator_id), None)
             if creator is None:
                 url = f"{domain}/api/v1/{service}/user/{creator_id}/profile"
-                response = self.session.get(url, headers={"accept": "text/css"})
-                response.raise_for_status()
-                creator = Creator(**response.json())
+                creator = Creator(**self.get_api_json(url, ttl=ResponseCache.PROFILE_TTL))
                 self.creators_cache[(service, creator_id)] = creator
             return creator
         except (RequestException, ValueError) as e:
-            print(f"[Error] Failed to fetch creator profile from {url!r}: {e}")
+            tprint(f"[Error] Failed to fetch creator profile from {url!r}: {e}")
             return None
 
-    def get_creator_post_ids(self, domain: str, service: str, creator_id: str, offset: int = 0) -> list[str]:
+    def get_creator_posts(self, domain: str, service: str, creator_id: str, offset: int = 0) -> list[dict] | None:
         try:
             url = f"{domain}/api/v1/{service}/user/{creator_id}/posts"
-            response = self.session.get(url, params={"o": offset}, headers={"accept": "text/css"})
-            response.raise_for_status()
-            posts = response.json()
-            return [post.get("id") for post in posts]
+            with self.metrics.phase("list"):
+                return self.get_api_json(url, params={"o": offset}, ttl=ResponseCache.LISTING_TTL)
         except (RequestException, ValueError) as e:
-            print(f"[Error] Failed to fetch posts from {url!r}: {e}")
-            return []
+            tprint(f"[Error] Failed to fetch posts from {url!r}: {e}")
+            return None
 
-    def get_all_creator_post_ids(self, domain: str, service: str, creator_id: str, limit: int = 0, offset: int = 0) -> list[str]:
-        posts = []
+    def get_creator_post_ids(self, domain: str, service: str, creator_id: str, offset: int = 0) -> list[str]:
+        posts = self.get_creator_posts(domain, service, creator_id, offset)
+        return [post.get("id") for post in posts or []]
+
+    def iter_creator_post_ids(self, domain: str, service: str, creator_id: str, offset: int = 0) -> Iterator[str]:
         while True:
             posts_chunk = self.get_creator_post_ids(domain, service, creator_id, offset)
-            posts += posts_chunk
-            if len(posts) >= limit and limit > 0:
-                posts = posts[:limit]
-                break
+            yield from posts_chunk
             if len(posts_chunk) < KemonoDL.POST_STEP_SIZE:
                 break
             offset += KemonoDL.POST_STEP_SIZE
-            time.sleep(0.5)
-        return posts
 
+    def get_all_creator_post_ids(self, domain: str, service: str, creator_id: str, limit: int = 0, offset: int = 0) -> list[str]:
+        post_ids = self.iter_creator_post_ids(domain, service, creator_id, offset)
+        if limit > 0:
+            return list(islice(post_ids, limit))
+        return list(post_ids)
+
+    @timed
     def get_post(self, domain: str, service: str, creator_id: str, post_id: str) -> Post | None:
         try:
             url = f"{domain}/api/v1/{service}/user/{creator_id}/post/{post_id}"
-            response = self.session.get(url, headers={"accept": "text/css"})
-            response.raise_for_status()
-            post_api = response.json()
+            with self.metrics.phase("fetch"):
+                post_api = self.get_api_json(url, ttl=ResponseCache.POST_TTL)
             return Post(post_api)
         except (RequestException, ValueError) as e:
-            print(f"[Error] Failed to fetch post from {url!r}: {e}")
+            tprint(f"[Error] Failed to fetch post from {url!r}: {e}")
             return None
 
     def get_favorit_creators(self, domain: str) -> List[FavoriteCreator] | None:
@@ -169,10 +320,10 @@ class KemonoDL:
             url = f"{domain}/api/v1/account/favorites"
             response = self.session.get(url, params={"type": "artist"}, headers={"accept": "text/css"})
             response.raise_for_status()
-            creators = response.json()
+            creators = decode_json(response)
             return [FavoriteCreator(**creator) for creator in creators]
         except (RequestException, ValueError) as e:
-            print(f"[Error] Failed to fetch favorite creators from {url!r}: {e}")
+            tprint(f"[Error] Failed to fetch favorite creators from {url!r}: {e}")
             return None
 
     def get_favorit_post_ids(self, domain: str) -> List[str] | None:
@@ -180,52 +331,75 @@ class KemonoDL:
             url = f"{domain}/api/v1/account/favorites"
             response = self.session.get(url, params={"type": "post"}, headers={"accept": "text/css"})
             response.raise_for_status()
-            posts = response.json()
+            posts = decode_json(response)
             return [post.get("id") for post in posts]
         except (RequestException, ValueError) as e:
-            print(f"[Error] Failed to fetch favorite posts from {url!r}: {e}")
+            tprint(f"[Error] Failed to fetch favorite posts from {url!r}: {e}")
             return None
 
     def download_favorite_creators(self, domain: str) -> None:
+        self.download_batch([], favorite_domains=[domain])
+
+    def favorite_creator_jobs(self, domain: str) -> List[CreatorJob]:
         if not self.isLoggedin(domain):
-            print(f"[Error] You are not logged into {domain!r}")
-            return
+            tprint(f"[Error] You are not logged into {domain!r}")
+            return []
 
         creators = self.get_favorit_creators(domain)
 
         if creators is None:
-            return
+            return []
+
+        return [CreatorJob(domain, creator.service, creator.id) for creator in creators]
+
+    def download_creators(self, domain: str, creators: Iterable[tuple[str, str]]) -> None:
+        """Download every post of the given (service, creator_id) pairs through the staged pipeline."""
+        self.run_pipeline(CreatorJob(domain, service, creator_id) for service, creator_id in creators)
 
-        for creator in creators:
-            post_ids = self.get_all_creator_post_ids(domain, creator.service, creator.id)
-            for post_id in post_ids:
-                time.sleep(0.5)
-                post = self.get_post(domain, creator.service, creator.id, post_id)
-                if post:
-                    self.download_post(domain, post)
+    def run_pipeline(self, jobs: Iterable[CreatorJob]) -> None:
+        PostPipeline(self, self.queue_size, self.fetch_workers, self.post_workers, self.parallel_creators, self.max_posts_per_domain).run(jobs)
 
     def download_favorite_posts(self, domain: str):
         pass
 
-    def download_url(self, url: str) -> None:
+    def url_job(self, url: str) -> CreatorJob | None:
         parsed_url = self.parse_url(url)
 
         if parsed_url is None:
-            print("Invalid URL:" + url)
-            return
+            tprint("Invalid URL:" + url)
+            return None
 
         domain = KemonoDL.KEMONO_DOMAIN if parsed_url["site"] == "kemono" else KemonoDL.COOMER_DOMAIN
-        if parsed_url["post_id"]:
-            post = self.get_post(domain, parsed_url["service"], parsed_url["creator_id"], parsed_url["post_id"])
+        return CreatorJob(domain, parsed_url["service"], parsed_url["creator_id"], parsed_url["post_id"])
+
+    def download_url(self, url: str) -> None:
+        job = self.url_job(url)
+
+        if job is None:
+            return
+
+        if job.post_id:
+            post = self.get_post(job.domain, job.service, job.creator_id, job.post_id)
             if post:
-                self.download_post(domain, post)
+                self.download_post(job.domain, post)
         else:
-            post_ids = self.get_all_creator_post_ids(domain, parsed_url["service"], parsed_url["creator_id"])
-            for post_id in post_ids:
-                time.sleep(0.5)
-                post = self.get_post(domain, parsed_url["service"], parsed_url["creator_id"], post_id)
-                if post:
-                    self.download_post(domain, post)
+            self.download_creators(job.domain, [(job.service, job.creator_id)])
+
+    def download_batch(self, urls: Iterable[str], favorite_domains: Iterable[str] = ()) -> None:
+        """Download the favorite creators of `favorite_domains` and every url in one pipeline run.
+
+        Creators are scheduled together, `parallel_creators` of them listed at a time.
+        """
+
+        def jobs() -> Iterator[CreatorJob]:
+            for domain in favorite_domains:
+                yield from self.favorite_creator_jobs(domain)
+            for url in urls:
+                job = self.url_job(url)
+                if job:
+                    yield job
+
+        self.run_pipeline(jobs())
 
     def download_creator_banner(self, domain: str, service: str, creator_id: str) -> None:
         self._download_special(domain, service, creator_id, "banner")
@@ -267,23 +441,29 @@ class KemonoDL:
         # )
 
     def download_post(self, domain: str, post: Post) -> None:
-        if f"{post.service}/user/{post.user}/post/{post.id}" in self.archived_posts:
-            print(f"[info] Post {post.id!r} already archived. Skipping.")
+        if archive_key(post.service, post.user, post.id) in self.archive:
+            tprint(f"[info] Post {post.id!r} already archived. Skipping.")
+            self.post_skipped(post, "archive")
             return
 
         if self.post_matches_filters(post):
-            print(f"[info] Post {post.id!r} matched 1 or more post filters. Skipping.")
+            tprint(f"[info] Post {post.id!r} matched 1 or more post filters. Skipping.")
+            self.post_skipped(post, "filter")
             return
 
         printable_title = re.sub(r'[<>:"/\\|?*\x00-\x1F]', "_", post.title)[:50]
-        print(f"[downloading] Post: {printable_title}")
+        tprint(f"[downloading] Post: {printable_title}")
 
         creator = self.get_creator_profile(domain, post.service, post.user)
         if creator is None:
             return
 
+        if self.planner:
+            self.plan_post(domain, creator, post)
+            return
+
         if self.skip_attachments:
-            print("[info] Skipping Post attachments.")
+            tprint("[info] Skipping Post attachments.")
         else:
             self.download_post_attachments(domain, creator, post)
 
@@ -291,61 +471,243 @@ class KemonoDL:
             self.write_post_content(creator, post)
 
         self.write_archive_file(domain, post.service, post.user, post.id)
+        self.metrics.count("posts_downloaded_total")
+        self.metrics.event("post_done", service=post.service, creator_id=post.user, post_id=post.id)
 
-    def download_post_attachments(self, domain: str, creator: Creator, post: Post) -> None:
-        if not post.attachments:
-            return
+    def post_skipped(self, post: Post, reason: str) -> None:
+        self.metrics.count("posts_skipped_total", reason=reason)
+        self.metrics.event("post_skipped", reason=reason, service=post.service, creator_id=post.user, post_id=post.id)
+
+    def file_skipped(self, file_path: str | None, reason: str) -> None:
+        self.metrics.count("files_skipped_total", reason=reason)
+        self.metrics.event("file_skipped", reason=reason, path=file_path)
 
-        print(f"[downloading] Attachments: {len(post.attachments)}")
+    def plan_post(self, domain: str, creator: Creator, post: Post) -> None:
+        """Write the files `download_post` would create to the plan, after the same filter and overwrite checks."""
+        post_entry = {"domain": domain, "service": post.service, "creator_id": post.user, "post_id": post.id}
+        entries = []
 
-        for attachment in post.attachments:
+        for attachment in [] if self.skip_attachments else post.attachments:
             if self.attachment_matches_filters(attachment):
-                print("[info] Attachment matched 1 or more attachment filters. Skipping.")
                 continue
-
             template_variables = FileTemplateVaribales(creator, post, attachment)
-
             file_path = generate_file_path(
                 self.path,
                 self.output_templates.get("attachments", {}),
                 template_variables.toDict(self.custom_template_variables),
                 self.restrict_names,
             )
-            expected_sha256 = template_variables.sha256
-
-            if os.path.exists(file_path):
-                actual_sha256 = get_sha256_hash(file_path)
+            if self.keep_existing_file(file_path, template_variables.sha256):
+                continue
+            entries.append(
+                {
+                    "type": "attachment",
+                    **post_entry,
+                    "url": f"{attachment.server}/data{attachment.path}",
+                    "server": attachment.server,
+                    "path": attachment.path,
+                    "name": attachment.name,
+                    "file_path": file_path,
+                    "sha256": template_variables.sha256,
+                    "size": None,
+                }
+            )
 
-                if self.force_overwrite is False:
-                    print(f"[info] File already exists at {file_path}")
-                    if expected_sha256 != actual_sha256:
-                        print(f'[warning] File sha256 mismatch. Expected "{expected_sha256}" recieved"{actual_sha256}"')
+        if self.write_content:
+            sha256 = compute_sha256(post.content)
+            template_variables = FileTemplateVaribales(creator, post, Attachment(name="content.html", path=f"{sha256}.html"))
+            file_path = generate_file_path(
+                self.path,
+                self.output_templates.get("content", {}),
+                template_variables.toDict(self.custom_template_variables),
+                self.restrict_names,
+            )
+            if not self.keep_existing_file(file_path, sha256):
+                entries.append({"type": "content", **post_entry, "file_path": file_path, "sha256": sha256, "size": len(post.content.encode("utf-8")), "content": post.content})
+
+        tprint(f"[plan] Post {post.id!r}: {len(entries)} files")
+        self.planner.write_post(post_entry, entries)
+
+    def download_plan(self, plan_file: str) -> None:
+        """Download the files of a plan written by `plan_post`, without fetching any post metadata.
+
+        Files run `concurrent_downloads * post_workers` at a time; a post is added to the archive
+        once all of its files are done.
+        """
+        workers = max(self.concurrent_downloads, 1) * max(self.post_workers, 1)
+        # bounds how far reading the plan runs ahead of the downloads
+        slots = threading.BoundedSemaphore(workers * max(self.queue_size, 1))
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kemono-dl-plan") as executor:
+            for post_entry, entries in read_plan(plan_file):
+                if archive_key(post_entry["service"], post_entry["creator_id"], post_entry["post_id"]) in self.archive:
+                    tprint(f"[info] Post {post_entry['post_id']!r} already archived. Skipping.")
                     continue
+                post = Post({"post": {"id": post_entry["post_id"], "user": post_entry["creator_id"], "service": post_entry["service"]}})
+                state = {"remaining": len(entries), "failed": False, "lock": threading.Lock()}
+                if not entries:
+                    self.write_archive_file(post_entry["domain"], post.service, post.user, post.id)
+                for entry in entries:
+                    slots.acquire()
+                    future = executor.submit(self._run_plan_entry, post_entry, post, entry, state)
+                    future.add_done_callback(lambda _: slots.release())
+
+    def _run_plan_entry(self, post_entry: dict, post: Post, entry: dict, state: dict) -> None:
+        try:
+            if entry["type"] == "content":
+                self.write_content_to(post, entry["file_path"], entry["sha256"], entry["content"])
+                ok = True
+            else:
+                attachment = Attachment(name=entry["name"], path=entry["path"], server=entry["server"])
+                ok = self.download_attachment_to(post, attachment, entry["file_path"], entry["sha256"], entry.get("size"))
+        except Exception as e:
+            tprint(f"[Error] Failed to run plan entry {entry['file_path']!r}: {e}")
+            ok = False
+
+        with state["lock"]:
+            state["remaining"] -= 1
+            state["failed"] |= not ok
+            done = state["remaining"] == 0 and not state["failed"]
+        if done:
+            self.write_archive_file(post_entry["domain"], post.service, post.user, post.id)
 
-                elif self.force_overwrite == "soft" and expected_sha256 == actual_sha256:
-                    print(f"[info] File already exists with matching sha256 at {file_path}")
-                    continue
+    def download_post_attachments(self, domain: str, creator: Creator, post: Post) -> None:
+        if not post.attachments:
+            return
+
+        tprint(f"[downloading] Attachments: {len(post.attachments)}")
+
+        if self.concurrent_downloads <= 1:
+            for attachment in post.attachments:
+                if not self.download_attachment(creator, post, attachment):
+                    return
+            return
+
+        with ThreadPoolExecutor(max_workers=self.concurrent_downloads, thread_name_prefix="kemono-dl") as executor:
+            futures = [executor.submit(self.download_attachment, creator, post, attachment) for attachment in post.attachments]
+            for future in as_completed(futures):
+                if not future.cancelled() and not future.result():
+                    # match the sequential behaviour: stop starting new attachments once one has exhausted its retries
+                    for pending in futures:
+                        pending.cancel()
+
+    def download_attachment(self, creator: Creator, post: Post, attachment: Attachment) -> bool:
+        """Download a single attachment. Returns False only when every download retry failed."""
+        if self.attachment_matches_filters(attachment):
+            tprint("[info] Attachment matched 1 or more attachment filters. Skipping.")
+            self.file_skipped(attachment.name, "filter")
+            return True
+
+        template_variables = FileTemplateVaribales(creator, post, attachment)
+
+        file_path = generate_file_path(
+            self.path,
+            self.output_templates.get("attachments", {}),
+            template_variables.toDict(self.custom_template_variables),
+            self.restrict_names,
+        )
+        expected_sha256 = template_variables.sha256
+
+        return self.download_attachment_to(post, attachment, file_path, expected_sha256)
 
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    def download_attachment_to(self, post: Post, attachment: Attachment, file_path: str, expected_sha256: str, expected_size: int | None = None) -> bool:
+        """Download the attachment to an already generated `file_path`, unless an existing file is kept."""
+        if self.keep_existing_file(file_path, expected_sha256):
+            return True
 
-            url = f"{attachment.server}/data{attachment.path}"
+        self.make_post_dirs(post, os.path.dirname(file_path))
 
+        with self.blob_store.claim(expected_sha256) if self.blob_store else nullcontext():
+            if self.blob_store and self.blob_store.link(expected_sha256, file_path):
+                tprint(f"[info] Linked {file_path} to the stored copy of {expected_sha256}")
+                self.file_skipped(file_path, "linked")
+                actual_sha256 = expected_sha256
+            else:
+                actual_sha256 = self.fetch_attachment(attachment, file_path, expected_size)
+                if actual_sha256 is None:
+                    return False
+
+                if expected_sha256 != actual_sha256:
+                    tprint(f"[Error] File downloaded with incorrect SHA-256. Expected: {expected_sha256} Actual: {actual_sha256}")
+                elif self.blob_store:
+                    self.blob_store.add(file_path, actual_sha256)
+
+        if self.hash_cache:
+            self.hash_cache.store(file_path, actual_sha256)
+        self.record_written(post, "files", file_path)
+        return True
+
+    def keep_existing_file(self, file_path: str, expected_sha256: str) -> bool:
+        """True when `file_path` exists and the overwrite mode says to keep it."""
+        if not os.path.exists(file_path):
+            return False
+
+        actual_sha256 = self.file_sha256(file_path)
+
+        if self.force_overwrite is False:
+            tprint(f"[info] File already exists at {file_path}")
+            if expected_sha256 != actual_sha256:
+                tprint(f'[warning] File sha256 mismatch. Expected "{expected_sha256}" recieved"{actual_sha256}"')
+            self.file_skipped(file_path, "exists")
+            return True
+
+        elif self.force_overwrite == "soft" and expected_sha256 == actual_sha256:
+            tprint(f"[info] File already exists with matching sha256 at {file_path}")
+            self.file_skipped(file_path, "hash")
+            return True
+
+        return False
+
+    def fetch_attachment(self, attachment: Attachment, file_path: str, expected_size: int | None = None) -> str | None:
+        """Download the attachment to `file_path`, retrying on failure. Returns the sha256 of the file or None."""
+        url = f"{attachment.server}/data{attachment.path}"
+        # an existing output may be linked to a stored blob, writing into it in place would change the blob
+        # and every other output linked to it, so with a blob store the file is always replaced from a .tmp file
+        temp_file = not self.no_tmp or self.blob_store is not None
+
+        with self._host_slot(attachment.server):
             for attempt in range(self.max_retries):
+                if attempt:
+                    self.metrics.count("retries_total", reason="download")
+                start = time.perf_counter()
                 try:
-                    download_file(self.session, url, file_path, temp_file=not self.no_tmp)
-                    break
+                    with self.metrics.phase("download"):
+                        if self.segments > 1:
+                            sha256 = download_file_segmented(
+                                self.session,
+                                url,
+                                file_path,
+                                segments=self.segments,
+                                min_size=self.segment_threshold,
+                                temp_file=temp_file,
+                                progress=self.progress,
+                            )
+                        else:
+                            sha256 = download_file(self.session, url, file_path, temp_file=temp_file, progress=self.progress, expected_size=expected_size)
                 except Exception as e:
-                    print(f"[Error] Failed to download attachment from {url!r}: {e}")
-            else:
-                print(f"[Error] All {self.max_retries} download reties failed")
-                return
+                    tprint(f"[Error] Failed to download attachment from {url!r}: {e}")
+                    self.metrics.event("download_error", url=url, path=file_path, attempt=attempt + 1, error=str(e))
+                    continue
 
-            actual_sha256 = get_sha256_hash(file_path)
-            if expected_sha256 != actual_sha256:
-                print(f"[Error] File downloaded with incorrect SHA-256. Expected: {expected_sha256} Actual: {actual_sha256}")
+                self.metrics.count("files_downloaded_total")
+                size = os.path.getsize(file_path) if os.path.isfile(file_path) else None
+                self.metrics.event("file_downloaded", url=url, path=file_path, size=size, seconds=round(time.perf_counter() - start, 3))
+                return sha256
+
+        tprint(f"[Error] All {self.max_retries} download reties failed")
+        self.metrics.count("download_failures_total")
+        self.metrics.event("download_failed", url=url, path=file_path)
+        return None
+
+    def _host_slot(self, host: str | None) -> threading.BoundedSemaphore:
+        with self._host_slots_lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.max_connections_per_host)
+            return slot
 
     def write_post_content(self, creator: Creator, post: Post) -> None:
-        print("[writing] Post Content")
+        tprint("[writing] Post Content")
 
         sha256 = compute_sha256(post.content)
         attachment = Attachment(name="content.html", path=f"{sha256}.html")
@@ -356,27 +718,69 @@ class KemonoDL:
             template_variables.toDict(self.custom_template_variables),
             self.restrict_names,
         )
-        expected_sha256 = template_variables.sha256
+        self.write_content_to(post, file_path, template_variables.sha256, post.content)
 
-        if os.path.exists(file_path):
-            actual_sha256 = get_sha256_hash(file_path)
+    def write_content_to(self, post: Post, file_path: str, expected_sha256: str, content: str) -> None:
+        if self.keep_existing_file(file_path, expected_sha256):
+            return
 
-            if self.force_overwrite is False:
-                print(f"[info] File already exists at {file_path}")
-                if expected_sha256 != actual_sha256:
-                    print(f'[warning] File sha256 mismatch. Expected "{expected_sha256}" recieved"{actual_sha256}"')
-                return
+        self.make_post_dirs(post, os.path.dirname(file_path))
 
-            elif self.force_overwrite == "soft" and expected_sha256 == actual_sha256:
-                print(f"[info] File already exists with matching sha256 at {file_path}")
-                return
+        tprint(f"[writing] Destination: {file_path!r}")
 
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+        if self.hash_cache:
+            with self.metrics.phase("hash"):
+                self.hash_cache.store(file_path, get_sha256_hash(file_path))
+        self.metrics.count("files_written_total")
+        self.metrics.event("file_written", path=file_path)
+        self.record_written(post, "files", file_path)
+
+    def make_post_dirs(self, post: Post, dir_path: str) -> None:
+        """`os.makedirs` that records the directories it created for the post."""
+        if not self.track_written:
+            os.makedirs(dir_path, exist_ok=True)
+            return
 
-        print(f"[writing] Destination: {file_path!r}")
+        missing = []
+        parent = os.path.abspath(dir_path)
+        while not os.path.isdir(parent) and parent != os.path.dirname(parent):
+            missing.append(parent)
+            parent = os.path.dirname(parent)
+        os.makedirs(dir_path, exist_ok=True)
+        for path in reversed(missing):
+            self.record_written(post, "directories", path)
+
+    def record_written(self, post: Post, kind: str, path: str) -> None:
+        if self.on_file_written and kind == "files":
+            self.on_file_written(os.path.abspath(path))
+        if not self.track_written:
+            return
+        with self._written_lock:
+            written = self.written.setdefault((post.service, post.user, post.id), {"files": [], "directories": []})
+            written[kind].append(os.path.abspath(path))
 
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(post.content)
+    def written_by_url(self, url: str) -> dict[str, list[str]]:
+        """The files and directories this run wrote for the posts of `url` (needs `track_written`)."""
+        parsed_url = self.parse_url(url)
+        written: dict[str, list[str]] = {"files": [], "directories": []}
+        if parsed_url is None:
+            return written
+        with self._written_lock:
+            for (service, creator_id, post_id), post_written in self.written.items():
+                if service == parsed_url["service"] and creator_id == parsed_url["creator_id"] and parsed_url["post_id"] in (None, post_id):
+                    written["files"] += post_written["files"]
+                    written["directories"] += post_written["directories"]
+        # attachments of one post downloading at once may both create the same directory
+        return {kind: list(dict.fromkeys(paths)) for kind, paths in written.items()}
+
+    def write_manifest(self, manifest_file: str, urls: Iterable[str]) -> None:
+        """Write one json line per url with the files and directories it produced."""
+        with open(manifest_file, "w", encoding="utf-8") as f:
+            for url in urls:
+                f.write(json.dumps({"url": url, **self.written_by_url(url)}, ensure_ascii=False) + "\n")
 
     def attachment_matches_filters(self, attachment) -> bool:
         skip_extensions = self.attachment_filters.get("skip_extensions", None)
@@ -387,6 +791,9 @@ class KemonoDL:
 
         return False
 
+    def has_post_filters(self) -> bool:
+        return any(value for post_filter in self.post_filters.values() for value in post_filter.values())
+
     def post_matches_filters(self, post: Post) -> bool:
         date_filter = self.post_filters.get("date", {})
         datebefore_filter = self.post_filters.get("datebefore", {})
@@ -394,12 +801,16 @@ class KemonoDL:
         date_fields = ("added", "edited", "published")
 
         for field in date_fields:
+            date, before, after = date_filter.get(field), datebefore_filter.get(field), dateafter_filter.get(field)
+            if not (date or before or after):
+                # don't parse dates no filter looks at
+                continue
             post_val = getattr(post, field)
-            if (val := date_filter.get(field)) and post_val.date() != val.date():
+            if date and post_val.date() != date.date():
                 return True
-            if (val := datebefore_filter.get(field)) and post_val.date() > val.date():
+            if before and post_val.date() > before.date():
                 return True
-            if (val := dateafter_filter.get(field)) and post_val.date() < val.date():
+            if after and post_val.date() < after.date():
                 return True
 
         return False
@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from .logging import logger
+from .utils import tprint
+
+PREFIX = "kemono_dl_"
+
+# name -> (type, help); every metric a run can report
+METRICS = {
+    "http_requests_total": ("counter", "HTTP responses received, by kind (api or data) and status code."),
+    "downloaded_bytes_total": ("counter", "Bytes of attachments received, including downloads still running."),
+    "files_downloaded_total": ("counter", "Attachments downloaded."),
+    "files_written_total": ("counter", "Post content files written."),
+    "files_skipped_total": ("counter", "Files not downloaded, by reason (filter, exists, hash or linked)."),
+    "posts_downloaded_total": ("counter", "Posts whose attachments were all handled."),
+    "posts_skipped_total": ("counter", "Posts not downloaded, by reason (archive or filter)."),
+    "retries_total": ("counter", "Requests repeated, by reason (throttled or download)."),
+    "download_failures_total": ("counter", "Attachments that failed every download retry."),
+    "phase_seconds_total": ("counter", "Seconds spent in each phase (list, fetch, download, hash), summed over all threads."),
+    "phase_calls_total": ("counter", "Times each phase was entered."),
+}
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Metrics:
+    """Counters and phase timers of a run, for graphing long runs.
+
+    With `event_log` notable events (files downloaded or skipped, retries, finished
+    posts) and a snapshot of every counter each `interval` seconds are appended to a
+    json lines file through the `kemono_dl.events` logger. With `prometheus_file` the
+    counters are written in the Prometheus text format every `interval` seconds, for
+    the node exporter textfile collector. Counting works without either.
+    """
+
+    def __init__(self, event_log: str | None = None, prometheus_file: str | None = None, interval: float = 15.0) -> None:
+        self.prometheus_file = prometheus_file
+        self.interval = interval
+        self._counters: dict[tuple[str, Labels], float] = {}
+        self._callbacks: dict[str, Callable[[], float]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        self._events: logging.Logger | None = None
+        self._handler: logging.Handler | None = None
+        if event_log:
+            self._events = logger.getChild("events")
+            self._events.setLevel(logging.INFO)
+            self._events.propagate = False
+            self._handler = logging.FileHandler(event_log, mode="a", encoding="utf-8")
+            self._handler.setFormatter(logging.Formatter("%(message)s"))
+            self._events.addHandler(self._handler)
+
+        if event_log or prometheus_file:
+            self._thread = threading.Thread(target=self._run, name="kemono-dl-metrics", daemon=True)
+            self._thread.start()
+
+    def count(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, callback: Callable[[], float]) -> None:
+        """Report the value of `callback()` as `name`, for totals kept elsewhere."""
+        self._callbacks[name] = callback
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                for metric, amount in (("phase_seconds_total", elapsed), ("phase_calls_total", 1)):
+                    key = (metric, (("phase", name),))
+                    self._counters[key] = self._counters.get(key, 0) + amount
+
+    def event(self, event: str, **fields) -> None:
+        if self._events:
+            self._events.info(json.dumps({"time": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False, default=str))
+
+    def value(self, name: str, **labels: str) -> float:
+        if name in self._callbacks:
+            return self._callbacks[name]()
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def snapshot(self) -> dict[tuple[str, Labels], float]:
+        with self._lock:
+            counters = dict(self._counters)
+        for name, callback in self._callbacks.items():
+            counters[(name, ())] = callback()
+        return counters
+
+    def render_prometheus(self) -> str:
+        by_name: dict[str, list[tuple[Labels, float]]] = {}
+        for (name, labels), value in sorted(self.snapshot().items()):
+            by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, samples in by_name.items():
+            metric_type, help_text = METRICS.get(name, ("untyped", name))
+            lines += [f"# HELP {PREFIX}{name} {help_text}", f"# TYPE {PREFIX}{name} {metric_type}"]
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels)
+                lines.append(f"{PREFIX}{name}{{{label_text}}} {_format_value(value)}" if label_text else f"{PREFIX}{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self) -> None:
+        if not self.prometheus_file:
+            return
+        # the collector may read the file at any time, so it is replaced in one step
+        temp_path = f"{self.prometheus_file}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(temp_path, self.prometheus_file)
+
+    def summary(self) -> str:
+        phases = sorted(
+            (labels[0][1], value) for (name, labels), value in self.snapshot().items() if name == "phase_seconds_total"
+        )
+        if not phases:
+            return "Time spent: nothing measured"
+        return "Time spent: " + ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in phases) + " (summed over threads)"
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._flush()
+        if self._handler and self._events:
+            self._events.removeHandler(self._handler)
+            self._handler.close()
+            self._events = self._handler = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._flush()
+
+    def _flush(self) -> None:
+        try:
+            self.write_prometheus()
+        except OSError as e:
+            tprint(f"[Error] Failed to write metrics to {self.prometheus_file!r}: {e}")
+        if self._events:
+            counters = {_series_name(name, labels): value for (name, labels), value in self.snapshot().items()}
+            self.event("metrics", counters=counters)
+
+
+def _series_name(name: str, labels: Labels) -> str:
+    return name + ("{" + ",".join(f"{key}={label}" for key, label in labels) + "}" if labels else "")
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
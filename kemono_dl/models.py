@@ -1,10 +1,22 @@
-from dataclasses import asdict, dataclass
+import functools
+import threading
+from dataclasses import dataclass, field, fields
 from datetime import datetime
 from os.path import splitext
-from typing import List
+from string import Formatter
+from typing import List, TypedDict
 
+from .utils import tprint
 
-@dataclass
+
+class ParsedUrl(TypedDict):
+    site: str
+    service: str
+    creator_id: str
+    post_id: str | None
+
+
+@dataclass(slots=True)
 class Creator:
     id: str
     name: str
@@ -34,7 +46,7 @@ class FavoriteCreator:
     has_chats: bool | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Attachment:
     name: str
     path: str
@@ -42,7 +54,7 @@ class Attachment:
     server: str | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Post:
     id: str
     user: str
@@ -50,9 +62,11 @@ class Post:
     title: str
     content: str
     shared_file: bool
-    added: datetime
-    published: datetime
-    edited: datetime
+    # the raw api strings, parsed into datetimes on first access (see `added`, `published` and `edited`)
+    _added: str
+    _published: str
+    _edited: str
+    _dates: dict[str, datetime] = field(repr=False, compare=False)
     poll: bool | None  # no idea what type this is
 
     embed: dict
@@ -72,77 +86,74 @@ class Post:
         self.content = post.get("content", "")
         self.shared_file = post.get("shared_file", False)
 
-        try:
-            self.added = datetime.fromisoformat(post.get("added", ""))
-        except Exception:
-            print(f"[Warning] Invalid isoformat string for `added`: '{post.get('added', '')}' ")
-            self.added = datetime.min
-
-        try:
-            self.published = datetime.fromisoformat(post.get("published", ""))
-        except Exception:
-            print(f"[Warning] Invalid isoformat string for `published`: '{post.get('published', '')}' ")
-            self.published = datetime.min
-
-        try:
-            self.edited = datetime.fromisoformat(post.get("edited", ""))
-        except Exception:
-            print(f"[Warning] Invalid isoformat string for `edited`: '{post.get('edited', '')}' ")
-            self.edited = datetime.min
+        self._added = post.get("added", "")
+        self._published = post.get("published", "")
+        self._edited = post.get("edited", "")
+        self._dates = {}
 
         self.poll = post.get("poll", None)
         self.embed = post.get("embed", {})
 
         self.attachments = []
 
-        file = post.get("file")
-        file_name = file.get("name", findNameFromPath(attachments, previews, file.get("path")))
-        file_path = file.get("path", None)
-        if file and file_name and file_path:
-            self.attachments.append(
-                Attachment(
-                    name=file_name,
-                    path=file_path,
-                    index=len(self.attachments),
-                    server=findSeverFromPath(attachments, previews, file_path),
-                )
-            )
+        # the server (and fallback name) of every file is looked up by path, index them once
+        paths = index_paths(attachments, previews)
 
-        for a in post.get("attachments", []):
-            a_name = a.get("name", findNameFromPath(attachments, previews, a.get("path")))
+        for a in (post.get("file") or {}, *(post.get("attachments") or [])):
             a_path = a.get("path", None)
+            server, indexed_name = paths.get(a_path, (None, None))
+            a_name = a["name"] if "name" in a else indexed_name
             if a and a_name and a_path:
                 self.attachments.append(
                     Attachment(
                         name=a_name,
                         path=a_path,
                         index=len(self.attachments),
-                        server=findSeverFromPath(attachments, previews, a_path),
+                        server=server,
                     )
                 )
 
         self.captions = post.get("captions", None)
         self.tags = post.get("tags", None)
 
+    @property
+    def added(self) -> datetime:
+        return self._date("added", self._added)
+
+    @property
+    def published(self) -> datetime:
+        return self._date("published", self._published)
+
+    @property
+    def edited(self) -> datetime:
+        return self._date("edited", self._edited)
+
+    def _date(self, name: str, value: str) -> datetime:
+        date = self._dates.get(name)
+        if date is None:
+            date = self._dates[name] = _parse_date(name, value)
+        return date
 
-def findSeverFromPath(attachments, previews, path):
-    for attachment in attachments:
-        if attachment.get("path") == path:
-            return attachment.get("server")
-    for preview in previews:
-        if preview.get("path") == path:
-            return preview.get("server")
-    return None
 
+def _parse_date(name: str, value) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except Exception:
+        tprint(f"[Warning] Invalid isoformat string for `{name}`: '{value}' ")
+        return datetime.min
 
-def findNameFromPath(attachments, previews, path):
-    for attachment in attachments:
-        if attachment.get("path") == path:
-            return attachment.get("name")
-    for preview in previews:
-        if preview.get("path") == path:
-            return preview.get("name")
-    return None
+
+def index_paths(attachments: list[dict] | None, previews: list[dict] | None) -> dict[str, tuple[str | None, str | None]]:
+    """Map every path in the `attachments` and `previews` of a post response to its (server, name).
+
+    The first entry for a path wins, with attachments taking precedence over previews.
+    """
+    paths = {}
+    for entry in (*(attachments or ()), *(previews or ())):
+        path = entry.get("path")
+        if path not in paths:
+            paths[path] = (entry.get("server"), entry.get("name"))
+    return paths
 
 
 @dataclass
@@ -179,9 +190,8 @@ class FileTemplateVaribales:
         self.creator_name = creator.name
         self.post_id = post.id
         self.post_title = post.title
-        self.added = post.added
-        self.published = post.published
-        self.edited = post.edited
+        # added, published and edited are read from the post when used, see `__getattr__`
+        self._post = post
         self.attachments_count = len(post.attachments)
 
         self.server_filename = server_filename
@@ -193,11 +203,93 @@ class FileTemplateVaribales:
         self.sha256 = sha256
         self.index = index
 
-    def toDict(self, custom_variables: dict | None = None) -> dict[str, str]:
-        template_variables_dict = asdict(self)
+    def __getattr__(self, name: str):
+        # only called for attributes __init__ did not set; parsing a date can print a warning, so it waits until a template needs it
+        if name in _DATE_VARIABLES:
+            return getattr(self._post, name)
+        raise AttributeError(name)
+
+    def toDict(self, custom_variables: "dict | CustomTemplateVariables | None" = None) -> dict[str, str]:
+        template_variables_dict = TemplateVariables({name: getattr(self, name) for name in _EAGER_VARIABLE_NAMES})
+        template_variables_dict.post = self._post
 
         if custom_variables:
-            for key, value in custom_variables.items():
-                template_variables_dict[key] = eval(value.format(**template_variables_dict))
+            if not isinstance(custom_variables, CustomTemplateVariables):
+                custom_variables = CustomTemplateVariables(custom_variables)
+            custom_variables.apply(template_variables_dict)
 
         return template_variables_dict
+
+
+_TEMPLATE_VARIABLE_NAMES = tuple(field.name for field in fields(FileTemplateVaribales))
+_DATE_VARIABLES = frozenset(("added", "published", "edited"))
+_EAGER_VARIABLE_NAMES = tuple(name for name in _TEMPLATE_VARIABLE_NAMES if name not in _DATE_VARIABLES)
+# the variables that are the same for every attachment of a post
+_POST_TEMPLATE_VARIABLES = frozenset(("service", "creator_id", "creator_name", "post_id", "post_title", "attachments_count", "added", "published", "edited"))
+
+
+class TemplateVariables(dict):
+    """The template variables of a file. The post dates are only parsed when a template looks them up."""
+
+    post: Post
+
+    def __missing__(self, key: str):
+        if key not in _DATE_VARIABLES:
+            raise KeyError(key)
+        value = self[key] = getattr(self.post, key)
+        return value
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile_expression(source: str):
+    return compile(source, "<custom template variable>", "eval")
+
+
+class CustomTemplateVariables:
+    """User defined template variables, evaluated the same way as before but compiled once.
+
+    Each value is a python expression that is first formatted with the template variables and
+    then evaluated. The formatted expressions are compiled once per distinct source, and values
+    that only reference post variables are evaluated once per post instead of once per file.
+    """
+
+    def __init__(self, variables: dict[str, str], cached_posts: int = 32) -> None:
+        self.variables = variables
+        self.cached_posts = cached_posts
+        # (name, expression, depends only on the post)
+        self._compiled: list[tuple[str, str, bool]] = []
+        self._post_values: dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+
+        post_variables = set(_POST_TEMPLATE_VARIABLES)
+        for name, expression in variables.items():
+            try:
+                references = {field.split(".")[0].split("[")[0] for _, field, _, _ in Formatter().parse(expression) if field}
+                post_only = bool(references) and references <= post_variables
+            except ValueError:
+                # leave malformed expressions to fail the same way they always did
+                post_only = False
+            if post_only:
+                post_variables.add(name)
+            self._compiled.append((name, expression, post_only))
+
+    def __bool__(self) -> bool:
+        return bool(self.variables)
+
+    def apply(self, template_variables: dict) -> None:
+        post_key = (template_variables.get("service"), template_variables.get("creator_id"), template_variables.get("post_id"))
+        with self._lock:
+            post_values = self._post_values.get(post_key)
+            if post_values is None:
+                if len(self._post_values) >= self.cached_posts:
+                    del self._post_values[next(iter(self._post_values))]
+                post_values = self._post_values[post_key] = {}
+
+        for name, expression, post_only in self._compiled:
+            if post_only and name in post_values:
+                template_variables[name] = post_values[name]
+                continue
+            value = eval(_compile_expression(expression.format_map(template_variables)))
+            template_variables[name] = value
+            if post_only:
+                post_values[name] = value
@@ -0,0 +1,312 @@
+import threading
+import time
+from collections import Counter, deque
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Iterable, NamedTuple
+
+from .archive import SyncMark
+from .utils import tprint
+
+if TYPE_CHECKING:
+    from .kemono_dl import KemonoDL
+
+_DONE = object()
+
+
+class CreatorJob(NamedTuple):
+    domain: str
+    service: str
+    creator_id: str
+    # only this post of the creator, for post urls
+    post_id: str | None = None
+
+
+class CreatorSync:
+    """Tracks one creator through the pipeline.
+
+    The creator counts as synced, and its sync mark is stored, only after its listing
+    finished and every listed post was fetched and downloaded without an error.
+    """
+
+    def __init__(self, domain: str, service: str, creator_id: str, since: SyncMark | None, post_id: str | None = None) -> None:
+        self.domain = domain
+        self.service = service
+        self.creator_id = creator_id
+        self.since = since
+        self.post_id = post_id
+        self.newest: SyncMark | None = None
+        self.failed = False
+        self.posts = 0
+        self.failed_posts = 0
+        # posts listed that another job of this run had already queued
+        self.shared_posts = 0
+        self.start_time = time.monotonic()
+        self._pending = 0
+        self._listed = False
+        self._lock = threading.Lock()
+
+    def post_listed(self) -> None:
+        with self._lock:
+            self._pending += 1
+            self.posts += 1
+
+    def listing_done(self, failed: bool = False) -> bool:
+        with self._lock:
+            self._listed = True
+            self.failed |= failed
+            return self._pending == 0
+
+    def post_done(self, failed: bool = False) -> bool:
+        with self._lock:
+            self._pending -= 1
+            self.failed |= failed
+            self.failed_posts += failed
+            return self._listed and self._pending == 0
+
+
+class FairQueue:
+    """A bounded queue that hands out the items of several creators round-robin.
+
+    Each key (a creator) holds at most `maxsize` items, so one large creator cannot
+    fill the queue ahead of the others. With `total_size`, all keys together hold at
+    most that many items, so neither can many creators that are still queued.
+    With `group_limit`, at most that many items of one group (a domain) are handed out
+    at once; `task_done` gives the slot back.
+    """
+
+    def __init__(self, maxsize: int, group_limit: int = 0, total_size: int = 0) -> None:
+        self.maxsize = max(maxsize, 1)
+        self.total_size = max(total_size, 0)
+        self.group_limit = group_limit
+        # dict order is the round-robin order, a key moves to the back when an item is taken
+        self._queues: dict[Hashable, deque] = {}
+        self._groups: dict[Hashable, Hashable] = {}
+        self._active: Counter = Counter()
+        self._closed = False
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def put(self, key: Hashable, group: Hashable, item: Any) -> None:
+        with self._cond:
+            while (self.total_size and self._size >= self.total_size) or len(self._queues.get(key, ())) >= self.maxsize:
+                self._cond.wait()
+            if key not in self._queues:
+                self._queues[key] = deque()
+                self._groups[key] = group
+            self._queues[key].append(item)
+            self._size += 1
+            self._cond.notify_all()
+
+    def get(self) -> tuple[Hashable, Any]:
+        """Return (group, item) of the next creator in turn, or (None, _DONE) once closed and empty."""
+        with self._cond:
+            while True:
+                for key, items in self._queues.items():
+                    group = self._groups[key]
+                    if self.group_limit and self._active[group] >= self.group_limit:
+                        continue
+                    item = items.popleft()
+                    del self._queues[key]
+                    if items:
+                        self._queues[key] = items
+                    else:
+                        del self._groups[key]
+                    self._size -= 1
+                    self._active[group] += 1
+                    self._cond.notify_all()
+                    return group, item
+                if self._closed and not self._queues:
+                    return None, _DONE
+                self._cond.wait()
+
+    def task_done(self, group: Hashable) -> None:
+        with self._cond:
+            self._active[group] -= 1
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def qsize(self) -> int:
+        return self._size
+
+
+class PostPipeline:
+    """Overlaps the three stages of a creator download, for several creators at once.
+
+    listing: pages through the creators' posts and queues post ids, `listing_workers` creators at a time
+    fetch:   fetches the post details for queued ids
+    download: downloads the fetched posts
+
+    Stages talk through bounded fair queues, so when downloading falls behind the fetch and
+    listing stages block instead of piling up metadata in memory, and a creator with thousands
+    of posts shares the workers with the small creators listed next to it.
+    """
+
+    def __init__(
+        self,
+        kemono_dl: "KemonoDL",
+        queue_size: int = 16,
+        fetch_workers: int = 1,
+        download_workers: int = 1,
+        listing_workers: int = 1,
+        domain_limit: int = 0,
+    ) -> None:
+        self.kemono_dl = kemono_dl
+        self.queue_size = max(queue_size, 1)
+        self.fetch_workers = max(fetch_workers, 1)
+        self.download_workers = max(download_workers, 1)
+        self.listing_workers = max(listing_workers, 1)
+        self.domain_limit = max(domain_limit, 0)
+        self.creators_done = 0
+        # (service, creator_id, post_id) -> the job that queued the post, so a post reached
+        # twice in one run (a creator in both a batch file and the favorites, a post url next
+        # to its creator's url, or a post pushed onto the next listing page) is downloaded once
+        self._queued_posts: dict[tuple[str, str, str], CreatorSync] = {}
+        self._jobs: set[tuple[str, str, str | None]] = set()
+        self._lock = threading.Lock()
+
+    def run(self, jobs: Iterable[CreatorJob]) -> None:
+        jobs = iter(jobs)
+        # a stage queues up to `queue_size` posts per creator being listed, however many creators have posts queued
+        total_size = self.queue_size * self.listing_workers
+        post_id_queue = FairQueue(self.queue_size, total_size=total_size)
+        post_queue = FairQueue(self.queue_size, self.domain_limit, total_size)
+        self.kemono_dl.progress.queue_depth = post_queue.qsize
+
+        listers = [threading.Thread(target=self._list_posts, args=(jobs, post_id_queue), name=f"kemono-dl-list-{i}", daemon=True) for i in range(self.listing_workers)]
+        fetchers = [threading.Thread(target=self._fetch_posts, args=(post_id_queue, post_queue), name=f"kemono-dl-fetch-{i}", daemon=True) for i in range(self.fetch_workers)]
+        downloaders = [threading.Thread(target=self._download_posts, args=(post_queue,), name=f"kemono-dl-download-{i}", daemon=True) for i in range(self.download_workers)]
+        for thread in listers + fetchers + downloaders:
+            thread.start()
+
+        # each stage is closed once every producer feeding it has finished
+        for thread in listers:
+            _join(thread)
+        post_id_queue.close()
+        for thread in fetchers:
+            _join(thread)
+        post_queue.close()
+        for thread in downloaders:
+            _join(thread)
+
+    def _next_job(self, jobs: Iterable[CreatorJob]) -> CreatorJob | None:
+        with self._lock:
+            return next(jobs, None)  # type: ignore[call-overload]
+
+    def _first_job(self, job: CreatorJob) -> bool:
+        key = (job.service, job.creator_id, job.post_id)
+        with self._lock:
+            if key in self._jobs:
+                return False
+            self._jobs.add(key)
+            return True
+
+    def _list_posts(self, jobs: Iterable[CreatorJob], post_id_queue: FairQueue) -> None:
+        try:
+            while (job := self._next_job(jobs)) is not None:
+                if not self._first_job(job):
+                    name = f"Post {job.post_id!r}" if job.post_id else f"Creator {job.creator_id!r}"
+                    tprint(f"[info] {name} ({job.service}) is already in this run. Skipping.")
+                    continue
+                since = None if job.post_id else self.kemono_dl.get_sync_mark(job.service, job.creator_id)
+                sync = CreatorSync(job.domain, job.service, job.creator_id, since, job.post_id)
+                if job.post_id:
+                    self._queue_post(sync, job.post_id, post_id_queue)
+                    listed = True
+                else:
+                    listed = _guarded(self._list_creator, sync, post_id_queue)
+                if sync.listing_done(failed=listed is not True):
+                    self._creator_done(sync)
+        except Exception as e:
+            tprint(f"[Error] Failed to list posts: {e}")
+
+    def _list_creator(self, sync: CreatorSync, post_id_queue: FairQueue) -> bool:
+        """Queue the creator's posts, newest first, until reaching the last synced post. False if a page failed."""
+        offset = 0
+        while True:
+            posts = self.kemono_dl.get_creator_posts(sync.domain, sync.service, sync.creator_id, offset)
+            if posts is None:
+                return False
+            for post in posts:
+                if sync.newest is None:
+                    sync.newest = SyncMark(post.get("id"), post.get("published"))
+                if sync.since and sync.since.reached(post):
+                    tprint(f"[info] Reached posts already synced for creator {sync.creator_id!r}. Stopping.")
+                    return True
+                self._queue_post(sync, post.get("id"), post_id_queue)
+            if len(posts) < self.kemono_dl.POST_STEP_SIZE:
+                return True
+            offset += self.kemono_dl.POST_STEP_SIZE
+
+    def _queue_post(self, sync: CreatorSync, post_id: str, post_id_queue: FairQueue) -> None:
+        key = (sync.service, sync.creator_id, post_id)
+        with self._lock:
+            owner = self._queued_posts.get(key)
+            if owner is None:
+                self._queued_posts[key] = sync
+        if owner is not None:
+            if owner is not sync:
+                sync.shared_posts += 1
+            return
+        sync.post_listed()
+        post_id_queue.put(sync, sync.domain, (sync, post_id))
+
+    def _fetch_posts(self, post_id_queue: FairQueue, post_queue: FairQueue) -> None:
+        while (item := post_id_queue.get())[1] is not _DONE:
+            group, (sync, post_id) = item
+            try:
+                post = _guarded(self.kemono_dl.get_post, sync.domain, sync.service, sync.creator_id, post_id)
+            finally:
+                post_id_queue.task_done(group)
+            if post and post is not _FAILED:
+                post_queue.put(sync, sync.domain, (sync, post))
+            elif sync.post_done(failed=True):
+                self._creator_done(sync)
+
+    def _download_posts(self, post_queue: FairQueue) -> None:
+        while (item := post_queue.get())[1] is not _DONE:
+            group, (sync, post) = item
+            try:
+                failed = _guarded(self.kemono_dl.download_post, sync.domain, post) is _FAILED
+            finally:
+                post_queue.task_done(group)
+            if sync.post_done(failed):
+                self._creator_done(sync)
+
+    def _creator_done(self, sync: CreatorSync) -> None:
+        with self._lock:
+            self.creators_done += 1
+            creators_done = self.creators_done
+        elapsed = time.monotonic() - sync.start_time
+        name = f"Post {sync.post_id!r}" if sync.post_id else f"Creator {sync.creator_id!r}"
+        if sync.failed:
+            tprint(
+                f"[info] {name} ({sync.service}) finished with errors: {sync.failed_posts} of {sync.posts} posts failed in {elapsed:.1f}s ({creators_done} done)."
+                + ("" if sync.post_id else " Its newer posts will be listed again next time.")
+            )
+            return
+        shared = f", {sync.shared_posts} more left to another job" if sync.shared_posts else ""
+        tprint(f"[info] {name} ({sync.service}) finished: {sync.posts} posts{shared} in {elapsed:.1f}s ({creators_done} done)")
+        # the job that queued the shared posts stores the sync mark once they are done
+        if not sync.shared_posts:
+            self.kemono_dl.creator_synced(sync.service, sync.creator_id, sync.newest)
+
+
+_FAILED = object()
+
+
+def _guarded(func: Callable, *args) -> Any:
+    # one bad post must not take down a pipeline stage
+    try:
+        return func(*args)
+    except Exception as e:
+        tprint(f"[Error] {func.__name__} failed: {e}")
+        return _FAILED
+
+
+def _join(thread: threading.Thread) -> None:
+    # join with a timeout so the main thread still sees KeyboardInterrupt
+    while thread.is_alive():
+        thread.join(0.5)
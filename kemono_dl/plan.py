@@ -0,0 +1,81 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+from requests.exceptions import RequestException
+
+from .session import CustomSession
+from .utils import format_bytes, tprint
+
+
+class PlanWriter:
+    """Writes the files a run would create as json lines instead of downloading them.
+
+    Every planned post is one block of lines: its "attachment" and "content" entries
+    followed by a "post" entry, so a run from the plan knows when a post is complete
+    and can add it to the archive. Attachment sizes come from HEAD requests made in
+    parallel; a size the server does not report is written as null.
+    """
+
+    def __init__(self, path: str, session: CustomSession, workers: int = 8) -> None:
+        self.path = path
+        self.session = session
+        self.files = 0
+        self.total_size = 0
+        self.unknown_sizes = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="kemono-dl-plan")
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write_post(self, post_entry: dict, entries: list[dict]) -> None:
+        attachments = [entry for entry in entries if entry["type"] == "attachment"]
+        for entry, size in zip(attachments, self._executor.map(self.head_size, [entry["url"] for entry in attachments])):
+            entry["size"] = size
+
+        with self._lock:
+            for entry in entries:
+                self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self.files += 1
+                if entry.get("size") is not None:
+                    self.total_size += entry["size"]
+                elif entry["type"] == "attachment":
+                    self.unknown_sizes += 1
+            self._file.write(json.dumps({"type": "post", **post_entry}, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def head_size(self, url: str) -> int | None:
+        try:
+            response = self.session.head(url, allow_redirects=True)
+            response.raise_for_status()
+            content_length = response.headers.get("Content-Length")
+            return int(content_length) if content_length and content_length.isdigit() else None
+        except RequestException as e:
+            tprint(f"[Error] Failed to get the size of {url!r}: {e}")
+            return None
+
+    def summary(self) -> str:
+        unknown = f" ({self.unknown_sizes} sizes unknown)" if self.unknown_sizes else ""
+        return f"Plan: {self.files} files, {format_bytes(self.total_size)}{unknown} written to {self.path!r}"
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        with self._lock:
+            self._file.close()
+
+
+def read_plan(path: str) -> Iterator[tuple[dict, list[dict]]]:
+    """Yield (post entry, file entries) for every post block of a plan file."""
+    entries: list[dict] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry["type"] == "post":
+                yield entry, entries
+                entries = []
+            else:
+                entries.append(entry)
+    if entries:
+        tprint(f"[warning] Plan file {path!r} ends with {len(entries)} entries of an incomplete post. Skipping them.")
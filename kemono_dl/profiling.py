@@ -0,0 +1,120 @@
+import cProfile
+import functools
+import pstats
+import random
+import sys
+import threading
+import time
+from typing import Callable, TypeVar
+
+F = TypeVar("F", bound=Callable)
+
+
+class FunctionTimers:
+    """Durations of the calls to functions decorated with `timed`, recorded only while `enabled`.
+
+    Call counts and totals are exact; the p95 comes from a uniform sample of at most
+    `max_samples` durations per function, so long runs do not grow without bound.
+    """
+
+    def __init__(self, max_samples: int = 10000) -> None:
+        self.enabled = False
+        self.max_samples = max_samples
+        # name -> [calls, total seconds, sampled durations]
+        self._stats: dict[str, list] = {}
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = [0, 0.0, []]
+            stats[0] += 1
+            stats[1] += seconds
+            samples = stats[2]
+            if len(samples) < self.max_samples:
+                samples.append(seconds)
+            elif (i := self._random.randrange(stats[0])) < self.max_samples:
+                # reservoir sampling: every call stays equally likely to be in the sample
+                samples[i] = seconds
+
+    def table(self, top: int = 10) -> list[str]:
+        """The `top` functions by total time, with their call count, total, mean and p95 time."""
+        with self._lock:
+            rows = sorted(((name, calls, total, sorted(samples)) for name, (calls, total, samples) in self._stats.items()), key=lambda row: row[2], reverse=True)
+        lines = [f"{'function':<30} {'calls':>8} {'total':>10} {'mean':>10} {'p95':>10}"]
+        for name, calls, total, samples in rows[:top]:
+            p95 = samples[min(int(len(samples) * 0.95), len(samples) - 1)]
+            lines.append(f"{name:<30} {calls:>8} {format_duration(total):>10} {format_duration(total / calls):>10} {format_duration(p95):>10}")
+        return lines
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+TIMERS = FunctionTimers()
+
+
+def timed(func: F) -> F:
+    """Record the duration of every call in `TIMERS` while it is enabled; a flag check otherwise."""
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not TIMERS.enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            TIMERS.record(name, time.perf_counter() - start)
+
+    return wrapper  # type: ignore[return-value]
+
+
+class RunProfiler:
+    """cProfile over a whole run, including the worker threads it starts, saved as one pstats file.
+
+    Before python 3.12 a profiler only sees the thread that enabled it, so every thread
+    started while profiling gets its own and the results are merged when stopping.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._profilers: list[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._profile_thread)
+        self._profile_thread()
+
+    def stop(self) -> None:
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)  # type: ignore[arg-type]
+        with self._lock:
+            profilers, self._profilers = self._profilers, []
+        for profiler in profilers:
+            profiler.disable()
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        stats.dump_stats(self.path)
+
+    def _profile_thread(self, *args) -> None:
+        # installed with threading.setprofile, so it runs once as the first event of every new thread
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        with self._lock:
+            self._profilers.append(profiler)
+        profiler.enable()
+
+
+def format_duration(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.2f}s"
+    if seconds >= 0.001:
+        return f"{seconds * 1000:.1f}ms"
+    return f"{seconds * 1e6:.0f}us"
@@ -0,0 +1,95 @@
+import sys
+import threading
+import time
+from typing import Callable
+
+from .utils import format_bytes, render_status, tprint
+
+
+class Transfer:
+    """Byte counter of a single download. The downloader only ever adds to `downloaded`."""
+
+    __slots__ = ("name", "total", "downloaded", "start_time", "start_size")
+
+    def __init__(self, name: str, total: int, downloaded: int = 0) -> None:
+        self.name = name
+        self.total = total
+        self.downloaded = downloaded
+        self.start_time = time.monotonic()
+        self.start_size = downloaded
+
+
+class ProgressTracker:
+    """Renders download progress from a background thread at a fixed rate.
+
+    On a terminal a single status line shows the aggregate throughput, the active
+    transfers and the queue depth (or percent and eta when only one file is downloading).
+    Otherwise a compact summary line is printed every `log_interval` seconds.
+    """
+
+    def __init__(self, refresh_interval: float = 0.5, log_interval: float = 10.0, isatty: bool | None = None) -> None:
+        self.isatty = sys.stdout.isatty() if isatty is None else isatty
+        self.interval = refresh_interval if self.isatty else log_interval
+        self.queue_depth: Callable[[], int] | None = None
+        self._transfers: list[Transfer] = []
+        self._finished_bytes = 0
+        self._last_sample = (time.monotonic(), 0)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start_transfer(self, name: str, total: int, downloaded: int = 0) -> Transfer:
+        transfer = Transfer(name, total, downloaded)
+        with self._lock:
+            self._transfers.append(transfer)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="kemono-dl-progress", daemon=True)
+                self._thread.start()
+        return transfer
+
+    def finish_transfer(self, transfer: Transfer) -> None:
+        with self._lock:
+            self._transfers.remove(transfer)
+            self._finished_bytes += transfer.downloaded - transfer.start_size
+
+    def received_bytes(self) -> int:
+        """Bytes received so far, counting the downloads that are still running."""
+        with self._lock:
+            return self._finished_bytes + sum(transfer.downloaded - transfer.start_size for transfer in self._transfers)
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if self.isatty:
+            render_status("")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            line = self.render()
+            if line is None:
+                continue
+            if self.isatty:
+                render_status(line)
+            else:
+                tprint(line)
+
+    def render(self) -> str | None:
+        with self._lock:
+            transfers = list(self._transfers)
+            received = self._finished_bytes + sum(transfer.downloaded - transfer.start_size for transfer in transfers)
+        now = time.monotonic()
+        last_time, last_received = self._last_sample
+        self._last_sample = (now, received)
+        speed = (received - last_received) / (now - last_time) if now > last_time else 0
+
+        if not transfers:
+            return None
+        queued = self.queue_depth() if self.queue_depth else 0
+
+        if len(transfers) == 1 and self.isatty and transfers[0].total:
+            transfer = transfers[0]
+            eta = (transfer.total - transfer.downloaded) / speed if speed > 0 else 0
+            percent = transfer.downloaded / transfer.total * 100
+            return f"[downloading] {percent:6.2f}% of {format_bytes(transfer.total)} eta {time.strftime('%H:%M:%S', time.gmtime(eta))} at {format_bytes(speed)}/s"
+        return f"[downloading] {len(transfers)} active at {format_bytes(speed)}/s, {format_bytes(received)} received, {queued} posts queued"
@@ -1,11 +1,213 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from .metrics import Metrics
+
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+class _Bucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.blocked_until = 0.0
+        self.waited = 0.0
+        self.requests = 0
+        self.throttled = 0
+
+
+class RateLimiter:
+    """Per host token bucket.
+
+    The rate is halved whenever a host answers 429/503 (and the host is paused for
+    its Retry-After), then grows back by `increase` requests/s on every success.
+    """
+
+    def __init__(self, rate: float = 4.0, min_rate: float = 0.1, max_rate: float = 16.0, burst: float = 4.0, increase: float = 0.25) -> None:
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self._buckets: dict[str, _Bucket] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, host: str) -> _Bucket:
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = _Bucket(self.rate, self.burst)
+        return bucket
+
+    def acquire(self, host: str, paced: bool = True) -> float:
+        """Block until a request to `host` may be sent. Returns the seconds waited.
+
+        Requests that are not `paced` don't use up tokens, they only wait out a Retry-After pause.
+        """
+        with self._lock:
+            bucket = self._bucket(host)
+            now = time.monotonic()
+            wait = bucket.blocked_until - now
+            if paced:
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.last) * bucket.rate)
+                bucket.last = now
+                # tokens may go negative: every caller reserves its own slot in the queue
+                bucket.tokens -= 1
+                wait = max(-bucket.tokens / bucket.rate, wait)
+            wait = max(wait, 0.0)
+            bucket.waited += wait
+            bucket.requests += 1
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def update(self, host: str, response: requests.Response) -> float | None:
+        """Adjust the rate of `host` from a response. Returns the seconds to wait before retrying a throttled request."""
+        with self._lock:
+            bucket = self._bucket(host)
+            if response.status_code not in THROTTLE_STATUS_CODES:
+                if response.ok:
+                    bucket.rate = min(self.max_rate, bucket.rate + self.increase)
+                return None
+
+            bucket.rate = max(self.min_rate, bucket.rate / 2)
+            bucket.throttled += 1
+            delay = parse_retry_after(response.headers.get("Retry-After")) or 1 / bucket.rate
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + delay)
+            return delay
+
+    def summary(self) -> list[str]:
+        with self._lock:
+            return [
+                f"Rate limit {host}: {bucket.requests} requests, {bucket.rate:.2f} req/s, waited {bucket.waited:.1f}s, throttled {bucket.throttled} times"
+                for host, bucket in self._buckets.items()
+            ]
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TransportAdapter(HTTPAdapter):
+    """HTTPAdapter with per host connection pool sizes and connection reuse counters."""
+
+    def __init__(self, pool_maxsize: int = 10, host_pool_sizes: dict[str, int] | None = None, **kwargs) -> None:
+        self.host_pool_sizes = host_pool_sizes or {}
+        self._connects = 0
+        self._requests = 0
+        self._counts_lock = threading.Lock()
+        super().__init__(pool_maxsize=pool_maxsize, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        # every pool creates its connections from these classes, so each socket that is dialed gets counted
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self._connected),
+            "https": _counting_pool(HTTPSConnectionPool, self._connected),
+        }
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        maxsize = self.host_pool_sizes.get(host_params["host"])
+        if maxsize:
+            pool_kwargs["maxsize"] = maxsize
+        return host_params, pool_kwargs
+
+    def send(self, request, *args, **kwargs):
+        with self._counts_lock:
+            self._requests += 1
+        return super().send(request, *args, **kwargs)
+
+    def _connected(self) -> None:
+        with self._counts_lock:
+            self._connects += 1
+
+    def connection_counts(self) -> tuple[int, int]:
+        """Return (connections opened, requests sent). A dropped connection dialed again counts as opened again."""
+        with self._counts_lock:
+            return self._connects, self._requests
+
+
+def _counting_pool(pool_cls: type, on_connect) -> type:
+    connection_cls = pool_cls.ConnectionCls
+
+    class CountingConnection(connection_cls):  # type: ignore[valid-type, misc]
+        def connect(self) -> None:
+            super().connect()
+            on_connect()
+
+    return type(f"Counting{pool_cls.__name__}", (pool_cls,), {"ConnectionCls": CountingConnection})
 
 
 class CustomSession(requests.Session):
+    # only api calls are paced by the rate limiter, file downloads just honor 429/503 responses
+    PACED_PATH = "/api/"
+
+    def __init__(
+        self,
+        rate_limiter: RateLimiter | None = None,
+        max_throttle_retries: int = 3,
+        pool_maxsize: int = 10,
+        host_pool_sizes: dict[str, int] | None = None,
+        connect_timeout: float | None = 10,
+        read_timeout: float | None = 60,
+        connect_retries: int = 3,
+        metrics: Metrics | None = None,
+    ) -> None:
+        super().__init__()
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self.max_throttle_retries = max_throttle_retries
+        self.timeout = (connect_timeout, read_timeout)
+        # only failed connection attempts are retried here, everything else is up to the caller
+        retries = Retry(total=None, connect=connect_retries, read=0, status=0, other=0, redirect=None, backoff_factor=0.5)
+        self.adapter = TransportAdapter(pool_maxsize=pool_maxsize, host_pool_sizes=host_pool_sizes, pool_connections=32, max_retries=retries)
+        self.mount("https://", self.adapter)
+        self.mount("http://", self.adapter)
+
     def request(self, method, url, *args, **kwargs):
-        response = super().request(method, url, *args, **kwargs)
+        kwargs.setdefault("timeout", self.timeout)
+        parsed_url = urlsplit(url)
+        host = parsed_url.netloc
+        paced = parsed_url.path.startswith(CustomSession.PACED_PATH)
+        for attempt in range(self.max_throttle_retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire(host, paced)
+            response = super().request(method, url, *args, **kwargs)
+            if self.metrics:
+                self.metrics.count("http_requests_total", kind="api" if paced else "data", status=str(response.status_code))
+            if self.rate_limiter is None or self.rate_limiter.update(host, response) is None or attempt == self.max_throttle_retries:
+                break
+            if self.metrics:
+                self.metrics.count("retries_total", reason="throttled")
+            # the limiter has paused this host for the Retry-After delay; the next acquire() waits it out
+            response.close()
+
         content_type = response.headers.get("Content-Type", "")
         # why is the api content type text/css and not application/json!
         if content_type == "text/css":
             response.encoding = "UTF-8"
         return response
+
+    def summary(self) -> list[str]:
+        opened, sent = self.adapter.connection_counts()
+        lines = [f"Connections: {opened} opened, {max(sent - opened, 0)} reused for {sent} requests"]
+        if self.rate_limiter:
+            lines += self.rate_limiter.summary()
+        return lines
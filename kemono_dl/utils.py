@@ -1,16 +1,77 @@
+import functools
 import hashlib
+import json
 import re
+import sys
+import threading
 from pathlib import Path
 
 from requests import Session
 
+from .profiling import timed
 
+_print_lock = threading.Lock()
+_status_width = 0
+
+
+def tprint(*args, **kwargs) -> None:
+    """`print` that keeps lines whole when several downloads report at once."""
+    global _status_width
+    with _print_lock:
+        if _status_width:
+            # clear the progress status line so the message starts on a clean line
+            sys.stdout.write("\r" + " " * _status_width + "\r")
+            _status_width = 0
+        print(*args, **kwargs)
+
+
+def render_status(line: str) -> None:
+    """Show `line` as the status line at the bottom of the terminal, replacing the previous one."""
+    global _status_width
+    with _print_lock:
+        sys.stdout.write("\r" + line.ljust(_status_width) + "\r")
+        sys.stdout.flush()
+        _status_width = len(line)
+
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    try:
+        import msgspec
+
+        _msgspec_decoder = msgspec.json.Decoder()
+
+        def json_loads(data: bytes | str):
+            try:
+                return _msgspec_decoder.decode(data)
+            except msgspec.DecodeError as e:
+                raise ValueError(e) from e
+
+    except ImportError:
+        json_loads = json.loads
+
+
+def decode_json(response):
+    """Decode the json body of `response` with the fastest decoder that is installed (orjson, msgspec or the stdlib)."""
+    content = response.content
+    if not isinstance(content, (bytes, str)):
+        return response.json()
+    return json_loads(content)
+
+
+@timed
 def get_sha256_hash(file_path: str) -> str:
-    sha256 = hashlib.sha256()
+    return hash_file_into(hashlib.sha256(), file_path).hexdigest()
+
+
+def hash_file_into(digest, file_path: str, chunk_size: int = 1024 * 1024):
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            sha256.update(chunk)
-    return sha256.hexdigest()
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest
 
 
 def compute_sha256(text: str) -> str:
@@ -35,6 +96,61 @@ def get_sha256_url_content(session: Session, url: str, chunk_size: int = 8192):
     return sha256.hexdigest()
 
 
+_UNSAFE_CHARACTERS = re.compile(r'[<>:"/\\|?*\x00-\x1F]')
+_NON_ASCII_CHARACTERS = re.compile(r"[^\x20-\x7E]")
+_PATH_SEPARATORS = re.compile(r"[\\/]")
+
+
+def _sanitize(value: str, replace: str = "_") -> str:
+    return _UNSAFE_CHARACTERS.sub(replace, value).rstrip(" .")
+
+
+class OutputTemplate:
+    """An output template split into path segments once, ready to be filled for every file.
+
+    Segments without any `{field}` are sanitized up front; only the remaining ones are formatted per call.
+    """
+
+    def __init__(self, template: str) -> None:
+        self.template = template
+        # (segment, needs formatting)
+        self.segments = [(segment, "{" in segment or "}" in segment) for segment in _PATH_SEPARATORS.split(template)]
+        self._constant_segments: dict[str, list[str]] = {}
+
+    def render(self, base_path: str, template_variables: dict, restrict_names: bool = False, replacement: str = "_") -> str:
+        constant_segments = self._constant_segments.get(replacement)
+        if constant_segments is None:
+            constant_segments = self._constant_segments[replacement] = [_sanitize(segment, replacement) for segment, _ in self.segments]
+
+        path_segments = constant_segments.copy()
+        try:
+            for i, (segment, dynamic) in enumerate(self.segments):
+                if dynamic:
+                    path_segments[i] = _sanitize(segment.format_map(template_variables), replacement)
+        except KeyError as e:
+            missing_key = e.args[0]
+            raise ValueError(f"[Error] Missing template key: '{missing_key}'.")
+
+        path = Path(*path_segments)
+
+        if not path.is_absolute():
+            path = Path(base_path) / path
+
+        if not path.is_absolute():
+            path = Path.cwd() / path
+
+        if restrict_names:
+            path = Path(_NON_ASCII_CHARACTERS.sub(replacement, str(path)))
+
+        return str(path)
+
+
+@functools.lru_cache(maxsize=64)
+def compile_output_template(output_template: str) -> OutputTemplate:
+    return OutputTemplate(output_template)
+
+
+@timed
 def generate_file_path(
     base_path: str,
     output_template: str,
@@ -42,27 +158,4 @@ def generate_file_path(
     restrict_names: bool = False,
     replacement: str = "_",
 ) -> str:
-    def _sanitize(value: str, replace: str = "_") -> str:
-        return re.sub(r'[<>:"/\\|?*\x00-\x1F]', replace, value).rstrip(" .")
-
-    path_segments = []
-    try:
-        for path_segment in re.split(r"[\\/]", output_template):
-            path_segment_formatted = path_segment.format_map(template_variables)
-            path_segments.append(_sanitize(path_segment_formatted, replacement))
-    except KeyError as e:
-        missing_key = e.args[0]
-        raise ValueError(f"[Error] Missing template key: '{missing_key}'.")
-
-    path = Path(*path_segments)
-
-    if not path.is_absolute():
-        path = Path(base_path) / path
-
-    if not path.is_absolute():
-        path = Path.cwd() / path
-
-    if restrict_names:
-        path = Path(re.sub(r"[^\x20-\x7E]", replacement, str(path)))
-
-    return str(path)
+    return compile_output_template(output_template).render(base_path, template_variables, restrict_names, replacement)
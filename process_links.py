@@ -1,9 +1,18 @@
+import json
 import os
-import subprocess
+import queue
+import struct
+import threading
 import zipfile
+import zlib
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from kemono_dl import KemonoDL
+from kemono_dl.hash_cache import HashCache
+from kemono_dl.http_cache import ResponseCache
+
 def read_links(link_file: str) -> list[str]:
     """
     读取指定链接文件中的有效链接（过滤空行和注释行）。
@@ -21,65 +30,391 @@ def read_links(link_file: str) -> list[str]:
     print(f"从 {link_file} 成功读取 {len(links)} 个有效链接")
     return links
 
-def get_current_files(dir_path: str) -> set[str]:
-    """获取指定目录下所有文件/目录的绝对路径（用于对比下载前后差异）"""
-    return set(
-        str(path.resolve()) 
-        for path in Path(dir_path).rglob("*")  # 递归获取所有子项
+def create_downloader(skip_attachments: bool, base_dir: str = "./download_base", on_file_written=None) -> KemonoDL:
+    """
+    创建进程内的下载器，配置与原先调用的 kemono-dl 命令相同。
+    track_written=True 会记录每个帖子写入的文件/目录，无需再扫描整个 base_dir。
+    """
+    output_template = "{post_title}/{filename}"
+    return KemonoDL(
+        path=base_dir,
+        output_templates={"attachments": output_template, "content": output_template},
+        no_tmp=True,
+        attachment_filters={"skip_extensions": ["zip", "rar"] if skip_attachments else []},  # 跳过附件时不下载压缩包
+        hash_cache_file=os.path.join(base_dir, HashCache.FILENAME),
+        response_cache_file=os.path.join(base_dir, ResponseCache.FILENAME),
+        track_written=True,
+        on_file_written=on_file_written,  # 每个文件下载完成后立即回调（用于边下载边打包）
     )
 
-def download_link(link: str, skip_attachments: bool, base_dir: str = "./download_base") -> list[str]:
+def download_links(links: list[str], skip_attachments: bool, base_dir: str = "./download_base", on_file_written=None) -> dict[str, list[str]]:
     """
-    下载单个链接的内容，返回新增的文件/目录路径列表。
+    在当前进程内批量下载一组链接，返回 {链接: 新增的文件/目录路径列表}。
     可根据 skip_attachments 参数决定是否跳过附件下载。
     """
-    # 记录下载前的文件列表
-    before_download = get_current_files(base_dir)
-    
+    if not links:
+        return {}
+
+    if skip_attachments:
+        print(f"\n=== 开始下载 {len(links)} 个链接 (跳过附件) ===")
+    else:
+        print(f"\n=== 开始下载 {len(links)} 个链接 ===")
+
+    kemono_dl = create_downloader(skip_attachments, base_dir, on_file_written)
     try:
-        # 根据是否跳过附件，构建不同的命令和提示信息
-        if skip_attachments:
-            print(f"\n=== 开始下载链接 (跳过附件): {link} ===")
-            command = [
-                "kemono-dl",
-                link,
-                "--path", base_dir,
-                "--output", "{post_title}/{filename}",
-                "--no-tmp",
-                "--skip-extensions",  # 新增的参数
-                "zip,rar"
-            ]
+        # 所有链接在同一次调度中下载，共享连接池和缓存
+        kemono_dl.download_batch(links)
+    except Exception as e:
+        print(f"下载失败: {str(e)}")
+    finally:
+        kemono_dl.close()
+    kemono_dl.print_summary()
+
+    # 直接使用下载器记录的写入清单，不再对比下载前后的目录快照
+    results = {}
+    for link in links:
+        written = kemono_dl.written_by_url(link)
+        results[link] = written["directories"] + written["files"]
+        print(f"{link} 新增 {len(results[link])} 个文件/目录")
+    return results
+
+def download_link(link: str, skip_attachments: bool, base_dir: str = "./download_base") -> list[str]:
+    """
+    下载单个链接的内容，返回新增的文件/目录路径列表。
+    """
+    return download_links([link], skip_attachments, base_dir).get(link, [])
+
+# 这些格式本身已经压缩过，再用 deflate 压缩只会浪费 CPU，直接以 ZIP_STORED 存储
+STORED_EXTENSIONS = {
+    "jpg", "jpeg", "png", "gif", "webp", "avif", "heic", "jxl",
+    "mp4", "m4v", "mkv", "webm", "mov", "avi", "wmv", "flv",
+    "mp3", "m4a", "aac", "ogg", "opus", "flac",
+    "zip", "rar", "7z", "gz", "bz2", "xz", "zst", "cbz", "cbr",
+    "pdf", "epub", "docx", "xlsx", "pptx", "clip",
+}
+# 超过此大小的可压缩文件不在内存中压缩，由写入线程流式压缩
+MAX_IN_MEMORY_DEFLATE = 16 * 1024 * 1024
+COMPRESS_LEVEL = 6
+# 每个压缩包的目标大小，便于上传和传输
+BUNDLE_TARGET_SIZE = 2 * 1024 * 1024 * 1024
+# 大小或偏移超过此值的条目使用 zip64 扩展字段
+ZIP64_LIMIT = zipfile.ZIP64_LIMIT
+COPY_BLOCK_SIZE = 1024 * 1024
+
+def is_stored(path: str) -> bool:
+    return os.path.splitext(path)[1][1:].lower() in STORED_EXTENSIONS
+
+def deflate_file(path: str, level: int = COMPRESS_LEVEL) -> tuple[bytes, int, int]:
+    """在工作线程中读取并压缩文件（zlib 压缩时会释放 GIL），返回 (压缩数据, CRC32, 原始大小)。"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)  # zip 使用不带头部的 raw deflate
+    return compressor.compress(raw) + compressor.flush(), zlib.crc32(raw), len(raw)
+
+class BundleZip:
+    """
+    只追加写入的 ZIP 文件，可以写入在其他线程中已经压缩好的条目。
+    zipfile 只能在写入线程里压缩，又没有写入已压缩数据的公开接口，所以这里按照 ZIP 格式自己写入
+    本地文件头、数据、中央目录和 zip64 记录；读取仍然使用 zipfile。
+    """
+
+    # ZIP 格式中的记录结构（APPNOTE.TXT 4.3）
+    LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+    CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+    END_RECORD = struct.Struct("<4s4H2LH")
+    END_RECORD_64 = struct.Struct("<4sQ2H2L4Q")
+    END_LOCATOR_64 = struct.Struct("<4sLQL")
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.fp = open(filename, "wb")
+        # (ZipInfo, 本地文件头偏移)
+        self.entries: list[tuple[zipfile.ZipInfo, int]] = []
+
+    def tell(self) -> int:
+        return self.fp.tell()
+
+    def write_compressed(self, path: str, arcname: str, data: bytes, crc: int, size: int) -> None:
+        """写入一个已经用 raw deflate 压缩好的条目。"""
+        zinfo = self._zinfo(path, arcname, zipfile.ZIP_DEFLATED, size, len(data), crc)
+        self._write(zinfo, lambda: self.fp.write(data))
+
+    def write_file(self, path: str, arcname: str, compress_type: int) -> None:
+        """从磁盘流式写入一个条目，写完后回到本地文件头补写 CRC32 和大小。"""
+        size = os.path.getsize(path)
+        zinfo = self._zinfo(path, arcname, compress_type, size, size, 0)
+        # 压缩后的大小事先未知，与 zipfile 一样为可能超过限制的条目预留 zip64 字段
+        zip64 = size * 1.05 > ZIP64_LIMIT
+
+        def copy() -> None:
+            compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15) if compress_type == zipfile.ZIP_DEFLATED else None
+            crc = file_size = compress_size = 0
+            with open(path, "rb") as f:
+                while block := f.read(COPY_BLOCK_SIZE):
+                    crc = zlib.crc32(block, crc)
+                    file_size += len(block)
+                    if compressor:
+                        block = compressor.compress(block)
+                    compress_size += len(block)
+                    self.fp.write(block)
+            if compressor:
+                block = compressor.flush()
+                compress_size += len(block)
+                self.fp.write(block)
+            if file_size != size:
+                raise ValueError(f"文件在打包时被修改: {path}")
+            zinfo.CRC, zinfo.compress_size = crc, compress_size
+
+        offset = self._write(zinfo, copy, zip64)
+        end = self.fp.tell()
+        self.fp.seek(offset)
+        self.fp.write(self._local_header(zinfo, zip64))
+        self.fp.seek(end)
+
+    def close(self) -> None:
+        cd_offset = self.fp.tell()
+        for zinfo, offset in self.entries:
+            fields, extra = [], b""
+            for value in (zinfo.file_size, zinfo.compress_size, offset):
+                if value > ZIP64_LIMIT:
+                    extra += struct.pack("<Q", value)
+            sizes = [0xFFFFFFFF if value > ZIP64_LIMIT else value for value in (zinfo.compress_size, zinfo.file_size, offset)]
+            if extra:
+                extra = struct.pack("<HH", 1, len(extra)) + extra
+            version = 45 if extra else 20
+            filename, flags = self._encoded_name(zinfo)
+            self.fp.write(self.CENTRAL_HEADER.pack(
+                b"PK\x01\x02", version, zinfo.create_system, version, 0, flags, zinfo.compress_type, *self._dos_time(zinfo),
+                zinfo.CRC, sizes[0], sizes[1], len(filename), len(extra), 0, 0, 0, zinfo.external_attr, sizes[2],
+            ))
+            self.fp.write(filename + extra)
+        cd_end = self.fp.tell()
+        count, cd_size = len(self.entries), cd_end - cd_offset
+        if count >= 0xFFFF or cd_offset > ZIP64_LIMIT or cd_size > ZIP64_LIMIT:
+            self.fp.write(self.END_RECORD_64.pack(b"PK\x06\x06", 44, 45, 45, 0, 0, count, count, cd_size, cd_offset))
+            self.fp.write(self.END_LOCATOR_64.pack(b"PK\x06\x07", 0, cd_end, 1))
+        self.fp.write(self.END_RECORD.pack(
+            b"PK\x05\x06", 0, 0, min(count, 0xFFFF), min(count, 0xFFFF), min(cd_size, 0xFFFFFFFF), min(cd_offset, 0xFFFFFFFF), 0,
+        ))
+        self.fp.close()
+
+    def _zinfo(self, path: str, arcname: str, compress_type: int, file_size: int, compress_size: int, crc: int) -> zipfile.ZipInfo:
+        zinfo = zipfile.ZipInfo.from_file(path, arcname)
+        zinfo.compress_type = compress_type
+        zinfo.file_size, zinfo.compress_size, zinfo.CRC = file_size, compress_size, crc
+        return zinfo
+
+    def _write(self, zinfo: zipfile.ZipInfo, write_data, zip64: bool | None = None) -> int:
+        """写入本地文件头和数据；失败时截断到条目开头，压缩包中不会留下不完整的条目。"""
+        offset = self.fp.tell()
+        if zip64 is None:
+            zip64 = zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT
+        try:
+            self.fp.write(self._local_header(zinfo, zip64))
+            write_data()
+        except BaseException:
+            self.fp.seek(offset)
+            self.fp.truncate()
+            raise
+        self.entries.append((zinfo, offset))
+        return offset
+
+    def _local_header(self, zinfo: zipfile.ZipInfo, zip64: bool) -> bytes:
+        filename, flags = self._encoded_name(zinfo)
+        extra = struct.pack("<HHQQ", 1, 16, zinfo.file_size, zinfo.compress_size) if zip64 else b""
+        compress_size, file_size = (0xFFFFFFFF, 0xFFFFFFFF) if zip64 else (zinfo.compress_size, zinfo.file_size)
+        version = 45 if zip64 else 20
+        return self.LOCAL_HEADER.pack(
+            b"PK\x03\x04", version, 0, flags, zinfo.compress_type, *self._dos_time(zinfo),
+            zinfo.CRC, compress_size, file_size, len(filename), len(extra),
+        ) + filename + extra
+
+    @staticmethod
+    def _dos_time(zinfo: zipfile.ZipInfo) -> tuple[int, int]:
+        year, month, day, hour, minute, second = zinfo.date_time
+        return hour << 11 | minute << 5 | second // 2, (year - 1980) << 9 | month << 5 | day
+
+    @staticmethod
+    def _encoded_name(zinfo: zipfile.ZipInfo) -> tuple[bytes, int]:
+        try:
+            return zinfo.filename.encode("ascii"), 0
+        except UnicodeEncodeError:
+            return zinfo.filename.encode("utf-8"), 0x800  # 文件名使用 UTF-8 编码
+
+class StreamingBundler:
+    """
+    边下载边打包：下载线程每完成一个文件就调用 add()，文件立即进入当前压缩包。
+    - 图片/视频/压缩包等已压缩格式以 ZIP_STORED 存储
+    - 文本、HTML 等在线程池中并行压缩（zlib 压缩时会释放 GIL），再由唯一的写入线程按顺序写入 BundleZip
+    - 按目标字节数分卷：当前压缩包加上下一个文件会超过 target_size 时开始下一个压缩包。
+      同一个顶层项目的文件连续加入时默认不拆分到多个压缩包，split_items=True 时允许在文件边界拆分。
+      并发下载时不同项目的文件会交错加入，而写入线程无法知道一个项目何时下载完，
+      因此开始新压缩包后才到达的文件会进入新压缩包，这时一个项目仍可能分布在多个压缩包中
+    - index_file 记录每个文件的排队/打包状态，中断后再次运行会继续打包未完成的文件，无需重新扫描下载目录
+    """
+
+    def __init__(
+        self,
+        base_dir: str = "./download_base",
+        output_dir: str = "./bundles",
+        target_size: int | None = BUNDLE_TARGET_SIZE,
+        split_items: bool = False,
+        workers: int | None = None,
+        first_bundle_num: int = 1,
+        index_file: str | None = None,
+    ):
+        self.base_dir = os.path.abspath(base_dir)
+        self.output_dir = output_dir
+        self.target_size = target_size
+        self.split_items = split_items
+        self.bundle_num = first_bundle_num - 1
+        self.bundles: list[str] = []
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bundle-compress")
+        # 队列有上限，压缩结果不会在内存中无限堆积
+        self.pending: queue.Queue = queue.Queue(maxsize=self.workers * 2)
+        self.seen: set[str] = set()
+        self.lock = threading.Lock()
+        self.zipf: BundleZip | None = None
+        self.bundle_items: set[str] = set()
+        self.bundle_files: list[tuple[str, int]] = []
+
+        self.index = None
+        unfinished = []
+        if index_file:
+            unfinished = self._load_index(index_file)
+            os.makedirs(os.path.dirname(os.path.abspath(index_file)), exist_ok=True)
+            self.index = open(index_file, "a", encoding="utf-8")
+            if self.index.tell() and not self._ends_with_newline(index_file):
+                self.index.write("\n")  # 新记录不能接在中断时留下的不完整行后面
+
+        self.writer = threading.Thread(target=self._write_loop, name="bundle-writer", daemon=True)
+        self.writer.start()
+
+        if unfinished:
+            print(f"继续打包上次未完成的 {len(unfinished)} 个文件")
+            for path in unfinished:
+                self.add(path)
+
+    def _load_index(self, index_file: str) -> list[str]:
+        """读取索引：已打包的文件不再打包，已排队但未打包的文件返回给调用方重新加入。"""
+        if not os.path.exists(index_file):
+            return []
+        queued: dict[str, None] = {}
+        with open(index_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 中断时可能留下不完整的最后一行
+                path = os.path.join(self.base_dir, entry["path"])
+                if entry["event"] == "queued":
+                    queued[path] = None
+                elif entry["event"] == "bundled":
+                    queued.pop(path, None)
+                    self.seen.add(path)
+                    self.bundle_num = max(self.bundle_num, entry["bundle_num"])
+        return [path for path in queued if os.path.isfile(path)]
+
+    @staticmethod
+    def _ends_with_newline(index_file: str) -> bool:
+        with open(index_file, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _log(self, **entry) -> None:
+        if self.index:
+            with self.lock:
+                self.index.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self.index.flush()
+
+    def add(self, path: str) -> None:
+        """加入一个已下载完成的文件（可在任意线程调用）。"""
+        path = os.path.abspath(path)
+        with self.lock:
+            if path in self.seen:
+                return
+            self.seen.add(path)
+        self._log(event="queued", path=os.path.relpath(path, self.base_dir))
+        future = None
+        if not is_stored(path) and os.path.getsize(path) <= MAX_IN_MEMORY_DEFLATE:
+            future = self.pool.submit(deflate_file, path)
+        self.pending.put((path, future))
+
+    def add_item(self, item: str) -> None:
+        """加入一个文件或目录（目录会递归加入其中的所有文件）。"""
+        if os.path.isfile(item):
+            self.add(item)
+        elif os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                for file in sorted(files):
+                    self.add(os.path.join(root, file))
+
+    def close(self) -> list[str]:
+        """等待所有文件写入并关闭最后一个压缩包，返回生成的压缩包路径列表。"""
+        self.pending.put(None)
+        self.writer.join()
+        self.pool.shutdown()
+        if self.index:
+            self.index.close()
+        return self.bundles
+
+    def _top_level_item(self, path: str) -> str:
+        rel_path = os.path.relpath(path, self.base_dir)
+        return rel_path.split(os.sep, 1)[0]
+
+    def _write_loop(self) -> None:
+        while (entry := self.pending.get()) is not None:
+            path, future = entry
+            try:
+                item = self._top_level_item(path)
+                size = os.path.getsize(path)
+                if self.zipf is not None and self.target_size and self.zipf.tell() + size > self.target_size:
+                    if item not in self.bundle_items or self.split_items:
+                        self._finish_bundle()
+                if self.zipf is None:
+                    self._start_bundle()
+                self.bundle_items.add(item)
+                self._write_file(path, future)
+                self.bundle_files.append((os.path.relpath(path, self.base_dir), size))
+            except Exception as e:
+                print(f"❌ 打包失败: {path}: {str(e)}")
+        self._finish_bundle()
+
+    def _write_file(self, path: str, future) -> None:
+        arcname = os.path.relpath(path, self.base_dir)
+        if future is None:
+            compress_type = zipfile.ZIP_STORED if is_stored(path) else zipfile.ZIP_DEFLATED
+            self.zipf.write_file(path, arcname, compress_type)
+            return
+        data, crc, size = future.result()
+        if len(data) >= size:
+            # 压缩后没有变小，直接存储
+            self.zipf.write_file(path, arcname, zipfile.ZIP_STORED)
         else:
-            print(f"\n=== 开始下载链接: {link} ===")
-            command = [
-                "kemono-dl",
-                link,
-                "--path", base_dir,
-                "--output", "{post_title}/{filename}",
-                "--no-tmp"
-            ]
-            
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            check=True,  # 下载失败时抛出异常
-            encoding='utf-8'
-        )
-        print(f"下载成功: {link}")
-        
-        # 对比下载前后的文件列表，获取新增内容
-        after_download = get_current_files(base_dir)
-        new_items = list(after_download - before_download)
-        print(f"该链接新增 {len(new_items)} 个文件/目录")
-        return new_items
-    
-    except subprocess.CalledProcessError as e:
-        print(f"下载失败: {link}")
-        print(f"错误信息: {e.stderr}")
-        return []
+            self.zipf.write_compressed(path, arcname, data, crc, size)
+
+    def _start_bundle(self) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.bundle_num += 1
+        zip_path = os.path.join(self.output_dir, f"bundle-{self.bundle_num:03d}.zip")
+        self.zipf = BundleZip(zip_path)
+        self.bundle_items = set()
+        self.bundle_files = []
 
-def create_bundle(items: list[str], bundle_num: int, output_dir: str = "./bundles") -> bool:
+    def _finish_bundle(self) -> None:
+        if self.zipf is None:
+            return
+        self.zipf.close()
+        self.bundles.append(self.zipf.filename)
+        # 压缩包完整写入后才记录到索引，中断时未完成的压缩包会在下次运行时重新生成
+        bundle_name = os.path.basename(self.zipf.filename)
+        for rel_path, size in self.bundle_files:
+            self._log(event="bundled", path=rel_path, size=size, bundle=bundle_name, bundle_num=self.bundle_num)
+        print(f"✅ 成功创建压缩包: {self.zipf.filename} (包含 {len(self.bundle_items)} 个顶层项目, {len(self.zipf.entries)} 个文件, {os.path.getsize(self.zipf.filename) / 1024 / 1024:.1f} MiB)")
+        self.zipf = None
+
+def create_bundle(items: list[str], bundle_num: int, output_dir: str = "./bundles", base_dir: str = "./download_base") -> bool:
     """
     将指定的文件/目录打包为 ZIP 压缩包
     items: 要打包的文件/目录路径列表
@@ -97,29 +432,13 @@ def create_bundle(items: list[str], bundle_num: int, output_dir: str = "./bundle
     ]
     print(f"过滤后，顶层项目数：{len(top_level_items)}")
 
-    os.makedirs(output_dir, exist_ok=True)
-    zip_path = os.path.join(output_dir, f"bundle-{bundle_num:03d}.zip")
-    
+    bundler = StreamingBundler(base_dir, output_dir, target_size=None, first_bundle_num=bundle_num)
     try:
-        # 使用过滤后的 top_level_items进行打包
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED, compresslevel=6) as zipf:
-            for item in top_level_items:
-                if os.path.isfile(item):
-                    rel_path = os.path.relpath(item, start="./download_base")
-                    zipf.write(item, rel_path)
-                elif os.path.isdir(item):
-                    for root, _, files in os.walk(item):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            file_rel_path = os.path.relpath(file_path, start="./download_base")
-                            zipf.write(file_path, file_rel_path)
-        
-        print(f"✅ 成功创建压缩包: {zip_path} (包含 {len(top_level_items)} 个顶层项目)")
-        return True
-    
-    except Exception as e:
-        print(f"❌ 打包失败: {str(e)}")
-        return False
+        for item in top_level_items:
+            bundler.add_item(item)
+    finally:
+        bundles = bundler.close()
+    return bool(bundles)
 
 def main():
     # 1. 读取两种链接文件
@@ -139,41 +458,28 @@ def main():
         return
     
     # 2. 初始化变量
-    batch_size = 10
-    current_batch = 1
-    batch_items = []
+    bundle_target_size = BUNDLE_TARGET_SIZE
+    split_items = False  # 为 True 时，超过目标大小的顶层项目会拆分到多个压缩包（并发下载交错的项目本来就可能被拆分）
     total_downloaded = 0
-    
-    # 3. 逐个处理所有链接
-    for idx, link_info in enumerate(all_links, 1):
-        link = link_info["url"]
-        skip = link_info["skip"]
-        
-        new_items = download_link(link, skip_attachments=skip)
-        
-        # 过滤新增项目，只保留顶层路径
-        item_set = set(new_items)
-        top_level_new_items = [
-            item for item in new_items
-            if str(Path(item).parent) not in item_set
-        ]
 
-        if top_level_new_items:
-            batch_items.extend(top_level_new_items)
+    # 3. 在进程内分两组批量下载（普通链接 / 跳过附件的链接），文件下载完成后立即进入压缩包
+    bundler = StreamingBundler(target_size=bundle_target_size, split_items=split_items, index_file="./bundles/index.jsonl")
+    try:
+        downloaded = download_links(normal_links, skip_attachments=False, on_file_written=bundler.add)
+        downloaded.update(download_links(skip_links, skip_attachments=True, on_file_written=bundler.add))
+    finally:
+        # 4. 等待剩余文件写入，关闭最后一个压缩包
+        bundles = bundler.close()
+
+    for link_info in all_links:
+        if downloaded.get(link_info["url"]):
             total_downloaded += 1
-        
-        # 4. 达到批次大小或处理完所有链接时，打包
-        if len(batch_items) >= batch_size or idx == len(all_links):
-            if batch_items:
-                create_bundle(batch_items, current_batch)
-                batch_items = []
-                current_batch += 1
     
     # 5. 输出最终统计
     print(f"\n=== 处理完成 ===")
     print(f"总链接数: {len(all_links)}")
     print(f"成功下载数: {total_downloaded}")
-    print(f"生成压缩包数: {current_batch - 1}")
+    print(f"生成压缩包数: {len(bundles)}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
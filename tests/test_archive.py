@@ -0,0 +1,73 @@
+from kemono_dl.archive import SQLiteArchive, SyncMark, TextArchive, archive_key, open_archive
+
+COOMER_DOMAIN = "https://coomer.st"
+
+
+def test_text_archive_matches_posts_added_this_run(tmp_path) -> None:
+    archive = TextArchive(str(tmp_path / "archive.txt"))
+    archive.add(COOMER_DOMAIN, "onlyfans", "USER_123", "POST_123")
+
+    assert archive_key("onlyfans", "USER_123", "POST_123") in archive
+    assert archive_key("onlyfans", "USER_123", "POST_456") not in archive
+
+
+def test_text_archive_buffers_and_reloads(tmp_path) -> None:
+    path = tmp_path / "archive.txt"
+    archive = TextArchive(str(path), flush_every=2)
+    archive.add(COOMER_DOMAIN, "onlyfans", "USER_123", "1")
+    assert not path.exists()
+
+    archive.add(COOMER_DOMAIN, "onlyfans", "USER_123", "2")
+    archive.add(COOMER_DOMAIN, "onlyfans", "USER_123", "3")
+    assert path.read_text().splitlines() == [f"{COOMER_DOMAIN}/onlyfans/user/USER_123/post/{i}" for i in (1, 2)]
+
+    archive.close()
+    assert len(TextArchive(str(path))) == 3
+
+
+def test_text_archive_compact(tmp_path) -> None:
+    path = tmp_path / "archive.txt"
+    line = f"{COOMER_DOMAIN}/onlyfans/user/USER_123/post/1"
+    path.write_text(f"{line}\nnot a url\n{line}\n")
+
+    TextArchive(str(path)).compact()
+
+    assert path.read_text() == line + "\n"
+
+
+def test_sqlite_archive_import_and_membership(tmp_path) -> None:
+    lines = [f"{COOMER_DOMAIN}/onlyfans/user/USER_123/post/{i}\n" for i in range(5)]
+
+    archive = open_archive(str(tmp_path / "archive.sqlite"))
+    assert isinstance(archive, SQLiteArchive)
+    assert archive.add_urls(lines + ["garbage\n"]) == 5
+    assert archive.add_urls(lines) == 0
+
+    archive.add(COOMER_DOMAIN, "fansly", "USER_456", "9")
+    assert archive_key("fansly", "USER_456", "9") in archive
+    archive.close()
+
+    archive = SQLiteArchive(str(tmp_path / "archive.sqlite"))
+    assert len(archive) == 6
+    assert archive_key("onlyfans", "USER_123", "3") in archive
+    archive.compact()
+    archive.close()
+
+
+def test_sync_marks_persist(tmp_path) -> None:
+    mark = SyncMark("POST_9", "2024-06-04T23:53:36")
+    for path in (tmp_path / "archive.txt", tmp_path / "archive.sqlite"):
+        archive = open_archive(str(path))
+        assert archive.get_sync_mark("onlyfans", "USER_123") is None
+        archive.set_sync_mark("onlyfans", "USER_123", mark)
+        archive.close()
+
+        assert open_archive(str(path)).get_sync_mark("onlyfans", "USER_123") == mark
+
+
+def test_sync_mark_reached() -> None:
+    mark = SyncMark("5", "2024-06-04T23:53:36")
+    assert mark.reached({"id": "5", "published": None})
+    assert mark.reached({"id": "4", "published": "2024-06-01T00:00:00"})
+    assert not mark.reached({"id": "6", "published": "2024-06-05T00:00:00"})
+    assert not mark.reached({"id": "6", "published": None})
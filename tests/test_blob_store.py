@@ -0,0 +1,47 @@
+import hashlib
+import os
+
+import pytest
+
+from kemono_dl.blob_store import BlobStore
+
+
+def add_file(tmp_path, store: BlobStore, content: bytes) -> str:
+    sha256 = hashlib.sha256(content).hexdigest()
+    path = tmp_path / "downloaded.bin"
+    path.write_bytes(content)
+    store.add(str(path), sha256)
+    return sha256
+
+
+def test_add_then_link(tmp_path) -> None:
+    store = BlobStore(str(tmp_path / "blobs"))
+    sha256 = add_file(tmp_path, store, b"hello")
+    target = tmp_path / "out" / "copy.bin"
+    target.parent.mkdir()
+
+    assert sha256 in store
+    assert store.link(sha256, str(target))
+    assert target.read_bytes() == b"hello"
+    assert os.stat(target).st_ino == os.stat(store.blob_path(sha256)).st_ino
+    assert store.linked == 1 and store.stored == 1 and store.saved_bytes == 5
+
+
+def test_link_unknown_hash(tmp_path) -> None:
+    store = BlobStore(str(tmp_path / "blobs"))
+
+    assert not store.link("0" * 64, str(tmp_path / "missing.bin"))
+    assert not (tmp_path / "missing.bin").exists()
+
+
+@pytest.mark.parametrize("link_mode", ["symlink", "copy"])
+def test_link_modes_replace_existing_file(tmp_path, link_mode) -> None:
+    store = BlobStore(str(tmp_path / "blobs"), link_mode)
+    sha256 = add_file(tmp_path, store, b"content")
+    target = tmp_path / "existing.bin"
+    target.write_bytes(b"old")
+
+    assert store.link(sha256, str(target))
+    assert target.read_bytes() == b"content"
+    assert target.is_symlink() == (link_mode == "symlink")
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".link")] == []
@@ -0,0 +1,187 @@
+import hashlib
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from kemono_dl.downloader import DownloadError, download_file, download_file_segmented
+from kemono_dl.session import CustomSession
+
+CONTENT = b"0123456789" * 100
+
+
+def mock_session(status_code: int, body: bytes, chunk_size: int = 64) -> MagicMock:
+    response = MagicMock()
+    response.__enter__.return_value = response
+    response.status_code = status_code
+    response.headers = {"content-length": str(len(body))}
+    response.iter_content.return_value = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)]
+    session = MagicMock()
+    session.get.return_value = response
+    return session
+
+
+def test_download_file_returns_sha256(tmp_path) -> None:
+    filepath = tmp_path / "file.bin"
+    session = mock_session(200, CONTENT)
+
+    result = download_file(session, "http://fake-url.com", str(filepath))
+
+    assert result == hashlib.sha256(CONTENT).hexdigest()
+    assert filepath.read_bytes() == CONTENT
+    assert not (tmp_path / "file.bin.tmp").exists()
+
+
+def test_download_file_resume_hashes_existing_prefix(tmp_path) -> None:
+    filepath = tmp_path / "file.bin"
+    (tmp_path / "file.bin.tmp").write_bytes(CONTENT[:300])
+    session = mock_session(206, CONTENT[300:])
+
+    result = download_file(session, "http://fake-url.com", str(filepath))
+
+    assert result == hashlib.sha256(CONTENT).hexdigest()
+    assert filepath.read_bytes() == CONTENT
+    assert session.get.call_args.kwargs["headers"] == {"Range": "bytes=300-"}
+
+
+def test_download_file_resume_ignored_range_restarts(tmp_path) -> None:
+    filepath = tmp_path / "file.bin"
+    (tmp_path / "file.bin.tmp").write_bytes(b"stale partial data")
+    session = mock_session(200, CONTENT)
+
+    result = download_file(session, "http://fake-url.com", str(filepath))
+
+    assert result == hashlib.sha256(CONTENT).hexdigest()
+    assert filepath.read_bytes() == CONTENT
+
+
+def test_download_file_expected_size_mismatch(tmp_path) -> None:
+    filepath = tmp_path / "file.bin"
+    session = mock_session(200, CONTENT)
+
+    with pytest.raises(DownloadError):
+        download_file(session, "http://fake-url.com", str(filepath), expected_size=len(CONTENT) + 1)
+
+    assert not filepath.exists()
+    session.get.return_value.iter_content.assert_not_called()
+
+
+class RangeSession:
+    """Serves CONTENT and answers Range requests like a data server would."""
+
+    def __init__(self, supports_range: bool = True) -> None:
+        self.supports_range = supports_range
+        self.ranges = []
+        self.plain_requests = 0
+
+    def get(self, url, headers=None, **kwargs) -> MagicMock:
+        body, status_code, response_headers = CONTENT, 200, {"content-length": str(len(CONTENT))}
+        if self.supports_range:
+            response_headers["Accept-Ranges"] = "bytes"
+        if not (headers and "Range" in headers):
+            self.plain_requests += 1
+        elif self.supports_range:
+            start, end = headers["Range"][len("bytes=") :].split("-")
+            start, end = int(start), int(end) if end else len(CONTENT) - 1
+            self.ranges.append((start, end))
+            body, status_code = CONTENT[start : end + 1], 206
+            response_headers = {"content-length": str(len(body)), "Content-Range": f"bytes {start}-{end}/{len(CONTENT)}"}
+        response = MagicMock()
+        response.__enter__.return_value = response
+        response.status_code = status_code
+        response.headers = response_headers
+        response.iter_content.return_value = [body[i : i + 64] for i in range(0, len(body), 64)]
+        return response
+
+
+def test_download_file_segmented(tmp_path) -> None:
+    filepath = tmp_path / "file.bin"
+    session = RangeSession()
+
+    result = download_file_segmented(session, "http://fake-url.com", str(filepath), segments=4, min_size=0)
+
+    assert result == hashlib.sha256(CONTENT).hexdigest()
+    assert filepath.read_bytes() == CONTENT
+    # the first segment is read from the plain request
+    assert session.plain_requests == 1
+    assert sorted(session.ranges) == [(250, 499), (500, 749), (750, 999)]
+    assert not (tmp_path / "file.bin.parts").exists()
+
+
+def test_download_file_segmented_small_file_is_one_request(tmp_path) -> None:
+    filepath = tmp_path / "file.bin"
+    session = RangeSession()
+
+    result = download_file_segmented(session, "http://fake-url.com", str(filepath), segments=4, min_size=len(CONTENT) + 1)
+
+    assert result == hashlib.sha256(CONTENT).hexdigest()
+    assert filepath.read_bytes() == CONTENT
+    assert session.plain_requests == 1 and session.ranges == []
+    assert not (tmp_path / "file.bin.parts").exists()
+
+
+def test_download_file_segmented_resumes_segments(tmp_path) -> None:
+    filepath = tmp_path / "file.bin"
+    partial = bytearray(len(CONTENT))
+    partial[0:250] = CONTENT[0:250]
+    partial[500:600] = CONTENT[500:600]
+    (tmp_path / "file.bin.tmp").write_bytes(bytes(partial))
+    state = {"url": "http://fake-url.com", "size": len(CONTENT), "segments": [[0, 499, 250], [500, 999, 100]]}
+    (tmp_path / "file.bin.parts").write_text(json.dumps(state))
+    session = RangeSession()
+
+    result = download_file_segmented(session, "http://fake-url.com", str(filepath), segments=2, min_size=0)
+
+    assert result == hashlib.sha256(CONTENT).hexdigest()
+    assert sorted(session.ranges) == [(250, 499), (600, 999)]
+
+
+def test_download_file_segmented_falls_back_without_range_support(tmp_path) -> None:
+    filepath = tmp_path / "file.bin"
+
+    session = RangeSession(supports_range=False)
+    result = download_file_segmented(session, "http://fake-url.com", str(filepath), segments=4, min_size=0)
+
+    assert result == hashlib.sha256(CONTENT).hexdigest()
+    assert filepath.read_bytes() == CONTENT
+    assert session.plain_requests == 1
+
+
+def test_download_file_failure_keeps_only_written_bytes(tmp_path) -> None:
+    filepath = tmp_path / "file.bin"
+    session = mock_session(200, CONTENT)
+
+    def broken_stream(chunk_size):
+        yield CONTENT[:100]
+        raise ConnectionError("connection reset")
+
+    session.get.return_value.iter_content.side_effect = broken_stream
+
+    with pytest.raises(ConnectionError):
+        download_file(session, "http://fake-url.com", str(filepath))
+
+    assert (tmp_path / "file.bin.tmp").read_bytes() == CONTENT[:100]
+
+
+def test_download_file_complete_tmp_restarts(tmp_path) -> None:
+    filepath = tmp_path / "file.bin"
+    (tmp_path / "file.bin.tmp").write_bytes(CONTENT)
+    unsatisfiable = mock_session(416, b"").get.return_value
+    complete = mock_session(200, CONTENT).get.return_value
+    session = MagicMock()
+    session.get.side_effect = [unsatisfiable, complete]
+
+    result = download_file(session, "http://fake-url.com", str(filepath))
+
+    assert result == hashlib.sha256(CONTENT).hexdigest()
+    assert filepath.read_bytes() == CONTENT
+    assert session.get.call_args.kwargs["headers"] == {}
+
+
+def test_download_file_reuses_the_connection(tmp_path, keep_alive_server) -> None:
+    session = CustomSession()
+    for i in range(5):
+        sha256 = download_file(session, f"{keep_alive_server.url}/data/{i}.bin", str(tmp_path / f"{i}.bin"))
+        assert sha256 == hashlib.sha256(keep_alive_server.body).hexdigest()
+
+    assert keep_alive_server.connections == 1
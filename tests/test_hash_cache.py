@@ -0,0 +1,37 @@
+import hashlib
+import os
+
+from kemono_dl.hash_cache import HashCache
+
+
+def test_hash_cache_hit_and_invalidation(tmp_path) -> None:
+    fpath = tmp_path / "file.bin"
+    fpath.write_bytes(b"hello world\n")
+    cache = HashCache(str(tmp_path / HashCache.FILENAME))
+
+    assert cache.get_sha256(str(fpath)) == hashlib.sha256(b"hello world\n").hexdigest()
+    assert cache.get_sha256(str(fpath)) == hashlib.sha256(b"hello world\n").hexdigest()
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    fpath.write_bytes(b"changed\n")
+    assert cache.get_sha256(str(fpath)) == hashlib.sha256(b"changed\n").hexdigest()
+    assert (cache.hits, cache.misses) == (1, 2)
+    cache.close()
+
+
+def test_hash_cache_persists_stored_digests(tmp_path) -> None:
+    fpath = tmp_path / "file.bin"
+    fpath.write_bytes(b"data")
+    cache = HashCache(str(tmp_path / HashCache.FILENAME))
+    cache.store(str(fpath), "STORED_HASH")
+    cache.close()
+
+    cache = HashCache(str(tmp_path / HashCache.FILENAME))
+    assert cache.get_sha256(str(fpath)) == "STORED_HASH"
+    cache.close()
+
+    cache = HashCache(str(tmp_path / HashCache.FILENAME), rehash=True)
+    assert cache.get_sha256(str(fpath)) == hashlib.sha256(b"data").hexdigest()
+    assert (cache.hits, cache.misses) == (0, 1)
+    cache.close()
+    assert os.path.exists(tmp_path / HashCache.FILENAME)
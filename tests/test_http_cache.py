@@ -0,0 +1,38 @@
+import json
+from unittest.mock import Mock, patch
+
+from kemono_dl import KemonoDL
+from kemono_dl.http_cache import ResponseCache
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path) -> None:
+    cache = ResponseCache(str(tmp_path / ResponseCache.FILENAME), max_size=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    cache.get("a")
+    cache.put("c", b"1234")
+
+    assert cache.get("b") is None
+    assert cache.get("a").body == b"1234"
+    assert cache.get("c").body == b"1234"
+    cache.close()
+
+
+@patch("kemono_dl.session.requests.Session.get")
+def test_get_api_json_uses_and_revalidates_cache(mock_get, tmp_path) -> None:
+    kemono_dl = KemonoDL(response_cache_file=str(tmp_path / ResponseCache.FILENAME))
+    url = KemonoDL.COOMER_DOMAIN + "/api/v1/SERVICE_123/user/USER_123/posts"
+    body = json.dumps([{"id": "1"}]).encode()
+    mock_get.return_value = Mock(status_code=200, content=body, headers={"ETag": '"v1"'}, json=lambda: json.loads(body))
+
+    assert kemono_dl.get_api_json(url, params={"o": 0}, ttl=60) == [{"id": "1"}]
+    assert kemono_dl.get_api_json(url, params={"o": 0}, ttl=60) == [{"id": "1"}]
+    assert mock_get.call_count == 1
+
+    mock_get.return_value = Mock(status_code=304)
+    assert kemono_dl.get_api_json(url, params={"o": 0}, ttl=0) == [{"id": "1"}]
+    assert mock_get.call_args.kwargs["headers"]["If-None-Match"] == '"v1"'
+
+    cache = kemono_dl.response_cache
+    assert (cache.hits, cache.revalidated, cache.misses) == (1, 1, 1)
+    kemono_dl.close()
@@ -1,4 +1,6 @@
+import hashlib
 import json
+from datetime import datetime
 from http.cookiejar import LoadError
 from unittest.mock import MagicMock, Mock, patch
 
@@ -6,6 +8,7 @@ import pytest
 from requests import HTTPError
 
 from kemono_dl import KemonoDL
+from kemono_dl.archive import SyncMark
 from kemono_dl.models import Creator, FavoriteCreator, ParsedUrl, Post
 
 TEST_DATA_PATH = "tests/data"
@@ -227,3 +230,209 @@ def test_load_cookies_exception(mock_cookiejar_cls, kemono_dl: KemonoDL, capsys)
     mock_jar.load.assert_called_once_with("cookies.txt")
     captured = capsys.readouterr().out
     assert "[Error] Failed to load cookies from cookies.txt" in captured
+
+
+def test_download_post_attachments_concurrent() -> None:
+    with open(f"{TEST_DATA_PATH}/post.json", encoding="utf-8") as f:
+        post = Post(json.load(f))
+    kemono_dl = KemonoDL(concurrent_downloads=4)
+    kemono_dl.download_attachment = Mock(return_value=True)
+
+    kemono_dl.download_post_attachments(KemonoDL.COOMER_DOMAIN, Mock(), post)
+
+    assert kemono_dl.download_attachment.call_count == len(post.attachments)
+    called = sorted(call.args[2].index for call in kemono_dl.download_attachment.call_args_list)
+    assert called == [attachment.index for attachment in post.attachments]
+
+
+def test_download_creators_pipeline() -> None:
+    kemono_dl = KemonoDL(queue_size=2, fetch_workers=3, post_workers=2)
+    post_ids = [str(i) for i in range(20)]
+    kemono_dl.get_creator_posts = Mock(return_value=[{"id": post_id} for post_id in post_ids])
+    kemono_dl.get_post = Mock(side_effect=lambda domain, service, creator_id, post_id: None if post_id == "5" else post_id)
+    kemono_dl.download_post = Mock()
+
+    kemono_dl.download_creators(KemonoDL.COOMER_DOMAIN, [("SERVICE_123", "USER_123")])
+
+    assert kemono_dl.get_post.call_count == len(post_ids)
+    downloaded = sorted((call.args[1] for call in kemono_dl.download_post.call_args_list), key=int)
+    assert downloaded == [post_id for post_id in post_ids if post_id != "5"]
+
+
+def test_download_creators_incremental(tmp_path) -> None:
+    kemono_dl = KemonoDL(archive_file=str(tmp_path / "archive.txt"))
+    pages = [[{"id": str(i), "published": f"2024-01-{i:02d}T00:00:00"} for i in range(25, 0, -1)]]
+    kemono_dl.get_creator_posts = Mock(side_effect=lambda domain, service, creator_id, offset: pages[offset // KemonoDL.POST_STEP_SIZE])
+    kemono_dl.get_post = Mock(side_effect=lambda domain, service, creator_id, post_id: post_id)
+    kemono_dl.download_post = Mock()
+
+    kemono_dl.download_creators(KemonoDL.COOMER_DOMAIN, [("SERVICE_123", "USER_123")])
+    assert kemono_dl.download_post.call_count == 25
+    assert kemono_dl.archive.get_sync_mark("SERVICE_123", "USER_123") == SyncMark("25", "2024-01-25T00:00:00")
+
+    pages[0] = [{"id": "27", "published": "2024-01-27T00:00:00"}, {"id": "26", "published": "2024-01-26T00:00:00"}] + pages[0]
+    kemono_dl.download_post.reset_mock()
+    kemono_dl.download_creators(KemonoDL.COOMER_DOMAIN, [("SERVICE_123", "USER_123")])
+    assert [call.args[1] for call in kemono_dl.download_post.call_args_list] == ["27", "26"]
+
+    kemono_dl.full_rescan = True
+    kemono_dl.download_post.reset_mock()
+    kemono_dl.download_creators(KemonoDL.COOMER_DOMAIN, [("SERVICE_123", "USER_123")])
+    assert kemono_dl.download_post.call_count == 27
+
+
+def test_download_creators_with_post_filters_keeps_sync_mark(tmp_path) -> None:
+    kemono_dl = KemonoDL(archive_file=str(tmp_path / "archive.txt"), post_filters={"dateafter": {"published": datetime(2024, 1, 2)}})
+    kemono_dl.get_creator_posts = Mock(return_value=[{"id": str(i), "published": f"2024-01-{i:02d}T00:00:00"} for i in range(3, 0, -1)])
+    kemono_dl.get_post = Mock(side_effect=lambda domain, service, creator_id, post_id: post_id)
+    kemono_dl.download_post = Mock()
+
+    kemono_dl.download_creators(KemonoDL.COOMER_DOMAIN, [("SERVICE_123", "USER_123")])
+    assert kemono_dl.download_post.call_count == 3
+    # the filtered posts were never archived, a run without the filter has to list them again
+    assert kemono_dl.archive.get_sync_mark("SERVICE_123", "USER_123") is None
+
+
+def test_download_attachment_links_known_hash(tmp_path) -> None:
+    content = b"same file in two posts"
+    sha256 = hashlib.sha256(content).hexdigest()
+    kemono_dl = KemonoDL(path=str(tmp_path), output_templates={"attachments": "{post_id}/{filename}"}, blob_store_dir=str(tmp_path / "blobs"))
+
+    def fetch(attachment, file_path, expected_size=None):
+        with open(file_path, "wb") as f:
+            f.write(content)
+        return sha256
+
+    kemono_dl.fetch_attachment = Mock(side_effect=fetch)
+    creator = Mock(service="SERVICE_123", id="USER_123")
+    creator.name = "creator"
+    for post_id in ("1", "2"):
+        post = Post({"post": {"id": post_id, "file": {"name": "a.png", "path": f"/aa/bb/{sha256}.png"}}, "previews": [{"path": f"/aa/bb/{sha256}.png", "server": "https://n1"}]})
+        assert kemono_dl.download_attachment(creator, post, post.attachments[0])
+
+    assert kemono_dl.fetch_attachment.call_count == 1
+    assert (tmp_path / "2" / "a.png").read_bytes() == content
+    assert kemono_dl.blob_store.linked == 1
+
+
+@pytest.mark.parametrize("link_mode", ["hardlink", "symlink"])
+def test_download_attachment_no_tmp_keeps_stored_blob(tmp_path, link_mode) -> None:
+    contents = {name: name.encode() * 100 for name in ("first", "second", "third")}
+    hashes = {name: hashlib.sha256(content).hexdigest() for name, content in contents.items()}
+    kemono_dl = KemonoDL(path=str(tmp_path), output_templates={"attachments": "{filename}"}, no_tmp=True, blob_store_dir=str(tmp_path / "blobs"), link_mode=link_mode)
+
+    def get(url, **kwargs):
+        body = next(content for name, content in contents.items() if hashes[name] in url)
+        response = MagicMock()
+        response.__enter__.return_value = response
+        response.status_code = 200
+        response.headers = {"content-length": str(len(body))}
+        response.iter_content.return_value = [body]
+        return response
+
+    kemono_dl.session = Mock(get=Mock(side_effect=get))
+    creator = Mock(service="SERVICE_123", id="USER_123")
+    creator.name = "creator"
+
+    def download(post_id: str, name: str) -> None:
+        post = Post({"post": {"id": post_id, "file": {"name": "a.bin", "path": f"/aa/bb/{hashes[name]}.bin"}}, "previews": [{"path": f"/aa/bb/{hashes[name]}.bin", "server": "https://n1"}]})
+        assert kemono_dl.download_attachment(creator, post, post.attachments[0])
+
+    download("1", "first")
+    # the output is linked to the stored first file, the next download to the same path must not write through the link
+    if link_mode == "symlink":
+        kemono_dl.blob_store.link(hashes["first"], str(tmp_path / "a.bin"))
+    download("2", "second")
+    download("3", "first")
+
+    assert (tmp_path / "a.bin").read_bytes() == contents["first"]
+    assert open(kemono_dl.blob_store.blob_path(hashes["first"]), "rb").read() == contents["first"]
+    assert open(kemono_dl.blob_store.blob_path(hashes["second"]), "rb").read() == contents["second"]
+    assert kemono_dl.session.get.call_count == 2
+
+
+def test_download_batch_schedules_creators_together() -> None:
+    kemono_dl = KemonoDL(parallel_creators=3, fetch_workers=2, post_workers=2, max_posts_per_domain=1)
+    sizes = {"BIG": 60, "SMALL1": 2, "SMALL2": 3}
+    kemono_dl.get_creator_posts = Mock(side_effect=lambda domain, service, creator_id, offset: [{"id": f"{creator_id}-{i}"} for i in range(sizes[creator_id])][offset : offset + KemonoDL.POST_STEP_SIZE])
+    kemono_dl.get_post = Mock(side_effect=lambda domain, service, creator_id, post_id: post_id)
+    kemono_dl.download_post = Mock()
+
+    kemono_dl.download_batch(
+        [
+            "https://kemono.cr/patreon/user/BIG",
+            "https://kemono.cr/patreon/user/SMALL1",
+            "https://coomer.st/onlyfans/user/SMALL2",
+            "https://coomer.st/onlyfans/user/OTHER/post/POST_1",
+            "not a url",
+        ]
+    )
+
+    downloaded = [call.args[1] for call in kemono_dl.download_post.call_args_list]
+    assert sorted(downloaded) == sorted([f"{creator_id}-{i}" for creator_id, size in sizes.items() for i in range(size)] + ["POST_1"])
+    # the small creators are not queued behind all of the big one
+    last_small = max(downloaded.index(post_id) for post_id in downloaded if not post_id.startswith("BIG"))
+    assert last_small < len(downloaded) - 10
+
+
+def test_download_batch_downloads_each_post_once(tmp_path) -> None:
+    kemono_dl = KemonoDL(archive_file=str(tmp_path / "archive.txt"), fetch_workers=2, post_workers=2)
+    # a post pushed onto the next page while listing shows up twice
+    posts = [{"id": post_id, "published": f"2024-01-0{post_id}T00:00:00"} for post_id in ("3", "2", "2", "1")]
+    kemono_dl.get_creator_posts = Mock(return_value=posts)
+    kemono_dl.get_post = Mock(side_effect=lambda domain, service, creator_id, post_id: post_id)
+    kemono_dl.download_post = Mock()
+
+    kemono_dl.download_batch(
+        [
+            "https://kemono.cr/patreon/user/USER_123",
+            "https://kemono.cr/patreon/user/USER_123/post/2",
+            "https://kemono.cr/patreon/user/USER_123",
+        ]
+    )
+
+    assert sorted(call.args[1] for call in kemono_dl.download_post.call_args_list) == ["1", "2", "3"]
+    # the creator is listed once
+    assert kemono_dl.get_creator_posts.call_count == 1
+    assert kemono_dl.archive.get_sync_mark("patreon", "USER_123") == SyncMark("3", "2024-01-03T00:00:00")
+
+
+def test_manifest_lists_written_files_per_url(tmp_path) -> None:
+    kemono_dl = KemonoDL(path=str(tmp_path), output_templates={"content": "{creator_id}/{post_id}/{filename}"}, track_written=True)
+    creator = Mock(service="patreon", id="USER_123")
+    creator.name = "creator"
+    (tmp_path / "USER_123").mkdir()
+    for post_id in ("1", "2"):
+        kemono_dl.write_post_content(creator, Post({"post": {"id": post_id, "user": "USER_123", "service": "patreon", "content": post_id}}))
+
+    post_url = "https://kemono.cr/patreon/user/USER_123/post/1"
+    assert kemono_dl.written_by_url(post_url) == {"files": [str(tmp_path / "USER_123" / "1" / "content.html")], "directories": [str(tmp_path / "USER_123" / "1")]}
+
+    manifest = tmp_path / "manifest.jsonl"
+    kemono_dl.write_manifest(str(manifest), [post_url, "https://kemono.cr/patreon/user/USER_123"])
+    entries = [json.loads(line) for line in manifest.read_text(encoding="utf-8").splitlines()]
+    assert [entry["url"] for entry in entries] == [post_url, "https://kemono.cr/patreon/user/USER_123"]
+    assert len(entries[1]["files"]) == 2 and len(entries[1]["directories"]) == 2
+
+
+def test_metrics_count_skipped_posts_and_files(tmp_path) -> None:
+    kemono_dl = KemonoDL(path=str(tmp_path), output_templates={"content": "{post_id}/{filename}"})
+    creator = Mock(service="patreon", id="USER_123")
+    creator.name = "creator"
+    post = Post({"post": {"id": "1", "user": "USER_123", "service": "patreon", "content": "hello"}})
+    kemono_dl.write_post_content(creator, post)
+    kemono_dl.write_post_content(creator, post)
+    kemono_dl.write_archive_file(KemonoDL.KEMONO_DOMAIN, "patreon", "USER_123", "1")
+    kemono_dl.download_post(KemonoDL.KEMONO_DOMAIN, post)
+
+    assert kemono_dl.metrics.value("files_written_total") == 1
+    assert kemono_dl.metrics.value("files_skipped_total", reason="hash") == 1
+    assert kemono_dl.metrics.value("posts_skipped_total", reason="archive") == 1
+    assert kemono_dl.metrics.value("phase_calls_total", phase="hash") == 1
+
+
+def test_post_matches_filters_parses_only_filtered_dates(capsys) -> None:
+    post = Post({"post": {"id": "1", "added": "bad", "published": "2024-01-05T00:00:00", "edited": None}})
+    assert not KemonoDL().post_matches_filters(post)
+    assert KemonoDL(post_filters={"dateafter": {"published": datetime(2024, 1, 6)}}).post_matches_filters(post)
+    assert capsys.readouterr().out == ""
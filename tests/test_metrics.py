@@ -0,0 +1,39 @@
+import json
+
+from kemono_dl.metrics import Metrics
+
+
+def test_metrics_prometheus_textfile(tmp_path) -> None:
+    prometheus_file = tmp_path / "kemono_dl.prom"
+    metrics = Metrics(prometheus_file=str(prometheus_file), interval=3600)
+    metrics.count("http_requests_total", kind="api", status="200")
+    metrics.count("http_requests_total", kind="api", status="200")
+    metrics.count("files_skipped_total", reason='say "hi"')
+    metrics.observe("downloaded_bytes_total", lambda: 12345678901)
+    with metrics.phase("fetch"):
+        pass
+    metrics.close()
+
+    text = prometheus_file.read_text(encoding="utf-8")
+    assert "# TYPE kemono_dl_http_requests_total counter" in text
+    assert 'kemono_dl_http_requests_total{kind="api",status="200"} 2' in text
+    assert 'kemono_dl_files_skipped_total{reason="say \\"hi\\""} 1' in text
+    assert "kemono_dl_downloaded_bytes_total 12345678901" in text
+    assert 'kemono_dl_phase_calls_total{phase="fetch"} 1' in text
+    assert metrics.value("http_requests_total", kind="api", status="200") == 2
+    assert metrics.summary().startswith("Time spent: fetch 0.0s")
+
+
+def test_metrics_event_log(tmp_path) -> None:
+    event_log = tmp_path / "events.jsonl"
+    metrics = Metrics(event_log=str(event_log), interval=3600)
+    metrics.event("file_skipped", reason="hash", path="a.png")
+    metrics.count("files_skipped_total", reason="hash")
+    metrics.close()
+    # events after close are dropped instead of reopening the log
+    metrics.event("post_done", post_id="1")
+
+    events = [json.loads(line) for line in event_log.read_text(encoding="utf-8").splitlines()]
+    assert [event["event"] for event in events] == ["file_skipped", "metrics"]
+    assert events[0]["reason"] == "hash" and events[0]["path"] == "a.png"
+    assert events[1]["counters"] == {"files_skipped_total{reason=hash}": 1}
@@ -0,0 +1,103 @@
+from datetime import datetime
+from unittest.mock import patch
+
+from kemono_dl.models import Attachment, Creator, CustomTemplateVariables, FileTemplateVaribales, Post
+from kemono_dl.utils import generate_file_path
+
+POST = {
+    "id": "1",
+    "user": "42",
+    "service": "patreon",
+    "title": "Title",
+    "content": "",
+    "added": "2024-01-01T00:00:00",
+    "published": "2024-01-01T00:00:00",
+    "edited": "2024-01-01T00:00:00",
+    "file": {},
+    "attachments": [],
+}
+
+
+def make_variables(post: Post, index: int) -> FileTemplateVaribales:
+    creator = Creator(
+        id="42", name="Creator", service="patreon", indexed=0, updated=0, public_id="creator",
+        relation_id=None, post_count=None, dm_count=None, share_count=None, chat_count=None,
+    )
+    attachment = Attachment(name=f"file{index}.png", path=f"/aa/bb/hash{index}.png", server="https://n1.kemono.su", index=index)
+    return FileTemplateVaribales(creator, post, attachment)
+
+
+def test_custom_variables_match_plain_eval() -> None:
+    post = Post({"post": POST, "attachments": [], "previews": []})
+    variables = make_variables(post, 3)
+    custom = {"short_title": "'{post_title}'[:3]", "padded": "'{index}'.zfill(4)", "both": "'{short_title}-{padded}'"}
+
+    result = variables.toDict(CustomTemplateVariables(custom))
+
+    assert result["short_title"] == "Tit"
+    assert result["padded"] == "0003"
+    assert result["both"] == "Tit-0003"
+    assert result == variables.toDict(custom)
+
+
+def test_post_only_custom_variables_are_evaluated_once_per_post() -> None:
+    post = Post({"post": POST, "attachments": [], "previews": []})
+    custom = CustomTemplateVariables({"short_title": "'{post_title}'[:3]", "padded": "'{index}'.zfill(4)"})
+
+    with patch("kemono_dl.models.eval", create=True, side_effect=eval) as mock_eval:
+        results = [make_variables(post, i).toDict(custom) for i in range(5)]
+
+    assert [result["padded"] for result in results] == ["0000", "0001", "0002", "0003", "0004"]
+    assert all(result["short_title"] == "Tit" for result in results)
+    assert mock_eval.call_count == 1 + 5
+
+
+def test_post_without_file_key() -> None:
+    post = Post({"post": {key: value for key, value in POST.items() if key != "file"}})
+
+    assert post.attachments == []
+
+
+def test_post_attachment_servers_and_names_come_from_the_response_index() -> None:
+    data = dict(POST, file={"path": "/aa/bb/main.png"}, attachments=[{"name": "a.zip", "path": "/cc/dd/a.zip"}, {"path": "/ee/ff/b.png"}])
+    post = Post(
+        {
+            "post": data,
+            "attachments": [{"server": "https://n2.kemono.su", "name": "a.zip", "path": "/cc/dd/a.zip"}],
+            "previews": [
+                {"server": "https://n1.kemono.su", "name": "main.png", "path": "/aa/bb/main.png"},
+                {"server": "https://n3.kemono.su", "name": "b.png", "path": "/ee/ff/b.png"},
+                {"server": "https://n4.kemono.su", "name": "other.zip", "path": "/cc/dd/a.zip"},
+            ],
+        }
+    )
+
+    assert post.attachments == [
+        Attachment(name="main.png", path="/aa/bb/main.png", index=0, server="https://n1.kemono.su"),
+        Attachment(name="a.zip", path="/cc/dd/a.zip", index=1, server="https://n2.kemono.su"),
+        Attachment(name="b.png", path="/ee/ff/b.png", index=2, server="https://n3.kemono.su"),
+    ]
+
+
+def test_post_dates_are_parsed_on_first_access(capsys) -> None:
+    post = Post({"post": dict(POST, edited=None)})
+
+    assert capsys.readouterr().out == ""
+    assert post.published == datetime(2024, 1, 1)
+    assert post.edited == datetime.min
+    assert "Invalid isoformat string for `edited`" in capsys.readouterr().out
+
+
+def test_template_variables_parse_only_the_dates_used(capsys) -> None:
+    post = Post({"post": dict(POST, edited=None, added="not a date")})
+    variables = make_variables(post, 0)
+
+    assert generate_file_path("/out", "{service}/{post_id}/{filename}", variables.toDict()) == "/out/patreon/1/file0.png"
+    assert capsys.readouterr().out == ""
+
+    result = variables.toDict({"year": "{published:%Y}"})
+    assert result["year"] == 2024 and result["published"] == datetime(2024, 1, 1)
+    assert generate_file_path("/out", "{published:%Y-%m}/{filename}", variables.toDict()) == "/out/2024-01/file0.png"
+    assert capsys.readouterr().out == ""
+    assert variables.edited == datetime.min
+    assert "Invalid isoformat string for `edited`" in capsys.readouterr().out
@@ -0,0 +1,72 @@
+import threading
+
+from kemono_dl.pipeline import _DONE, FairQueue
+
+
+def test_fair_queue_round_robin() -> None:
+    fair_queue = FairQueue(maxsize=10)
+    for i in range(4):
+        fair_queue.put("big", "kemono", f"big-{i}")
+    fair_queue.put("small", "kemono", "small-0")
+    fair_queue.put("other", "coomer", "other-0")
+    fair_queue.close()
+
+    items = []
+    while (item := fair_queue.get())[1] is not _DONE:
+        items.append(item[1])
+        fair_queue.task_done(item[0])
+
+    assert items == ["big-0", "small-0", "other-0", "big-1", "big-2", "big-3"]
+
+
+def test_fair_queue_group_limit() -> None:
+    fair_queue = FairQueue(maxsize=10, group_limit=1)
+    fair_queue.put("a", "kemono", "a-0")
+    fair_queue.put("b", "kemono", "b-0")
+    fair_queue.put("c", "coomer", "c-0")
+
+    assert fair_queue.get() == ("kemono", "a-0")
+    # kemono is at its limit, so the coomer item is handed out first
+    assert fair_queue.get() == ("coomer", "c-0")
+
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(fair_queue.get()))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+    fair_queue.task_done("kemono")
+    waiter.join(1)
+    assert got == [("kemono", "b-0")]
+
+
+def test_fair_queue_put_blocks_per_key() -> None:
+    fair_queue = FairQueue(maxsize=1)
+    fair_queue.put("a", None, 1)
+    # another key still has room
+    fair_queue.put("b", None, 2)
+
+    blocked = threading.Thread(target=fair_queue.put, args=("a", None, 3))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+    assert fair_queue.get() == (None, 1)
+    blocked.join(1)
+    assert not blocked.is_alive()
+    assert fair_queue.qsize() == 2
+
+
+def test_fair_queue_put_blocks_on_total_size() -> None:
+    fair_queue = FairQueue(maxsize=2, total_size=3)
+    fair_queue.put("a", None, 1)
+    fair_queue.put("b", None, 2)
+    fair_queue.put("c", None, 3)
+
+    # "d" has no items yet, but the queue as a whole is full
+    blocked = threading.Thread(target=fair_queue.put, args=("d", None, 4))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+    assert fair_queue.get() == (None, 1)
+    blocked.join(1)
+    assert not blocked.is_alive()
+    assert fair_queue.qsize() == 3
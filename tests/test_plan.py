@@ -0,0 +1,85 @@
+import json
+from unittest.mock import Mock
+
+from requests import HTTPError
+
+from kemono_dl import KemonoDL
+from kemono_dl.archive import archive_key
+from kemono_dl.models import Post
+from kemono_dl.plan import PlanWriter, read_plan
+
+POST_ENTRY = {"domain": KemonoDL.KEMONO_DOMAIN, "service": "patreon", "creator_id": "USER_123", "post_id": "1"}
+
+
+def attachment_entry(tmp_path, name: str) -> dict:
+    return {
+        "type": "attachment",
+        **POST_ENTRY,
+        "url": f"https://n1.kemono.su/data/aa/bb/{name}",
+        "server": "https://n1.kemono.su",
+        "path": f"/aa/bb/{name}",
+        "name": name,
+        "file_path": str(tmp_path / name),
+        "sha256": name,
+        "size": None,
+    }
+
+
+def test_plan_writer_sizes_and_blocks(tmp_path) -> None:
+    def head(url, allow_redirects):
+        if url.endswith("missing"):
+            return Mock(raise_for_status=Mock(side_effect=HTTPError("404")))
+        return Mock(headers={"Content-Length": "10"})
+
+    plan_file = tmp_path / "plan.jsonl"
+    planner = PlanWriter(str(plan_file), Mock(head=Mock(side_effect=head)), workers=2)
+    planner.write_post(POST_ENTRY, [attachment_entry(tmp_path, "a"), attachment_entry(tmp_path, "missing")])
+    planner.write_post(dict(POST_ENTRY, post_id="2"), [])
+    planner.close()
+
+    blocks = list(read_plan(str(plan_file)))
+    assert [post_entry["post_id"] for post_entry, _ in blocks] == ["1", "2"]
+    assert [entry["size"] for entry in blocks[0][1]] == [10, None]
+    assert blocks[1][1] == []
+    assert planner.files == 2 and planner.total_size == 10 and planner.unknown_sizes == 1
+
+
+def test_download_plan_archives_complete_posts(tmp_path) -> None:
+    plan_file = tmp_path / "plan.jsonl"
+    lines = [attachment_entry(tmp_path, "a"), {"type": "content", **POST_ENTRY, "file_path": str(tmp_path / "content.html"), "sha256": "c", "size": 2, "content": "hi"}, {"type": "post", **POST_ENTRY}]
+    lines += [dict(attachment_entry(tmp_path, "b"), post_id="2"), {"type": "post", **POST_ENTRY, "post_id": "2"}]
+    plan_file.write_text("".join(json.dumps(line) + "\n" for line in lines), encoding="utf-8")
+
+    kemono_dl = KemonoDL(path=str(tmp_path), concurrent_downloads=2, archive_file=str(tmp_path / "archive.txt"))
+    kemono_dl.get_post = Mock()
+
+    def fetch(attachment, file_path, expected_size=None):
+        if attachment.name == "b":
+            return None
+        with open(file_path, "w") as f:
+            f.write(attachment.name)
+        return attachment.name
+
+    kemono_dl.fetch_attachment = Mock(side_effect=fetch)
+    kemono_dl.download_plan(str(plan_file))
+
+    assert (tmp_path / "a").read_text() == "a"
+    assert (tmp_path / "content.html").read_text(encoding="utf-8") == "hi"
+    assert archive_key("patreon", "USER_123", "1") in kemono_dl.archive
+    assert archive_key("patreon", "USER_123", "2") not in kemono_dl.archive
+    kemono_dl.get_post.assert_not_called()
+
+
+def test_plan_run_keeps_sync_marks(tmp_path) -> None:
+    kemono_dl = KemonoDL(path=str(tmp_path), archive_file=str(tmp_path / "archive.txt"), plan_file=str(tmp_path / "plan.jsonl"))
+    posts = [{"id": post_id, "user": "USER_123", "service": "patreon", "published": f"2024-01-0{post_id}T00:00:00"} for post_id in "321"]
+    kemono_dl.get_creator_posts = Mock(return_value=posts)
+    kemono_dl.get_post = Mock(side_effect=lambda domain, service, creator_id, post_id: Post({"post": next(post for post in posts if post["id"] == post_id)}))
+    kemono_dl.get_creator_profile = Mock()
+
+    kemono_dl.download_creators(KemonoDL.KEMONO_DOMAIN, [("patreon", "USER_123")])
+    kemono_dl.close()
+
+    assert [post_entry["post_id"] for post_entry, _ in read_plan(str(tmp_path / "plan.jsonl"))] == ["3", "2", "1"]
+    assert kemono_dl.get_sync_mark("patreon", "USER_123") is None
+    assert len(kemono_dl.archive) == 0
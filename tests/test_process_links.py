@@ -0,0 +1,149 @@
+import json
+import zipfile
+
+import process_links
+from process_links import StreamingBundler
+
+
+def make_files(base_dir, files: dict[str, bytes]) -> None:
+    for name, content in files.items():
+        path = base_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+
+def test_bundler_stores_media_and_deflates_text(tmp_path) -> None:
+    base_dir = tmp_path / "download_base"
+    files = {
+        "post/image.jpg": bytes(range(256)) * 64,
+        "post/content.html": b"<p>hello</p>\n" * 2000,
+        "post/notes.txt": b"",
+        "other/video.mp4": b"\x00\x01" * 5000,
+        "other/page.html": "<p>你好</p>".encode() * 100,
+    }
+    make_files(base_dir, files)
+
+    bundler = StreamingBundler(str(base_dir), str(tmp_path / "bundles"), target_size=None)
+    for item in ("post", "other"):
+        bundler.add_item(str(base_dir / item))
+    bundles = bundler.close()
+
+    assert len(bundles) == 1
+    with zipfile.ZipFile(bundles[0]) as zipf:
+        assert zipf.testzip() is None
+        assert {info.filename: info.compress_type for info in zipf.infolist()} == {
+            "post/image.jpg": zipfile.ZIP_STORED,
+            "post/content.html": zipfile.ZIP_DEFLATED,
+            # deflating an empty file makes it larger
+            "post/notes.txt": zipfile.ZIP_STORED,
+            "other/video.mp4": zipfile.ZIP_STORED,
+            "other/page.html": zipfile.ZIP_DEFLATED,
+        }
+        for name, content in files.items():
+            assert zipf.read(name) == content
+        assert zipf.getinfo("post/content.html").compress_size < len(files["post/content.html"])
+
+
+def test_bundler_writes_zip64_and_streamed_entries(tmp_path, monkeypatch) -> None:
+    # small limits, so the zip64 records and the streamed deflate are written without gigabytes of data
+    monkeypatch.setattr(process_links, "ZIP64_LIMIT", 1000)
+    monkeypatch.setattr(process_links, "MAX_IN_MEMORY_DEFLATE", 3000)
+    base_dir = tmp_path / "download_base"
+    files = {
+        "item/small.html": b"<p>small</p>" * 10,
+        "item/large.html": b"<p>large enough to be compressed in memory</p>" * 50,
+        "item/streamed.txt": b"too large for memory, compressed by the writer\n" * 200,
+        "item/video.mp4": bytes(range(256)) * 20,
+        "item/名前.jpg": bytes(2000),
+    }
+    make_files(base_dir, files)
+
+    bundler = StreamingBundler(str(base_dir), str(tmp_path / "bundles"), target_size=None, workers=2)
+    bundler.add_item(str(base_dir / "item"))
+    bundles = bundler.close()
+
+    with zipfile.ZipFile(bundles[0]) as zipf:
+        assert zipf.testzip() is None
+        assert sorted(zipf.namelist()) == sorted(files)
+        for name, content in files.items():
+            assert zipf.read(name) == content
+        assert zipf.getinfo("item/streamed.txt").compress_type == zipfile.ZIP_DEFLATED
+
+
+def bundle_names(bundles: list[str]) -> list[list[str]]:
+    names = []
+    for bundle in bundles:
+        with zipfile.ZipFile(bundle) as zipf:
+            assert zipf.testzip() is None
+            names.append(zipf.namelist())
+    return names
+
+
+def test_bundler_cuts_bundles_at_target_size(tmp_path) -> None:
+    base_dir = tmp_path / "download_base"
+    make_files(base_dir, {f"{item}/image.jpg": bytes(400) for item in ("a", "b", "c")})
+
+    bundler = StreamingBundler(str(base_dir), str(tmp_path / "bundles"), target_size=1000)
+    for item in ("a", "b", "c"):
+        bundler.add_item(str(base_dir / item))
+    bundles = bundler.close()
+
+    assert [bundle.rsplit("/", 1)[1] for bundle in bundles] == ["bundle-001.zip", "bundle-002.zip"]
+    assert bundle_names(bundles) == [["a/image.jpg", "b/image.jpg"], ["c/image.jpg"]]
+
+
+def test_bundler_keeps_items_whole_unless_split(tmp_path) -> None:
+    base_dir = tmp_path / "download_base"
+    make_files(base_dir, {f"big/{i}.jpg": bytes(400) for i in range(3)} | {"small/image.jpg": bytes(400)})
+
+    bundler = StreamingBundler(str(base_dir), str(tmp_path / "whole"), target_size=1000)
+    for item in ("big", "small"):
+        bundler.add_item(str(base_dir / item))
+    # the item outgrows the target size, but stays in one bundle
+    assert bundle_names(bundler.close()) == [["big/0.jpg", "big/1.jpg", "big/2.jpg"], ["small/image.jpg"]]
+
+    bundler = StreamingBundler(str(base_dir), str(tmp_path / "split"), target_size=1000, split_items=True)
+    for item in ("big", "small"):
+        bundler.add_item(str(base_dir / item))
+    assert bundle_names(bundler.close()) == [["big/0.jpg", "big/1.jpg"], ["big/2.jpg", "small/image.jpg"]]
+
+
+def test_bundler_interleaved_items_continue_in_next_bundle(tmp_path) -> None:
+    base_dir = tmp_path / "download_base"
+    make_files(base_dir, {f"{item}/{i}.jpg": bytes(400) for item in ("a", "b", "c") for i in range(2)})
+
+    bundler = StreamingBundler(str(base_dir), str(tmp_path / "bundles"), target_size=1000)
+    # files of different items arrive interleaved, as with concurrent downloads
+    for name in ("a/0.jpg", "b/0.jpg", "c/0.jpg", "a/1.jpg", "c/1.jpg", "b/1.jpg"):
+        bundler.add(str(base_dir / name))
+    # the first bundle is closed when c arrives, so the rest of a and b goes to the next one
+    assert bundle_names(bundler.close()) == [["a/0.jpg", "b/0.jpg"], ["c/0.jpg", "a/1.jpg", "c/1.jpg"], ["b/1.jpg"]]
+
+
+def test_bundler_resumes_queued_files_from_index(tmp_path) -> None:
+    base_dir = tmp_path / "download_base"
+    make_files(base_dir, {"a/image.jpg": b"a" * 100, "b/page.html": b"b" * 100})
+    index_file = tmp_path / "bundles" / "index.jsonl"
+
+    bundler = StreamingBundler(str(base_dir), str(tmp_path / "bundles"), index_file=str(index_file))
+    bundler.add(str(base_dir / "a" / "image.jpg"))
+    assert bundler.close() == [str(tmp_path / "bundles" / "bundle-001.zip")]
+
+    # the run was interrupted after queueing b, while writing the next line
+    with open(index_file, "a", encoding="utf-8") as f:
+        f.write('{"event": "queued", "path": "b/page.html"}\n{"event": "bund')
+
+    bundler = StreamingBundler(str(base_dir), str(tmp_path / "bundles"), index_file=str(index_file))
+    # already bundled, so not bundled again
+    bundler.add(str(base_dir / "a" / "image.jpg"))
+    bundles = bundler.close()
+
+    assert bundles == [str(tmp_path / "bundles" / "bundle-002.zip")]
+    assert bundle_names(bundles) == [["b/page.html"]]
+
+    # entries are not appended to the truncated line
+    lines = index_file.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["event"] for line in lines if line != '{"event": "bund'] == ["queued", "bundled", "queued", "queued", "bundled"]
+    # nothing is left to resume
+    bundler = StreamingBundler(str(base_dir), str(tmp_path / "bundles"), index_file=str(index_file))
+    assert bundler.close() == []
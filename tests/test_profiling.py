@@ -0,0 +1,50 @@
+import pstats
+import threading
+
+from kemono_dl.profiling import TIMERS, FunctionTimers, RunProfiler, timed
+
+
+def test_function_timers_table() -> None:
+    timers = FunctionTimers(max_samples=50)
+    for i in range(100):
+        timers.record("fast", 0.001)
+    timers.record("slow", 2.0)
+    timers.record("slow", 4.0)
+
+    lines = timers.table(top=1)
+    assert len(lines) == 2
+    assert lines[1].split() == ["slow", "2", "6.00s", "3.00s", "4.00s"]
+    assert timers.table()[2].split() == ["fast", "100", "100.0ms", "1.0ms", "1.0ms"]
+
+
+def test_timed_records_only_when_enabled() -> None:
+    @timed
+    def work(x: int) -> int:
+        return x * 2
+
+    assert work(2) == 4
+    assert "work" not in "\n".join(TIMERS.table())
+
+    TIMERS.enabled = True
+    try:
+        assert work(3) == 6
+    finally:
+        TIMERS.enabled = False
+    assert any(line.split()[:2] == ["test_timed_records_only_when_enabled.<locals>.work", "1"] for line in TIMERS.table(top=100))
+    TIMERS.reset()
+
+
+def _profiled_in_thread() -> int:
+    return sum(range(1000))
+
+
+def test_run_profiler_includes_threads(tmp_path) -> None:
+    profiler = RunProfiler(str(tmp_path / "run.pstats"))
+    profiler.start()
+    thread = threading.Thread(target=_profiled_in_thread)
+    thread.start()
+    thread.join()
+    profiler.stop()
+
+    stats = pstats.Stats(str(tmp_path / "run.pstats"))
+    assert any(function == "_profiled_in_thread" for _, _, function in stats.stats)  # type: ignore[attr-defined]
@@ -0,0 +1,20 @@
+from kemono_dl.progress import ProgressTracker
+
+
+def test_progress_tracker_render() -> None:
+    tracker = ProgressTracker(isatty=True)
+    assert tracker.render() is None
+
+    first = tracker.start_transfer("a.png", total=1000)
+    first.downloaded += 250
+    assert tracker.render().startswith("[downloading]  25.00% of 1000.00 B")
+
+    second = tracker.start_transfer("b.png", total=0)
+    tracker.queue_depth = lambda: 3
+    second.downloaded += 100
+    assert "2 active" in tracker.render() and "350.00 B received, 3 posts queued" in tracker.render()
+
+    tracker.finish_transfer(first)
+    tracker.finish_transfer(second)
+    assert tracker.render() is None
+    tracker.close()
@@ -0,0 +1,97 @@
+from unittest.mock import Mock, patch
+
+import pytest
+import requests
+
+from kemono_dl.session import CustomSession, RateLimiter, parse_retry_after
+
+
+def response(status_code: int, headers: dict | None = None) -> Mock:
+    return Mock(status_code=status_code, ok=status_code < 400, headers=headers or {})
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        (None, None),
+        ("", None),
+        ("3", 3.0),
+        ("-1", 0.0),
+        ("Wed, 21 Oct 2015 07:28:00 GMT", 0.0),
+        ("soon", None),
+    ],
+)
+def test_parse_retry_after(value, expected) -> None:
+    assert parse_retry_after(value) == expected
+
+
+def test_rate_limiter_backs_off_and_recovers() -> None:
+    limiter = RateLimiter(rate=4.0, min_rate=1.0, max_rate=5.0, increase=0.5)
+
+    assert limiter.update("kemono.cr", response(429, {"Retry-After": "2"})) == 2.0
+    assert limiter.update("kemono.cr", response(503)) == 1.0
+    assert limiter._buckets["kemono.cr"].rate == 1.0
+
+    for _ in range(10):
+        assert limiter.update("kemono.cr", response(200)) is None
+    assert limiter._buckets["kemono.cr"].rate == 5.0
+    assert limiter._buckets["kemono.cr"].throttled == 2
+
+
+@patch("kemono_dl.session.time.sleep")
+def test_rate_limiter_waits_when_bucket_is_empty(mock_sleep) -> None:
+    limiter = RateLimiter(rate=2.0, burst=1.0)
+
+    assert limiter.acquire("kemono.cr") == 0
+    assert limiter.acquire("kemono.cr") == pytest.approx(0.5, abs=0.05)
+    assert limiter.acquire("coomer.st") == 0
+    mock_sleep.assert_called_once()
+
+
+@patch("kemono_dl.session.time.sleep")
+@patch("kemono_dl.session.requests.Session.request")
+def test_custom_session_retries_throttled_requests(mock_request, mock_sleep) -> None:
+    mock_request.side_effect = [response(429, {"Retry-After": "1"}), response(200)]
+    session = CustomSession(rate_limiter=RateLimiter())
+
+    result = session.get("https://kemono.cr/api/v1/account")
+
+    assert result.status_code == 200
+    assert mock_request.call_count == 2
+    assert any(call.args[0] > 0.9 for call in mock_sleep.call_args_list)
+
+
+def test_transport_adapter_host_pool_sizes() -> None:
+    session = CustomSession(pool_maxsize=7, host_pool_sizes={"kemono.cr": 3})
+
+    api_request = requests.Request("GET", "https://kemono.cr/api/v1/account").prepare()
+    data_request = requests.Request("GET", "https://n1.kemono.cr/data/file.png").prepare()
+
+    assert session.adapter.build_connection_pool_key_attributes(api_request, True)[1]["maxsize"] == 3
+    assert "maxsize" not in session.adapter.build_connection_pool_key_attributes(data_request, True)[1]
+    assert session.adapter.poolmanager.connection_pool_kw["maxsize"] == 7
+
+
+@patch("kemono_dl.session.requests.Session.request")
+def test_custom_session_default_timeout(mock_request) -> None:
+    mock_request.return_value = response(200)
+    session = CustomSession(connect_timeout=5, read_timeout=30)
+
+    session.get("https://kemono.cr/api/v1/account")
+    session.get("https://kemono.cr/api/v1/account", timeout=1)
+
+    assert mock_request.call_args_list[0].kwargs["timeout"] == (5, 30)
+    assert mock_request.call_args_list[1].kwargs["timeout"] == 1
+
+
+def test_connection_counts_count_sockets_dialed(keep_alive_server) -> None:
+    session = CustomSession()
+    for _ in range(3):
+        session.get(keep_alive_server.url).content
+    assert session.adapter.connection_counts() == (1, 3)
+
+    # a response closed before its body was read drops its socket, the next request dials again
+    with session.get(keep_alive_server.url, stream=True):
+        pass
+    session.get(keep_alive_server.url).content
+    assert session.adapter.connection_counts() == (keep_alive_server.connections, 5) == (2, 5)
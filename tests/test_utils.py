@@ -1,10 +1,10 @@
 import hashlib
 from pathlib import Path
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, Mock
 
 import pytest
 
-from kemono_dl.utils import format_bytes, generate_file_path, get_sha256_hash, get_sha256_url_content
+from kemono_dl.utils import decode_json, format_bytes, generate_file_path, get_sha256_hash, get_sha256_url_content
 
 
 def test_get_sha256_hash(tmp_path) -> None:
@@ -82,3 +82,19 @@ def test_generate_file_path_restirc_name_and_replacement() -> None:
     )
     assert "-" in result
     assert "\x01" not in result and ":" not in result
+
+
+def test_generate_file_path_sanitizes_constant_segments() -> None:
+    result = generate_file_path(
+        base_path="/base",
+        output_template="a:b/{name}/c. ",
+        template_variables={"name": "x?y"},
+    )
+    assert result == str(Path("/base/a_b/x_y/c"))
+
+
+def test_decode_json_bytes_and_fallback() -> None:
+    assert decode_json(Mock(content=b'{"a": [1, "\\u00e9"]}')) == {"a": [1, "é"]}
+    assert decode_json(Mock(json=lambda: {"b": 2})) == {"b": 2}
+    with pytest.raises(ValueError):
+        decode_json(Mock(content=b"<html>"))